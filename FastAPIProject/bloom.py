@@ -0,0 +1,44 @@
+import hashlib
+import math
+import threading
+
+
+class CountingBloomFilter:
+    """Compact probabilistic set that also supports removals.
+
+    `x in f` is False only if x was never added (or was removed); a True answer
+    is wrong with probability of roughly `error_rate` at `capacity` items.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._counters = bytearray(self.size)
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        with self._lock:
+            for position in self._positions(item):
+                if self._counters[position] < 255:
+                    self._counters[position] += 1
+
+    def remove(self, item: str):
+        with self._lock:
+            positions = self._positions(item)
+            if not all(self._counters[position] for position in positions):
+                return
+            for position in positions:
+                # Saturated counters stay put, they no longer know their real count
+                if 0 < self._counters[position] < 255:
+                    self._counters[position] -= 1
+
+    def __contains__(self, item: str):
+        counters = self._counters
+        return all(counters[position] for position in self._positions(item))
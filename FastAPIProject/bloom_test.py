@@ -0,0 +1,31 @@
+import unittest
+
+from bloom import CountingBloomFilter
+
+
+class TestCountingBloomFilter(unittest.TestCase):
+    def test_added_items_are_members(self):
+        bloom = CountingBloomFilter(capacity=1000)
+        codes = [f"CODE{i}" for i in range(1000)]
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+
+    def test_false_positive_rate_is_bounded(self):
+        bloom = CountingBloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(f"CODE{i}")
+        false_positives = sum(f"GUESS{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_remove(self):
+        bloom = CountingBloomFilter(capacity=100)
+        bloom.add("SUMMER10")
+        bloom.add("WINTER20")
+        bloom.remove("SUMMER10")
+        self.assertNotIn("SUMMER10", bloom)
+        self.assertIn("WINTER20", bloom)
+
+
+if __name__ == '__main__':
+    unittest.main()
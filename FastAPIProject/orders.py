@@ -1,9 +1,13 @@
-from datetime import datetime, timedelta
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional
 from uuid import UUID
 from uuid import uuid4
 
 from cassandra.cluster import Cluster
+from cassandra.query import ValueSequence
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
 
@@ -15,6 +19,9 @@ from typing import Dict
 
 
 from user_2 import get_current_user
+from bloom import CountingBloomFilter
+from cache import TTLCache
+from pricing import UnknownItemError, from_cents, price_basket, to_cents
 
 # Initialize FastAPI app
 app = FastAPI(title="Order Microservice")
@@ -35,6 +42,125 @@ def get_db_session():
     return session
 
 
+# Discounts are written with a Cassandra TTL derived from expires_at, so expired
+# codes disappear on their own. Active codes are cached until they expire, capped
+# so that deletions made by other instances are picked up.
+DISCOUNT_CACHE_MAX_TTL_SECONDS = int(os.getenv("DISCOUNT_CACHE_MAX_TTL_SECONDS", "300"))
+discount_cache = TTLCache(ttl=DISCOUNT_CACHE_MAX_TTL_SECONDS, max_size=100000)
+
+
+# Bloom filter of active discount codes so guessed codes are rejected without a
+# database scan. Built at startup, rebuilt periodically to shed expired codes, and
+# kept up to date by create_discount_code/delete_discount_code_admin in between.
+# Codes created by other instances (or the order service's POST /discounts) are
+# listed in discount_codes_by_day; a filter miss reads the codes created since
+# the last read from there, at most once every DISCOUNT_FILTER_CATCH_UP_SECONDS.
+# Misses in between are rejected in memory, so guessed codes never reach the
+# database more often than that; a code made elsewhere may be turned away for
+# up to that long.
+DISCOUNT_FILTER_REBUILD_SECONDS = int(os.getenv("DISCOUNT_FILTER_REBUILD_SECONDS", "600"))
+DISCOUNT_FILTER_CATCH_UP_SECONDS = int(os.getenv("DISCOUNT_FILTER_CATCH_UP_SECONDS", "5"))
+DISCOUNT_FILTER_CLOCK_SKEW_SECONDS = 5  # how far behind another instance's created_at may be
+discount_filter = None  # None until the first load, then every lookup is checked
+discount_filter_pending = None  # codes created while a rebuild is scanning
+discount_filter_since = None  # codes created after this are read on a filter miss
+discount_filter_caught_up = 0.0  # time.monotonic() of the last rebuild or catch-up
+
+
+def rebuild_discount_filter(db):
+    global discount_filter, discount_filter_pending, discount_filter_since, discount_filter_caught_up
+    discount_filter_pending = []
+    caught_up = time.monotonic()
+    now = datetime.utcnow()
+    rows = db.execute("SELECT discount_code, expires_at FROM discounts_by_code")
+    codes = [row.discount_code for row in rows if row.expires_at and row.expires_at > now]
+    new_filter = CountingBloomFilter(capacity=max(len(codes) * 2, 100000))
+    for code in codes:
+        new_filter.add(code)
+    for code in discount_filter_pending:
+        new_filter.add(code)
+    discount_filter_since = now
+    discount_filter_caught_up = caught_up
+    discount_filter = new_filter
+    discount_filter_pending = None
+
+
+def catch_up_discount_filter(db):
+    # Adds the codes created since discount_filter_since, one partition per day
+    global discount_filter_since, discount_filter_caught_up
+    discount_filter_caught_up = time.monotonic()
+    since = discount_filter_since - timedelta(seconds=DISCOUNT_FILTER_CLOCK_SKEW_SECONDS)
+    latest = discount_filter_since
+    day = since.date()
+    while day <= datetime.utcnow().date():
+        rows = db.execute(
+            "SELECT created_at, discount_code FROM discount_codes_by_day WHERE day = %s AND created_at > %s",
+            [day, since],
+        )
+        for row in rows:
+            discount_filter.add(row.discount_code)
+            latest = max(latest, row.created_at)
+        day += timedelta(days=1)
+    discount_filter_since = latest
+
+
+def list_new_discount_code(db, discount_code, created_at, ttl_seconds):
+    db.execute(
+        "INSERT INTO discount_codes_by_day (day, created_at, discount_code) VALUES (%s, %s, %s) USING TTL %s",
+        [created_at.date(), created_at, discount_code, ttl_seconds],
+    )
+
+
+def add_to_discount_filter(discount_code):
+    if discount_filter_pending is not None:
+        discount_filter_pending.append(discount_code)
+    if discount_filter is not None:
+        discount_filter.add(discount_code)
+
+
+def load_discount_filter():
+    db = get_db_session()
+    try:
+        rebuild_discount_filter(db)
+    finally:
+        db.cluster.shutdown()
+
+
+async def refresh_discount_filter_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(load_discount_filter)
+        except Exception as e:
+            print(f"Failed to rebuild discount filter: {str(e)}")
+        await asyncio.sleep(DISCOUNT_FILTER_REBUILD_SECONDS)
+
+
+@app.on_event("startup")
+async def start_discount_filter():
+    asyncio.create_task(refresh_discount_filter_periodically())
+
+
+def get_active_discount(db, discount_code):
+    if discount_filter is not None and discount_code not in discount_filter:
+        if time.monotonic() - discount_filter_caught_up < DISCOUNT_FILTER_CATCH_UP_SECONDS:
+            return None
+        catch_up_discount_filter(db)
+        if discount_code not in discount_filter:
+            return None
+    discount = discount_cache.get(discount_code)
+    if discount is None:
+        query = "SELECT * FROM discounts_by_code WHERE discount_code = %s"
+        discount = db.execute(query, [discount_code]).one()
+        if not discount:
+            return None
+        # Rows written before discounts had a TTL can still be past their expiry
+        seconds_left = (discount.expires_at - datetime.utcnow()).total_seconds()
+        if seconds_left <= 0:
+            return None
+        discount_cache.set(discount_code, discount, ttl=min(seconds_left, DISCOUNT_CACHE_MAX_TTL_SECONDS))
+    return discount
+
+
 # Models
 class CartItem(BaseModel):
     product_id: str
@@ -227,6 +353,22 @@ async def remove_from_cart(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def cart_price(session, products, discount_percentage=None):
+    # Cart products are keyed by item id strings; returns the PriceBreakdown in cents
+    if not products:
+        return price_basket({}, {}, discount_percentage)
+    rows = session.execute(
+        "SELECT item_id, price FROM items WHERE item_id IN %s",
+        [ValueSequence([UUID(item_id) for item_id in products])],
+    )
+    unit_prices = {str(row.item_id): to_cents(row.price) for row in rows}
+    return price_basket(products, unit_prices, discount_percentage)
+
+
+def cart_total(session, products, discount_percentage=None):
+    return cart_price(session, products, discount_percentage).total
+
+
 @app.get("/get_cart")
 async def get_cart(
         current_user: UUID = Depends(get_current_user),
@@ -242,11 +384,18 @@ async def get_cart(
         if not cart:
             return {"message": "Cart is empty", "items": {}}
 
+        try:
+            # A discount applied with /apply_discounts is stored as its percentage
+            total_price = float(from_cents(cart_total(session, cart.products, int(cart.discount or 0))))
+        except UnknownItemError:
+            # An item was taken off its menu after it was added to the cart
+            total_price = None
+
         return OrderResponse(
             order_id=cart.order_id,
             customer_id=cart.customer_id,
             products=cart.products,
-            total_price=cart.total_price,
+            total_price=total_price,
             status=cart.status,
             created_at=cart.created_at
         )
@@ -385,24 +534,48 @@ async def create_discount_code(
     if not user_result or user_result.admin != 1:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    # Check if discount code already exists
-    query = "SELECT * FROM discounts WHERE discount_code = %s ALLOW FILTERING"
-    existing_discount = session.execute(query, [discount.discount_code]).one()
-    if existing_discount:
+    discount_id = uuid4()
+    created_at = datetime.utcnow()
+    expired_at = discount.expires_at or created_at + timedelta(days=30)
+    if expired_at.tzinfo is not None:
+        expired_at = expired_at.astimezone(timezone.utc).replace(tzinfo=None)
+    ttl_seconds = int((expired_at - created_at).total_seconds())
+    if ttl_seconds <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Discount expiry must be in the future"
+        )
+    # discounts_by_code is keyed by the code, so IF NOT EXISTS is the uniqueness
+    # check, the same one POST /discounts in the order service uses. Cassandra
+    # drops both rows once the code expires.
+    query = """
+        INSERT INTO discounts_by_code (
+            discount_code, discount_id, discount_percentage, created_by,
+            created_at, expires_at
+        ) VALUES (%s, %s, %s, %s, %s, %s)
+        IF NOT EXISTS
+        USING TTL %s
+    """
+    result = session.execute(query, [
+        discount.discount_code,
+        discount_id,
+        discount.discount_percentage,
+        current_user,
+        created_at,
+        expired_at,
+        ttl_seconds
+    ])
+    if not result.was_applied:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Discount code already exists"
         )
-
-    discount_id = uuid4()
-    created_at = datetime.utcnow()
-    expired_at = created_at + timedelta(days=30)
-    # Insert new discount code
     query = """
         INSERT INTO discounts (
             discount_id, created_by, discount_code, created_at, 
             discount_percentage, expires_at
         ) VALUES (%s, %s, %s, %s, %s, %s)
+        USING TTL %s
     """
     session.execute(query, [
         discount_id,
@@ -410,8 +583,11 @@ async def create_discount_code(
         discount.discount_code,
         created_at,
         discount.discount_percentage,
-        expired_at
+        expired_at,
+        ttl_seconds
     ])
+    list_new_discount_code(session, discount.discount_code, created_at, ttl_seconds)
+    add_to_discount_filter(discount.discount_code)
 
     return DiscountResponse(
         discount_id=discount_id,
@@ -436,7 +612,7 @@ async def delete_discount_code_admin(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     # Check if discount exists
-    query = "SELECT * FROM discounts WHERE discount_code = %s ALLOW FILTERING"
+    query = "SELECT discount_id, expires_at FROM discounts_by_code WHERE discount_code = %s"
     discount = session.execute(query, [discount_code]).one()
     if not discount:
         raise HTTPException(
@@ -444,36 +620,27 @@ async def delete_discount_code_admin(
             detail="Discount code not found"
         )
 
-    # Delete the discount code
-    query = "DELETE FROM discounts WHERE discount_id = %s"
-    session.execute(query, [discount.discount_id])
+    # Delete the discount code from both tables; checkout reads discounts_by_code
+    session.execute("DELETE FROM discounts_by_code WHERE discount_code = %s", [discount_code])
+    session.execute("DELETE FROM discounts WHERE discount_id = %s", [discount.discount_id])
+    discount_cache.invalidate(discount_code)
+    # Only active codes were added to the filter; removing anything else would
+    # clear counters that belong to other codes
+    if discount_filter is not None and discount.expires_at > datetime.utcnow():
+        discount_filter.remove(discount_code)
 
     return {"message": f"Discount code '{discount_code}' has been deleted"}
 
 
 
-def delete_expired_discounts(db):
-    query = "SELECT * FROM discounts"
-    discounts = db.execute(query)
-
-    for discount in discounts:
-        if discount.expires_at < datetime.utcnow():
-            delete_query = "DELETE FROM discounts WHERE discount_id = %s"
-            db.execute(delete_query, [discount.discount_id])
-
-
 @app.get("/apply_discounts")
 async def apply_discount_code(
         discount_code: str,
         current_user: UUID = Depends(get_current_user),
         db=Depends(get_db_session)
 ):
-    # Remove expired discounts from the database
-    delete_expired_discounts(db)
-
-    # Get discount details
-    query = "SELECT * FROM discounts WHERE discount_code = %s ALLOW FILTERING"
-    discount = db.execute(query, [discount_code]).one()
+    # Get discount details; expired codes are gone thanks to the row TTL
+    discount = get_active_discount(db, discount_code)
 
     if not discount:
         raise HTTPException(
@@ -498,10 +665,15 @@ async def apply_discount_code(
             detail="A discount is already applied to this cart"
         )
 
-    cart_total = cart_result.total_price
-    # Calculate discounted amount and final price
-    discount_amount = (cart_total * discount.discount_percentage) / 100
-    final_price = cart_total - discount_amount
+    # Priced from the current menu, the same way get_cart shows it
+    try:
+        price = cart_price(db, cart_result.products, discount.discount_percentage)
+    except UnknownItemError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Item {e.item_id} is no longer on the menu"
+        )
+    final_price = from_cents(price.total)
 
     # Update the database with the discount and updated total price
     update_query = """
@@ -512,9 +684,9 @@ async def apply_discount_code(
     db.execute(update_query, [discount.discount_percentage, final_price, cart_result.order_id])
 
     return {
-        "original_price": cart_total,
+        "original_price": from_cents(price.subtotal),
         "discount_percentage": discount.discount_percentage,
-        "discount_amount": discount_amount,
+        "discount_amount": from_cents(price.discount),
         "final_price": final_price
     }
 
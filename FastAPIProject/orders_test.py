@@ -0,0 +1,114 @@
+import asyncio
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import Mock, patch
+from uuid import uuid4
+
+import orders
+
+Listed = namedtuple("Listed", ["created_at", "discount_code"])
+Code = namedtuple("Code", ["discount_code", "expires_at"])
+Discount = namedtuple("Discount", ["discount_code", "discount_percentage", "expires_at"])
+Cart = namedtuple("Cart", ["order_id", "customer_id", "products", "total_price", "status", "created_at", "discount"])
+Item = namedtuple("Item", ["item_id", "price"])
+
+
+class TestDiscountFilter(unittest.TestCase):
+    def setUp(self):
+        self.listed = []
+        self.discounts = {}
+        self.db = Mock()
+        self.db.execute.side_effect = self.execute
+        orders.discount_cache.clear()
+        orders.rebuild_discount_filter(self.db)
+
+    def execute(self, query, params=None):
+        result = Mock()
+        if "FROM discount_codes_by_day" in query:
+            return [row for row in self.listed if row.created_at.date() == params[0] and row.created_at > params[1]]
+        if "FROM discounts_by_code WHERE" in query:
+            result.one.return_value = self.discounts.get(params[0])
+            return result
+        return []
+
+    def wait_for_catch_up(self):
+        orders.discount_filter_caught_up -= orders.DISCOUNT_FILTER_CATCH_UP_SECONDS
+
+    def listed_reads(self):
+        return [call for call in self.db.execute.call_args_list if "FROM discount_codes_by_day" in call.args[0]]
+
+    def create_elsewhere(self, code):
+        # A code created by another instance after this one built its filter
+        expires_at = datetime.utcnow() + timedelta(days=1)
+        self.listed.append(Listed(datetime.utcnow(), code))
+        self.discounts[code] = Discount(code, 10, expires_at)
+
+    def test_unknown_code_is_rejected(self):
+        self.assertIsNone(orders.get_active_discount(self.db, "GUESS123"))
+
+    def test_code_created_on_another_instance_is_accepted(self):
+        self.create_elsewhere("SPRING10")
+        self.wait_for_catch_up()
+        self.assertEqual(orders.get_active_discount(self.db, "SPRING10").discount_percentage, 10)
+        self.assertIn("SPRING10", orders.discount_filter)
+
+    def test_catch_up_reads_only_recent_codes(self):
+        self.create_elsewhere("SPRING10")
+        self.wait_for_catch_up()
+        orders.get_active_discount(self.db, "GUESS123")
+        self.assertIn("SPRING10", orders.discount_filter)
+        self.listed[0] = Listed(self.listed[0].created_at, "OLDCODE")
+        orders.discount_filter_since += timedelta(seconds=orders.DISCOUNT_FILTER_CLOCK_SKEW_SECONDS + 1)
+        self.wait_for_catch_up()
+        orders.get_active_discount(self.db, "GUESS123")
+        self.assertNotIn("OLDCODE", orders.discount_filter)
+
+    def test_misses_between_catch_ups_stay_in_memory(self):
+        for _ in range(100):
+            self.assertIsNone(orders.get_active_discount(self.db, "GUESS123"))
+        self.assertEqual(self.listed_reads(), [])
+        self.wait_for_catch_up()
+        for _ in range(100):
+            orders.get_active_discount(self.db, "GUESS123")
+        self.assertEqual(len(self.listed_reads()), 1)
+
+
+class TestCart(unittest.TestCase):
+    def setUp(self):
+        self.first, self.second = uuid4(), uuid4()
+        self.cart = Cart(uuid4(), uuid4(), {str(self.first): 2, str(self.second): 1}, Decimal("99.00"), "cart",
+                         datetime.utcnow(), 0)
+        self.db = Mock()
+        self.db.execute.side_effect = self.execute
+
+    def execute(self, query, params=None):
+        result = Mock()
+        if "FROM items" in query:
+            return [Item(self.first, Decimal("10.05")), Item(self.second, Decimal("3.10"))]
+        result.one.return_value = self.cart
+        return result
+
+    def test_cart_total_includes_applied_discount(self):
+        self.assertEqual(asyncio.run(orders.get_cart(self.cart.customer_id, self.db)).total_price, 23.2)
+        self.cart = self.cart._replace(discount=Decimal("15"))
+        # 23.20 less 15% (3.48)
+        self.assertEqual(asyncio.run(orders.get_cart(self.cart.customer_id, self.db)).total_price, 19.72)
+
+    def test_apply_discount_prices_the_cart_like_get_cart(self):
+        discount = Discount("SPRING15", 15, datetime.utcnow() + timedelta(days=1))
+        with patch.object(orders, "get_active_discount", return_value=discount):
+            applied = asyncio.run(orders.apply_discount_code("SPRING15", self.cart.customer_id, self.db))
+        self.assertEqual(applied["original_price"], Decimal("23.20"))
+        self.assertEqual(applied["discount_amount"], Decimal("3.48"))
+        self.assertEqual(applied["final_price"], Decimal("19.72"))
+        update = self.db.execute.call_args_list[-1]
+        self.assertIn("UPDATE orders", update.args[0])
+        self.assertEqual(update.args[1], [15, Decimal("19.72"), self.cart.order_id])
+        self.cart = self.cart._replace(discount=Decimal("15"))
+        self.assertEqual(asyncio.run(orders.get_cart(self.cart.customer_id, self.db)).total_price, 19.72)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,7 +25,9 @@ CREATE TABLE IF NOT EXISTS customers (
     created_at TIMESTAMP,
     password TEXT,
     admin INT,
-    worker INT
+    worker INT,
+    restaurant_id UUID,
+    delivery_person_id UUID
 );
 
 CREATE TABLE IF NOT EXISTS restaurants (
@@ -36,7 +38,8 @@ CREATE TABLE IF NOT EXISTS restaurants (
     address TEXT,
     opening_hours MAP<TEXT, TEXT>,
     delivery_people MAP<UUID, TEXT>,
-    created_at TIMESTAMP
+    created_at TIMESTAMP,
+    deleted_at TIMESTAMP
 );
 
 CREATE TABLE IF NOT EXISTS delivery_people (
@@ -46,13 +49,33 @@ CREATE TABLE IF NOT EXISTS delivery_people (
     created_at TIMESTAMP
 );
 
+CREATE TABLE IF NOT EXISTS couriers_by_restaurant (
+    restaurant_id UUID,
+    delivery_person_id UUID,
+    status TEXT,
+    assigned_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (restaurant_id, delivery_person_id)
+);
+
+CREATE TABLE IF NOT EXISTS courier_locations (
+    delivery_person_id UUID,
+    bucket TIMESTAMP,
+    recorded_at TIMESTAMP,
+    latitude DOUBLE,
+    longitude DOUBLE,
+    PRIMARY KEY ((delivery_person_id, bucket), recorded_at)
+) WITH CLUSTERING ORDER BY (recorded_at DESC)
+  AND compaction = {'class': 'TimeWindowCompactionStrategy', 'compaction_window_unit': 'DAYS', 'compaction_window_size': 1};
+
 CREATE TABLE IF NOT EXISTS items (
     item_id UUID PRIMARY KEY,
     restaurant_id UUID,
     name TEXT,
     description TEXT,
     price DECIMAL,
-    created_at TIMESTAMP
+    created_at TIMESTAMP,
+    deleted_at TIMESTAMP
 );
 
 CREATE TABLE IF NOT EXISTS orders (
@@ -72,7 +95,11 @@ CREATE TABLE IF NOT EXISTS orders (
     delivery_time TIMESTAMP,
     estimated_delivery_time TIMESTAMP,
     delivery_person_name TEXT,
-    delivery_person_phone TEXT
+    delivery_person_phone TEXT,
+    delivery_distance_km DOUBLE,
+    item_prices MAP<UUID, DECIMAL>,
+    discount_percentage INT,
+    discount_code TEXT
 );
 
 CREATE TABLE IF NOT EXISTS discounts (
@@ -84,6 +111,106 @@ CREATE TABLE IF NOT EXISTS discounts (
     expires_at TIMESTAMP
 );
 
+CREATE TABLE IF NOT EXISTS discounts_by_code (
+    discount_code TEXT PRIMARY KEY,
+    discount_id UUID,
+    discount_percentage INT,
+    created_by UUID,
+    created_at TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS discount_codes_by_day (
+    day DATE,
+    created_at TIMESTAMP,
+    discount_code TEXT,
+    PRIMARY KEY (day, created_at, discount_code)
+);
+
+CREATE TABLE IF NOT EXISTS menu_versions (
+    restaurant_id UUID PRIMARY KEY,
+    version COUNTER
+);
+
+CREATE TABLE IF NOT EXISTS order_idempotency (
+    customer_id UUID,
+    idempotency_key TEXT,
+    order_id UUID,
+    request_hash TEXT,
+    response TEXT,
+    created_at TIMESTAMP,
+    PRIMARY KEY ((customer_id, idempotency_key))
+);
+
+CREATE TABLE IF NOT EXISTS order_intake (
+    order_id UUID PRIMARY KEY,
+    customer_id UUID,
+    request TEXT,
+    status TEXT,
+    result TEXT,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS restaurant_prep_times (
+    restaurant_id UUID PRIMARY KEY,
+    prep_minutes DOUBLE,
+    samples INT,
+    updated_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS order_status_history (
+    order_id UUID,
+    changed_at TIMESTAMP,
+    status TEXT,
+    changed_by UUID,
+    PRIMARY KEY (order_id, changed_at)
+);
+
+CREATE TABLE IF NOT EXISTS orders_by_restaurant_status (
+    restaurant_id UUID,
+    day DATE,
+    created_at TIMESTAMP,
+    order_id UUID,
+    customer_id UUID,
+    status TEXT,
+    products MAP<UUID, INT>,
+    delivery_method TEXT,
+    address TEXT,
+    estimated_delivery_time TIMESTAMP,
+    PRIMARY KEY ((restaurant_id, day), created_at, order_id)
+) WITH default_time_to_live = 604800
+  AND compaction = {'class': 'TimeWindowCompactionStrategy', 'compaction_window_unit': 'DAYS', 'compaction_window_size': 1};
+
+CREATE TABLE IF NOT EXISTS orders_by_customer (
+    customer_id UUID,
+    created_at TIMESTAMP,
+    order_id UUID,
+    restaurant_id UUID,
+    status TEXT,
+    total_price DECIMAL,
+    item_count INT,
+    PRIMARY KEY (customer_id, created_at, order_id)
+) WITH CLUSTERING ORDER BY (created_at DESC, order_id DESC);
+
+CREATE TABLE IF NOT EXISTS purge_queue (
+    day DATE,
+    kind TEXT,
+    id UUID,
+    PRIMARY KEY (day, kind, id)
+);
+
+// CREATE TABLE IF NOT EXISTS leaves tables of an existing keyspace as they are,
+// so columns added after a table was first created are added here as well
+ALTER TABLE customers ADD IF NOT EXISTS restaurant_id UUID;
+ALTER TABLE customers ADD IF NOT EXISTS delivery_person_id UUID;
+ALTER TABLE restaurants ADD IF NOT EXISTS deleted_at TIMESTAMP;
+ALTER TABLE items ADD IF NOT EXISTS deleted_at TIMESTAMP;
+ALTER TABLE orders ADD IF NOT EXISTS delivery_distance_km DOUBLE;
+ALTER TABLE orders ADD IF NOT EXISTS item_prices MAP<UUID, DECIMAL>;
+ALTER TABLE orders ADD IF NOT EXISTS discount_percentage INT;
+ALTER TABLE orders ADD IF NOT EXISTS discount_code TEXT;
+
 "
 
 echo "✅ Tables and keyspace created!"
@@ -0,0 +1,142 @@
+"""Archived orders as gzip-compressed JSON lines on local disk.
+
+Orders are stored under <root>/<day>/<restaurant_id>.jsonl.gz, one file per
+day (of created_at) and restaurant. Each write appends one gzip member per
+file, so a file is still a plain .jsonl.gz to zcat or gzip.open, while a single
+order can be read back by decompressing only the member that holds it.
+
+Where that is lives in the index: <root>/index/<first two hex digits of the
+order id>.tsv, one line per order with its file, member offset and length and
+its line in the member. Index lines are appended after the data is on disk,
+so an order is never indexed before it can be read. Writers take <root>/.lock,
+so the order service's purge and archive_orders.py can write at the same time.
+
+Shards only ever grow, so the last index_cache_size shards read are kept in
+memory and later lookups only read the lines appended since.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+try:
+    import fcntl
+except ImportError:  # Windows: only one writer at a time there
+    fcntl = None
+
+
+def to_json(value):
+    # Cassandra rows hold UUIDs, Decimals and datetimes, also as map keys
+    if isinstance(value, dict):
+        return {str(key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_json(item) for item in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    return value
+
+
+class OrderArchive:
+    def __init__(self, root, index_cache_size=16):
+        self.root = root
+        self.index_cache_size = index_cache_size
+        # shard path -> (bytes read, {order_id: (path, offset, length, line)})
+        self._index_cache = OrderedDict()
+        self._index_lock = threading.Lock()
+
+    def _index_path(self, order_id):
+        return os.path.join(self.root, "index", f"{str(order_id)[:2]}.tsv")
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _lookup(self, shard_path, order_ids):
+        # Index entries of those order_ids that are in the shard; a later line wins
+        with self._index_lock:
+            read, entries = self._index_cache.pop(shard_path, (0, {}))
+            try:
+                with open(shard_path, "rb") as index:
+                    if os.fstat(index.fileno()).st_size < read:
+                        read, entries = 0, {}
+                    index.seek(read)
+                    appended = index.read()
+                # A line still being written is read next time
+                appended = appended[:appended.rfind(b"\n") + 1]
+                read += len(appended)
+                for line in appended.decode().splitlines():
+                    order_id, path, offset, length, number = line.split("\t")
+                    entries[order_id] = (path, int(offset), int(length), int(number))
+            except FileNotFoundError:
+                pass
+            self._index_cache[shard_path] = (read, entries)
+            while len(self._index_cache) > self.index_cache_size:
+                self._index_cache.popitem(last=False)
+            return {order_id: entries[order_id] for order_id in order_ids if order_id in entries}
+
+    def write(self, orders):
+        """Append orders (dicts with order_id, restaurant_id and created_at)."""
+        groups = defaultdict(list)
+        for order in orders:
+            groups[(order["created_at"].date(), order["restaurant_id"])].append(order)
+        if not groups:
+            return
+
+        with self._write_lock():
+            self._write(groups)
+
+    def _write(self, groups):
+        index_lines = defaultdict(list)
+        for (day, restaurant_id), group in groups.items():
+            path = os.path.join(day.isoformat(), f"{restaurant_id}.jsonl.gz")
+            full_path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            member = gzip.compress("".join(json.dumps(to_json(order)) + "\n" for order in group).encode())
+            with open(full_path, "ab") as archive_file:
+                offset = archive_file.tell()
+                archive_file.write(member)
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+            for number, order in enumerate(group):
+                index_lines[self._index_path(order["order_id"])].append(
+                    f"{order['order_id']}\t{path}\t{offset}\t{len(member)}\t{number}\n"
+                )
+
+        for shard_path, lines in index_lines.items():
+            os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+            with open(shard_path, "a") as index:
+                index.writelines(lines)
+                index.flush()
+                os.fsync(index.fileno())
+
+    def archived(self, order_ids):
+        """The subset of order_ids that is in the archive, as strings."""
+        shards = defaultdict(set)
+        for order_id in order_ids:
+            shards[self._index_path(order_id)].add(str(order_id))
+        found = set()
+        for shard_path, wanted in shards.items():
+            found |= self._lookup(shard_path, wanted).keys()
+        return found
+
+    def get(self, order_id):
+        """The archived order as a dict of JSON values, None if it is not archived."""
+        entry = self._lookup(self._index_path(order_id), [str(order_id)]).get(str(order_id))
+        if entry is None:
+            return None
+        path, offset, length, number = entry
+        with open(os.path.join(self.root, path), "rb") as archive_file:
+            archive_file.seek(offset)
+            member = archive_file.read(length)
+        return json.loads(gzip.decompress(member).decode().splitlines()[number])
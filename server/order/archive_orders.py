@@ -0,0 +1,96 @@
+"""Move delivered and canceled orders older than --older-than-days to the archive.
+
+Reads orders page by page, writes the old closed ones (with their status
+history) to ORDER_ARCHIVE_DIR (see archive.py) and only then deletes them from
+orders and order_status_history, --delete-batch orders at a time with
+--pause seconds in between so compaction and live reads keep up. Orders
+already in the archive are not written again, so a run that was interrupted
+between archiving and deleting can simply be repeated or continued with
+--resume. orders_by_customer keeps its summary rows, so archived orders
+stay in GET /orders and can still be tracked by id. Canceled orders are
+usually archived much earlier, by the order service's purge.
+
+    python archive_orders.py [--older-than-days 90] [--page-size 500] [--delete-batch 100] [--pause 0.5] [--resume HEX]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+from archive import OrderArchive
+from order_status import CLOSED_ORDER_STATUSES
+
+
+def archive_rows(session, archive, rows, concurrency=50):
+    # Writes rows of orders with their status history, except those already archived
+    already_archived = archive.archived([row.order_id for row in rows])
+    new = [row for row in rows if str(row.order_id) not in already_archived]
+    histories = execute_concurrent_with_args(
+        session,
+        "SELECT changed_at, status, changed_by FROM order_status_history WHERE order_id = %s",
+        [(row.order_id,) for row in new],
+        concurrency=concurrency,
+    )
+    archive.write([
+        dict(row._asdict(), history=[change._asdict() for change in history])
+        for row, (_, history) in zip(new, histories)
+    ])
+
+
+def archive_orders(session, archive, older_than, page_size, delete_batch, pause, paging_state=None):
+    select = SimpleStatement("SELECT * FROM orders", fetch_size=page_size)
+    delete_order = session.prepare("DELETE FROM orders WHERE order_id = ?")
+    delete_history = session.prepare("DELETE FROM order_status_history WHERE order_id = ?")
+
+    scanned = archived = 0
+    while True:
+        result = session.execute(select, paging_state=paging_state)
+        rows = result.current_rows
+        due = [
+            row for row in rows
+            if row.created_at and row.created_at < older_than and row.status in CLOSED_ORDER_STATUSES
+        ]
+        archive_rows(session, archive, due)
+
+        for start in range(0, len(due), delete_batch):
+            order_ids = [(row.order_id,) for row in due[start:start + delete_batch]]
+            execute_concurrent_with_args(session, delete_order, order_ids, concurrency=delete_batch)
+            execute_concurrent_with_args(session, delete_history, order_ids, concurrency=delete_batch)
+            time.sleep(pause)
+
+        scanned += len(rows)
+        archived += len(due)
+        paging_state = result.paging_state
+        print(f"{scanned} orders scanned, {archived} archived"
+              + (f", resume with --resume {paging_state.hex()}" if paging_state else ""))
+        if not paging_state:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--older-than-days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "90")))
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--delete-batch", type=int, default=100, help="orders deleted at a time")
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds to wait after each delete batch")
+    parser.add_argument("--resume", help="paging state printed by a previous run")
+    args = parser.parse_args()
+
+    cluster = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4)
+    session = cluster.connect("pantastic")
+    try:
+        archive_orders(
+            session,
+            OrderArchive(os.getenv("ORDER_ARCHIVE_DIR", "order-archive")),
+            datetime.utcnow() - timedelta(days=args.older_than_days),
+            args.page_size,
+            args.delete_batch,
+            args.pause,
+            bytes.fromhex(args.resume) if args.resume else None,
+        )
+    finally:
+        cluster.shutdown()
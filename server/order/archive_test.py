@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from uuid import UUID, uuid4
+
+from archive import OrderArchive
+
+
+def make_order(restaurant_id, created_at, **columns):
+    return {"order_id": uuid4(), "restaurant_id": restaurant_id, "created_at": created_at,
+            "status": "Delivered", **columns}
+
+
+class OrderArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = OrderArchive(self.directory.name)
+        self.restaurant_id = uuid4()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_archived_order(self):
+        item_id = uuid4()
+        order = make_order(self.restaurant_id, datetime(2025, 3, 1, 12, 30),
+                           products={item_id: 2}, total_price=Decimal("12.50"))
+        self.archive.write([order, make_order(self.restaurant_id, datetime(2025, 3, 1, 13))])
+        archived = self.archive.get(order["order_id"])
+        self.assertEqual(archived["order_id"], str(order["order_id"]))
+        self.assertEqual(archived["products"], {str(item_id): 2})
+        self.assertEqual(archived["total_price"], "12.50")
+        self.assertEqual(archived["created_at"], "2025-03-01T12:30:00")
+        self.assertIsNone(self.archive.get(uuid4()))
+
+    def test_files_per_day_and_restaurant(self):
+        other_restaurant = uuid4()
+        self.archive.write([
+            make_order(self.restaurant_id, datetime(2025, 3, 1, 9)),
+            make_order(self.restaurant_id, datetime(2025, 3, 2, 9)),
+            make_order(other_restaurant, datetime(2025, 3, 1, 9)),
+        ])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, "2025-03-01"))),
+                         sorted([f"{self.restaurant_id}.jsonl.gz", f"{other_restaurant}.jsonl.gz"]))
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, "2025-03-02")),
+                         [f"{self.restaurant_id}.jsonl.gz"])
+
+    def test_appended_writes_stay_readable(self):
+        first = [make_order(self.restaurant_id, datetime(2025, 3, 1, hour)) for hour in (8, 9)]
+        second = [make_order(self.restaurant_id, datetime(2025, 3, 1, hour)) for hour in (10, 11)]
+        self.archive.write(first)
+        self.archive.write(second)
+        for order in first + second:
+            self.assertEqual(self.archive.get(order["order_id"])["order_id"], str(order["order_id"]))
+        # Still one .jsonl.gz with every order, for tools that read whole files
+        path = os.path.join(self.directory.name, "2025-03-01", f"{self.restaurant_id}.jsonl.gz")
+        with gzip.open(path, "rt") as archive_file:
+            self.assertEqual([json.loads(line)["order_id"] for line in archive_file],
+                             [str(order["order_id"]) for order in first + second])
+
+    def test_archived(self):
+        order = make_order(self.restaurant_id, datetime(2025, 3, 1, 9))
+        self.archive.write([order])
+        missing = uuid4()
+        self.assertEqual(self.archive.archived([order["order_id"], missing]), {str(order["order_id"])})
+
+    def test_cached_index_sees_other_writers(self):
+        first = make_order(self.restaurant_id, datetime(2025, 3, 1, 9))
+        self.archive.write([first])
+        self.assertIsNotNone(self.archive.get(first["order_id"]))
+        # Written by another process, e.g. archive_orders.py next to the service
+        second = make_order(self.restaurant_id, datetime(2025, 3, 1, 10))
+        # Same index shard as the first order
+        second["order_id"] = UUID(str(first["order_id"])[:2] + str(second["order_id"])[2:])
+        OrderArchive(self.directory.name).write([second])
+        self.assertEqual(self.archive.get(second["order_id"])["order_id"], str(second["order_id"]))
+        self.assertEqual(self.archive.get(first["order_id"])["order_id"], str(first["order_id"]))
+
+    def test_index_cache_size(self):
+        archive = OrderArchive(self.directory.name, index_cache_size=2)
+        orders = [make_order(self.restaurant_id, datetime(2025, 3, 1, 9)) for _ in range(20)]
+        archive.write(orders)
+        self.assertEqual(len(archive.archived([order["order_id"] for order in orders])), 20)
+        self.assertLessEqual(len(archive._index_cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
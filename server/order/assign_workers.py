@@ -0,0 +1,66 @@
+"""Assign the workers made before restaurant assignments to their restaurant.
+
+Without --assign or --restaurant it only lists the workers that have no
+customers.restaurant_id yet. --assign reads worker_id,restaurant_id lines from
+a CSV file; --restaurant assigns every unassigned worker to one restaurant,
+for deployments with a single restaurant. Workers that already have a
+restaurant are never changed. Once none are left, set
+UNASSIGNED_WORKERS_ALLOWED=0 on the order service.
+
+    python assign_workers.py [--assign FILE | --restaurant ID] [--page-size 500]
+"""
+import argparse
+import csv
+import os
+from uuid import UUID
+
+from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement
+
+
+def unassigned_workers(session, page_size):
+    select = SimpleStatement("SELECT customer_id, worker, restaurant_id FROM customers", fetch_size=page_size)
+    return [row.customer_id for row in session.execute(select) if row.worker == 1 and not row.restaurant_id]
+
+
+def assign_workers(session, assignments):
+    # IF restaurant_id = null: an admin may have assigned the worker meanwhile
+    update = session.prepare("UPDATE customers SET restaurant_id = ? WHERE customer_id = ? IF restaurant_id = null")
+    assigned = 0
+    for worker_id, restaurant_id in assignments.items():
+        if session.execute(update, (restaurant_id, worker_id)).was_applied:
+            assigned += 1
+    return assigned
+
+
+def read_assignments(path):
+    with open(path, newline="") as assignments_file:
+        return {UUID(worker_id): UUID(restaurant_id) for worker_id, restaurant_id in csv.reader(assignments_file)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--assign", help="CSV file of worker_id,restaurant_id lines")
+    target.add_argument("--restaurant", type=UUID, help="assign every unassigned worker to this restaurant")
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    cluster = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4)
+    session = cluster.connect("pantastic")
+    try:
+        workers = unassigned_workers(session, args.page_size)
+        if args.assign:
+            assignments = {worker_id: restaurant_id for worker_id, restaurant_id in read_assignments(args.assign).items()
+                           if worker_id in workers}
+        elif args.restaurant:
+            assignments = {worker_id: args.restaurant for worker_id in workers}
+        else:
+            assignments = {}
+        assigned = assign_workers(session, assignments)
+        left = [worker_id for worker_id in workers if worker_id not in assignments]
+        print(f"{assigned} workers assigned, {len(left)} still unassigned")
+        for worker_id in left:
+            print(worker_id)
+    finally:
+        cluster.shutdown()
@@ -0,0 +1,69 @@
+"""Fill discounts_by_code from discounts created before checkout read it.
+
+Reads discounts page by page and prints the paging state after every page so
+an interrupted run can continue with --resume. Expired codes are skipped and
+the rest keep their remaining TTL. Codes already in discounts_by_code are
+never overwritten, so the backfill can run while the services are live; when
+discounts holds the same code twice, the first one copied wins and the others
+are reported as duplicates.
+
+    python backfill_discounts_by_code.py [--page-size 500] [--resume HEX]
+"""
+import argparse
+import os
+from datetime import datetime
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+
+def backfill(session, page_size, paging_state=None):
+    select = SimpleStatement(
+        "SELECT discount_id, discount_code, discount_percentage, created_by, created_at, expires_at FROM discounts",
+        fetch_size=page_size,
+    )
+    insert = session.prepare(
+        """
+        INSERT INTO discounts_by_code (discount_code, discount_id, discount_percentage, created_by, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        IF NOT EXISTS
+        USING TTL ?
+        """
+    )
+
+    copied = duplicates = 0
+    while True:
+        result = session.execute(select, paging_state=paging_state)
+        now = datetime.utcnow()
+        params = [
+            (row.discount_code, row.discount_id, row.discount_percentage, row.created_by, row.created_at,
+             row.expires_at, int((row.expires_at - now).total_seconds()))
+            for row in result.current_rows
+            if row.discount_code and row.expires_at and row.expires_at > now
+        ]
+        for (_, claim), row_params in zip(execute_concurrent_with_args(session, insert, params, concurrency=50), params):
+            if claim.was_applied:
+                copied += 1
+            elif claim.one().discount_id != row_params[1]:
+                duplicates += 1
+
+        paging_state = result.paging_state
+        print(f"{copied} codes copied, {duplicates} duplicate codes skipped"
+              + (f", resume with --resume {paging_state.hex()}" if paging_state else ""))
+        if not paging_state:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--resume", help="paging state printed by a previous run")
+    args = parser.parse_args()
+
+    cluster = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4)
+    session = cluster.connect("pantastic")
+    try:
+        backfill(session, args.page_size, bytes.fromhex(args.resume) if args.resume else None)
+    finally:
+        cluster.shutdown()
@@ -0,0 +1,61 @@
+"""Fill orders_by_customer from orders placed before GET /orders existed.
+
+Reads orders page by page and prints the paging state after every page so an
+interrupted run can continue with --resume. Rows already in orders_by_customer
+are never overwritten, so the backfill can run while the service is live.
+
+    python backfill_order_history.py [--page-size 500] [--resume HEX]
+"""
+import argparse
+import os
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+
+def backfill(session, page_size, paging_state=None):
+    select = SimpleStatement(
+        "SELECT customer_id, created_at, order_id, restaurant_id, status, total_price, products FROM orders",
+        fetch_size=page_size,
+    )
+    insert = session.prepare(
+        """
+        INSERT INTO orders_by_customer (customer_id, created_at, order_id, restaurant_id, status, total_price, item_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        IF NOT EXISTS
+        """
+    )
+
+    orders = 0
+    while True:
+        result = session.execute(select, paging_state=paging_state)
+        rows = result.current_rows
+        params = [
+            (row.customer_id, row.created_at, row.order_id, row.restaurant_id, row.status, row.total_price,
+             sum((row.products or {}).values()))
+            for row in rows
+            if row.customer_id and row.created_at
+        ]
+        execute_concurrent_with_args(session, insert, params, concurrency=50)
+
+        orders += len(params)
+        paging_state = result.paging_state
+        print(f"{orders} orders copied"
+              + (f", resume with --resume {paging_state.hex()}" if paging_state else ""))
+        if not paging_state:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--resume", help="paging state printed by a previous run")
+    args = parser.parse_args()
+
+    cluster = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4)
+    session = cluster.connect("pantastic")
+    try:
+        backfill(session, args.page_size, bytes.fromhex(args.resume) if args.resume else None)
+    finally:
+        cluster.shutdown()
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import namedtuple
+
+from geo import distance_km
+
+PendingOrder = namedtuple(
+    "PendingOrder", ["order_id", "restaurant_id", "restaurant_location", "destination", "received_at"]
+)
+
+
+def group_orders(orders, max_batch_size: int, max_spread_km: float):
+    """Split orders of one restaurant into runs for a single courier each.
+
+    The oldest order seeds a run, which then takes the closest destinations
+    within max_spread_km of the seed until it is full.
+    """
+    remaining = sorted(orders, key=lambda order: order.received_at)
+    groups = []
+    while remaining:
+        seed = remaining.pop(0)
+        nearby = sorted(
+            (distance_km(*seed.destination, *order.destination), index)
+            for index, order in enumerate(remaining)
+        )
+        taken = [index for distance, index in nearby if distance <= max_spread_km][:max_batch_size - 1]
+        groups.append([seed] + [remaining[index] for index in taken])
+        for index in sorted(taken, reverse=True):
+            del remaining[index]
+    return groups
+
+
+class OrderBatcher:
+    """Holds new orders for a short window so nearby ones can share a courier.
+
+    Orders wait per restaurant; once the oldest order of a restaurant has
+    waited `window_seconds` all of that restaurant's waiting orders are
+    grouped and handed out. Runs are remembered per courier so the courier is
+    only released when every order of the run is finished.
+    """
+
+    def __init__(self, window_seconds: float, max_batch_size: int = 3, max_spread_km: float = 1.5):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_spread_km = max_spread_km
+        self._waiting = {}  # restaurant_id -> [PendingOrder]
+        self._runs = {}  # courier_id -> set of order_ids still open
+        self._lock = threading.Lock()
+
+    def add(self, order: PendingOrder):
+        with self._lock:
+            waiting = self._waiting.setdefault(order.restaurant_id, [])
+            # Orders recovered after a restart may have been added by create_order already
+            if all(waiting_order.order_id != order.order_id for waiting_order in waiting):
+                waiting.append(order)
+
+    def take_due(self, now: float = None):
+        """Groups whose window has passed, as a list of lists of PendingOrder."""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            for restaurant_id, orders in list(self._waiting.items()):
+                if now - min(order.received_at for order in orders) >= self.window_seconds:
+                    due.append(orders)
+                    del self._waiting[restaurant_id]
+        groups = []
+        for orders in due:
+            groups.extend(group_orders(orders, self.max_batch_size, self.max_spread_km))
+        return groups
+
+    def discard(self, order_id):
+        # The order was canceled before it got a courier
+        with self._lock:
+            for restaurant_id, orders in list(self._waiting.items()):
+                orders[:] = [order for order in orders if order.order_id != order_id]
+                if not orders:
+                    del self._waiting[restaurant_id]
+
+    def requeue(self, group):
+        # No courier was free; the orders keep their place for the next round
+        for order in group:
+            self.add(order)
+
+    def start_run(self, courier_id, group):
+        with self._lock:
+            self._runs.setdefault(courier_id, set()).update(order.order_id for order in group)
+
+    def finish(self, courier_id, order_id):
+        """Mark an order of the courier's run as done; True once the run is over."""
+        with self._lock:
+            run = self._runs.get(courier_id)
+            if run is None:
+                return True
+            run.discard(order_id)
+            if run:
+                return False
+            del self._runs[courier_id]
+            return True
@@ -0,0 +1,102 @@
+import random
+import unittest
+from uuid import uuid4
+
+from batching import OrderBatcher, PendingOrder, group_orders
+from geo import distance_km
+
+RESTAURANT = (42.6977, 23.3219)
+SPEED_KMH = 20.0
+DROP_OFF_MINUTES = 3.0
+
+
+def run_minutes(group):
+    # Restaurant -> nearest remaining drop-off each time -> back to the restaurant
+    position, minutes, stops = RESTAURANT, 0.0, [order.destination for order in group]
+    while stops:
+        stop = min(stops, key=lambda s: distance_km(*position, *s))
+        stops.remove(stop)
+        minutes += distance_km(*position, *stop) / SPEED_KMH * 60 + DROP_OFF_MINUTES
+        position = stop
+    return minutes + distance_km(*position, *RESTAURANT) / SPEED_KMH * 60
+
+
+def simulate(window_minutes, max_batch_size, couriers=6, orders_per_hour=40, hours=3, seed=1):
+    """Deliveries per courier-hour for one restaurant at peak, one tick per minute."""
+    rng = random.Random(seed)
+    # Three neighborhoods around the restaurant get most of the orders
+    neighborhoods = [(42.71, 23.30), (42.68, 23.35), (42.70, 23.36)]
+    batcher = OrderBatcher(window_seconds=window_minutes, max_batch_size=max_batch_size, max_spread_km=1.5)
+    restaurant_id = uuid4()
+    free_at = [0.0] * couriers
+    busy_minutes = 0.0
+    delivered = 0
+    for minute in range(hours * 60):
+        for _ in range(sum(rng.random() < orders_per_hour / 60 / 4 for _ in range(4))):
+            center = rng.choice(neighborhoods)
+            destination = (center[0] + rng.uniform(-0.005, 0.005), center[1] + rng.uniform(-0.005, 0.005))
+            batcher.add(PendingOrder(uuid4(), restaurant_id, RESTAURANT, destination, minute))
+        for group in batcher.take_due(now=minute):
+            courier = min(range(couriers), key=lambda c: free_at[c])
+            if free_at[courier] > minute:
+                batcher.requeue(group)
+                continue
+            duration = run_minutes(group)
+            free_at[courier] = minute + duration
+            busy_minutes += duration
+            delivered += len(group)
+    return delivered / (busy_minutes / 60)
+
+
+class TestGroupOrders(unittest.TestCase):
+    def order(self, destination, received_at=0):
+        return PendingOrder(uuid4(), None, RESTAURANT, destination, received_at)
+
+    def test_nearby_destinations_share_a_run(self):
+        a, b = self.order((42.710, 23.300)), self.order((42.712, 23.301))
+        far = self.order((42.650, 23.400))
+        groups = group_orders([a, b, far], max_batch_size=3, max_spread_km=1.5)
+        self.assertEqual(sorted(len(group) for group in groups), [1, 2])
+        self.assertIn([far], groups)
+
+    def test_runs_are_capped(self):
+        orders = [self.order((42.710, 23.300), received_at=i) for i in range(7)]
+        groups = group_orders(orders, max_batch_size=3, max_spread_km=1.5)
+        self.assertEqual([len(group) for group in groups], [3, 3, 1])
+        self.assertEqual(groups[0][0], orders[0])
+
+
+class TestOrderBatcher(unittest.TestCase):
+    def test_orders_wait_for_the_window(self):
+        batcher = OrderBatcher(window_seconds=30)
+        batcher.add(PendingOrder(uuid4(), "r", RESTAURANT, (42.71, 23.30), 100))
+        self.assertEqual(batcher.take_due(now=120), [])
+        self.assertEqual(len(batcher.take_due(now=130)), 1)
+
+    def test_an_order_waits_only_once(self):
+        batcher = OrderBatcher(window_seconds=30)
+        order = PendingOrder(uuid4(), "r", RESTAURANT, (42.71, 23.30), 0)
+        batcher.add(order)
+        batcher.add(order._replace(received_at=10))
+        self.assertEqual(batcher.take_due(now=30), [[order]])
+
+    def test_courier_is_released_after_the_last_order_of_the_run(self):
+        batcher = OrderBatcher(window_seconds=30)
+        group = [PendingOrder(uuid4(), "r", RESTAURANT, (42.71, 23.30), 0) for _ in range(2)]
+        batcher.start_run("courier", group)
+        self.assertFalse(batcher.finish("courier", group[0].order_id))
+        self.assertTrue(batcher.finish("courier", group[1].order_id))
+
+
+class TestBatchingSimulation(unittest.TestCase):
+    def test_batching_increases_deliveries_per_courier_hour(self):
+        unbatched = simulate(window_minutes=0, max_batch_size=1)
+        batched = simulate(window_minutes=3, max_batch_size=3)
+        # Deliveries per courier-hour, the figures quoted when batching was introduced
+        self.assertAlmostEqual(unbatched, 3.12, places=2)
+        self.assertAlmostEqual(batched, 5.90, places=2)
+        self.assertGreater(batched, unbatched * 1.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
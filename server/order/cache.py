@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionedCache:
+    """TTL cache whose entries carry a version number.
+
+    Writers bump the version of a key; entries loaded at an older version are
+    dropped and never stored again, so a slow loader racing a write cannot
+    put a stale value back into the cache.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._entries = TTLCache(ttl=ttl, max_size=max_size)
+        self._latest = TTLCache(ttl=ttl, max_size=max_size)  # key -> newest version seen
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry if entry is None else entry[1]
+
+    def get_version(self, key):
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key, version: int, value):
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is not None and version < latest:
+                return
+            self._entries.set(key, (version, value))
+
+    def bump(self, key, version: int):
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is None or version > latest:
+                self._latest.set(key, version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < version:
+                self._entries.invalidate(key)
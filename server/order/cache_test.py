@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from cache import TTLCache, VersionedCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_returns_value_before_expiry(self):
+        cache = TTLCache(ttl=60, max_size=10)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_entry_expires(self):
+        cache = TTLCache(ttl=0.01, max_size=10)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(ttl=60, max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_invalidate(self):
+        cache = TTLCache(ttl=60, max_size=10)
+        cache.set("a", 1)
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+
+
+class TestVersionedCache(unittest.TestCase):
+    def test_bump_drops_older_entry(self):
+        cache = VersionedCache(ttl=60, max_size=10)
+        cache.set("menu", 1, {"a": 1})
+        cache.bump("menu", 2)
+        self.assertIsNone(cache.get("menu"))
+
+    def test_stale_load_is_not_stored(self):
+        cache = VersionedCache(ttl=60, max_size=10)
+        cache.bump("menu", 3)
+        cache.set("menu", 2, {"a": 1})
+        self.assertIsNone(cache.get("menu"))
+        cache.set("menu", 3, {"a": 2})
+        self.assertEqual(cache.get("menu"), {"a": 2})
+
+    def test_out_of_order_bump_keeps_newer_entry(self):
+        cache = VersionedCache(ttl=60, max_size=10)
+        cache.set("menu", 5, {"a": 1})
+        cache.bump("menu", 4)
+        self.assertEqual(cache.get_version("menu"), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Read latency under many cancellations: DELETE on cancel vs a Canceled status.
+
+Needs a Cassandra node (CASSANDRA_HOST, default 127.0.0.1). Creates the
+scratch keyspace cancel_bench, loads the same orders into two tables, cancels
+the same share of them in each (one with DELETE, one with UPDATE status) and
+times the two read patterns the order service uses: the latest orders of a
+customer and the ALLOW FILTERING lookup by customer over the whole table.
+Memtables are flushed first (nodetool flush) when --flush is given, which is
+closer to production where tombstones sit in SSTables; a failed flush stops
+the run instead of timing reads against memtables.
+
+"delete" is how orders were canceled before (DELETE FROM orders), "soft" how
+they are canceled now. --json writes the percentiles to a file so runs on
+different clusters or cancel ratios can be kept and compared.
+
+    python cancel_bench.py [--customers 200] [--orders 200] [--cancel-ratio 0.5] [--reads 500] [--flush] [--json FILE]
+
+Against the node from server/nginx/docker-compose.yml, whose nodetool is in
+the container:
+
+    docker compose up -d cassandra-db
+    NODETOOL="docker exec cassandra-db nodetool" python cancel_bench.py --flush --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import subprocess
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+
+MODES = ("delete", "soft")
+
+
+def setup(session):
+    session.execute(
+        "CREATE KEYSPACE IF NOT EXISTS cancel_bench "
+        "WITH replication = {'class': 'SimpleStrategy', 'replication_factor': 1}"
+    )
+    session.set_keyspace("cancel_bench")
+    for mode in MODES:
+        session.execute(f"DROP TABLE IF EXISTS orders_{mode}")
+        session.execute(f"DROP TABLE IF EXISTS orders_by_customer_{mode}")
+        session.execute(
+            f"CREATE TABLE orders_{mode} (order_id UUID PRIMARY KEY, customer_id UUID, status TEXT, created_at TIMESTAMP)"
+        )
+        session.execute(
+            f"""
+            CREATE TABLE orders_by_customer_{mode} (
+                customer_id UUID, created_at TIMESTAMP, order_id UUID, status TEXT,
+                PRIMARY KEY (customer_id, created_at, order_id)
+            ) WITH CLUSTERING ORDER BY (created_at DESC, order_id ASC)
+            """
+        )
+
+
+def load(session, mode, orders, canceled):
+    execute_concurrent_with_args(
+        session,
+        session.prepare(f"INSERT INTO orders_{mode} (order_id, customer_id, status, created_at) VALUES (?, ?, ?, ?)"),
+        [(order_id, customer_id, "Pending", created_at) for customer_id, created_at, order_id in orders],
+        concurrency=64,
+    )
+    execute_concurrent_with_args(
+        session,
+        session.prepare(
+            f"INSERT INTO orders_by_customer_{mode} (customer_id, created_at, order_id, status) VALUES (?, ?, ?, ?)"
+        ),
+        [(customer_id, created_at, order_id, "Pending") for customer_id, created_at, order_id in orders],
+        concurrency=64,
+    )
+    if mode == "delete":
+        statements = [
+            (f"DELETE FROM orders_{mode} WHERE order_id = ?", lambda c, t, o: (o,)),
+            (f"DELETE FROM orders_by_customer_{mode} WHERE customer_id = ? AND created_at = ? AND order_id = ?",
+             lambda c, t, o: (c, t, o)),
+        ]
+    else:
+        statements = [
+            (f"UPDATE orders_{mode} SET status = 'Canceled' WHERE order_id = ?", lambda c, t, o: (o,)),
+            (f"UPDATE orders_by_customer_{mode} SET status = 'Canceled' "
+             "WHERE customer_id = ? AND created_at = ? AND order_id = ?", lambda c, t, o: (c, t, o)),
+        ]
+    for query, params in statements:
+        execute_concurrent_with_args(
+            session, session.prepare(query), [params(*order) for order in canceled], concurrency=64
+        )
+
+
+def timed(session, statement, params):
+    started = time.perf_counter()
+    session.execute(statement, params).all()
+    return (time.perf_counter() - started) * 1000
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=200, help="orders per customer")
+    parser.add_argument("--cancel-ratio", type=float, default=0.5)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--flush", action="store_true", help="run nodetool flush cancel_bench before reading")
+    parser.add_argument("--nodetool", default=os.getenv("NODETOOL", "nodetool"),
+                        help='nodetool command, e.g. "docker exec cassandra-db nodetool"')
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    session = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4).connect()
+    setup(session)
+
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    customers = [uuid4() for _ in range(args.customers)]
+    orders = [
+        (customer_id, start + timedelta(minutes=n), uuid4())
+        for customer_id in customers
+        for n in range(args.orders)
+    ]
+    canceled = [order for order in orders if rng.random() < args.cancel_ratio]
+    for mode in MODES:
+        load(session, mode, orders, canceled)
+    if args.flush:
+        subprocess.run([*shlex.split(args.nodetool), "flush", "cancel_bench"], check=True)
+
+    print(f"{len(orders)} orders, {len(canceled)} canceled, {args.reads} reads per pattern")
+    print(f"{'mode':8} {'pattern':24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    results = []
+    for mode in MODES:
+        patterns = {
+            "latest 20 by customer": session.prepare(
+                f"SELECT * FROM orders_by_customer_{mode} WHERE customer_id = ? LIMIT 20"
+            ),
+            "filter by customer": session.prepare(
+                f"SELECT * FROM orders_{mode} WHERE customer_id = ? LIMIT 20 ALLOW FILTERING"
+            ),
+        }
+        for name, statement in patterns.items():
+            reads = args.reads if name != "filter by customer" else max(1, args.reads // 20)
+            latencies = [timed(session, statement, (rng.choice(customers),)) for _ in range(reads)]
+            p = percentiles(latencies)
+            print(f"{mode:8} {name:24} {p[50]:8.2f} {p[95]:8.2f} {p[99]:8.2f}")
+            results.append({"mode": mode, "pattern": name, "reads": reads,
+                            **{f"p{q}_ms": round(value, 3) for q, value in p.items()}})
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"orders": len(orders), "canceled": len(canceled), "flushed": args.flush,
+                       "results": results}, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
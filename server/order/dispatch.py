@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+AVAILABLE = "Assigned"  # courier is assigned to the restaurant and free
+BUSY = "Busy"  # courier is out on a delivery
+
+NEAREST_CANDIDATES = 5
+DISTANCE_BAND_KM = 0.5  # couriers this close to each other count as equally near
+
+
+class CourierDispatcher:
+    """Hands out couriers per restaurant and takes them back after delivery.
+
+    Each restaurant has an in-memory queue of free couriers ordered by how many
+    deliveries they got from this process, so work is spread evenly. With a
+    CourierIndex of live positions, the nearest free couriers are tried first,
+    least loaded first among couriers at about the same distance. All of this
+    is only a hint: a courier is claimed with a lightweight transaction on its
+    couriers_by_restaurant row, so two orders (or two service instances) can
+    never get the same courier.
+    """
+
+    def __init__(self, index=None):
+        self.index = index
+        self._queues = {}  # restaurant_id -> heap of (load, seq, courier_id)
+        # restaurant_id -> {courier_id: seq of its live heap entry}; entries of
+        # couriers claimed or pushed again since are skipped and dropped
+        self._queued = {}
+        self._load = defaultdict(int)  # courier_id -> deliveries handed out
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _push(self, restaurant_id, courier_id):
+        queue = self._queues.setdefault(restaurant_id, [])
+        queued = self._queued.setdefault(restaurant_id, {})
+        seq = next(self._seq)
+        heapq.heappush(queue, (self._load[courier_id], seq, courier_id))
+        queued[courier_id] = seq
+        if len(queue) > 2 * len(queued):
+            queue[:] = [entry for entry in queue if queued.get(entry[2]) == entry[1]]
+            heapq.heapify(queue)
+
+    def _unqueue(self, restaurant_id, courier_id):
+        with self._lock:
+            self._queued.get(restaurant_id, {}).pop(courier_id, None)
+
+    def _refill(self, db, restaurant_id):
+        rows = db.execute(
+            "SELECT delivery_person_id, status FROM couriers_by_restaurant WHERE restaurant_id = %s",
+            [restaurant_id],
+        )
+        available = [row.delivery_person_id for row in rows if row.status == AVAILABLE]
+        with self._lock:
+            self._queues[restaurant_id] = []
+            self._queued[restaurant_id] = {}
+            for courier_id in available:
+                self._push(restaurant_id, courier_id)
+        if self.index:
+            self.index.clear_restaurant(restaurant_id)
+            for courier_id in available:
+                self.index.set_available(restaurant_id, courier_id, True)
+
+    def _pop(self, restaurant_id):
+        with self._lock:
+            queue = self._queues.get(restaurant_id) or []
+            queued = self._queued.get(restaurant_id, {})
+            while queue:
+                _, seq, courier_id = heapq.heappop(queue)
+                if queued.get(courier_id) == seq:
+                    del queued[courier_id]
+                    return courier_id
+            return None
+
+    def _try_claim(self, db, restaurant_id, courier_id):
+        result = db.execute(
+            """
+            UPDATE couriers_by_restaurant SET status = %s, updated_at = %s
+            WHERE restaurant_id = %s AND delivery_person_id = %s
+            IF status = %s
+            """,
+            (BUSY, datetime.utcnow(), restaurant_id, courier_id, AVAILABLE),
+        )
+        # Claimed by us or by someone else, either way no longer free
+        self._unqueue(restaurant_id, courier_id)
+        if self.index:
+            self.index.set_available(restaurant_id, courier_id, False)
+        if result.was_applied:
+            with self._lock:
+                self._load[courier_id] += 1
+        return result.was_applied
+
+    def _claim_nearest(self, db, restaurant_id, near):
+        candidates = self.index.nearest(restaurant_id, near[0], near[1], k=NEAREST_CANDIDATES)
+        candidates.sort(key=lambda candidate: (int(candidate[0] / DISTANCE_BAND_KM), self._load[candidate[1]]))
+        for _, courier_id in candidates:
+            if self._try_claim(db, restaurant_id, courier_id):
+                return courier_id
+        return None
+
+    def claim(self, db, restaurant_id, near=None):
+        """Reserve a free courier of the restaurant, or None.
+
+        `near` is the (latitude, longitude) to search from when positions are known.
+        """
+        refilled = restaurant_id not in self._queues
+        if refilled:
+            self._refill(db, restaurant_id)
+        while True:
+            if self.index and near:
+                courier_id = self._claim_nearest(db, restaurant_id, near)
+                if courier_id:
+                    return courier_id
+            # Then couriers without a known position, least loaded first
+            courier_id = self._pop(restaurant_id)
+            if courier_id is None:
+                # Couriers may have been released by another instance
+                if refilled:
+                    return None
+                self._refill(db, restaurant_id)
+                refilled = True
+                continue
+            if self._try_claim(db, restaurant_id, courier_id):
+                return courier_id
+            # Taken by someone else or unassigned meanwhile; it comes back on release
+
+    def release(self, db, restaurant_id, courier_id):
+        """Make a courier available again after a delivery ends."""
+        result = db.execute(
+            """
+            UPDATE couriers_by_restaurant SET status = %s, updated_at = %s
+            WHERE restaurant_id = %s AND delivery_person_id = %s
+            IF status = %s
+            """,
+            (AVAILABLE, datetime.utcnow(), restaurant_id, courier_id, BUSY),
+        )
+        if result.was_applied:
+            with self._lock:
+                if restaurant_id in self._queues:
+                    self._push(restaurant_id, courier_id)
+            if self.index:
+                self.index.set_available(restaurant_id, courier_id, True)
+        return result.was_applied
+
+    def forget(self, restaurant_id):
+        # Couriers were assigned or unassigned; rebuild the queue on next claim
+        with self._lock:
+            self._queues.pop(restaurant_id, None)
+            self._queued.pop(restaurant_id, None)
+        if self.index:
+            self.index.clear_restaurant(restaurant_id)
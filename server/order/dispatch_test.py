@@ -0,0 +1,97 @@
+import unittest
+from types import SimpleNamespace
+from uuid import uuid4
+
+from dispatch import AVAILABLE, BUSY, CourierDispatcher
+from geo import CourierIndex
+
+
+class FakeCouriersTable:
+    """Just enough of couriers_by_restaurant for the dispatcher's statements."""
+
+    def __init__(self, restaurant_id, couriers):
+        self.restaurant_id = restaurant_id
+        self.delivery_people = {courier_id: AVAILABLE for courier_id in couriers}
+        self.failed_claims = 0
+
+    def execute(self, query, params):
+        if query.startswith("SELECT"):
+            return [
+                SimpleNamespace(delivery_person_id=courier_id, status=courier_status)
+                for courier_id, courier_status in self.delivery_people.items()
+            ]
+        new_status, _, _, courier_id, expected = params
+        applied = self.delivery_people.get(courier_id) == expected
+        if applied:
+            self.delivery_people[courier_id] = new_status
+        elif new_status == BUSY:
+            self.failed_claims += 1
+        return SimpleNamespace(was_applied=applied)
+
+
+class TestCourierDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.restaurant_id = uuid4()
+        self.couriers = [uuid4(), uuid4()]
+        self.db = FakeCouriersTable(self.restaurant_id, self.couriers)
+        self.dispatcher = CourierDispatcher()
+
+    def test_claimed_courier_is_busy_and_not_handed_out_twice(self):
+        first = self.dispatcher.claim(self.db, self.restaurant_id)
+        second = self.dispatcher.claim(self.db, self.restaurant_id)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.db.delivery_people[first], BUSY)
+        self.assertIsNone(self.dispatcher.claim(self.db, self.restaurant_id))
+
+    def test_release_makes_courier_available_again(self):
+        first = self.dispatcher.claim(self.db, self.restaurant_id)
+        self.dispatcher.claim(self.db, self.restaurant_id)
+        self.assertTrue(self.dispatcher.release(self.db, self.restaurant_id, first))
+        self.assertEqual(self.dispatcher.claim(self.db, self.restaurant_id), first)
+
+    def test_courier_claimed_elsewhere_is_skipped(self):
+        self.db.delivery_people[self.couriers[0]] = BUSY
+        self.dispatcher._refill(self.db, self.restaurant_id)
+        self.db.delivery_people[self.couriers[0]] = AVAILABLE
+        self.db.delivery_people[self.couriers[1]] = BUSY
+        self.assertEqual(self.dispatcher.claim(self.db, self.restaurant_id), self.couriers[0])
+
+    def test_load_is_spread_across_couriers(self):
+        handed_out = []
+        for _ in range(10):
+            courier_id = self.dispatcher.claim(self.db, self.restaurant_id)
+            handed_out.append(courier_id)
+            self.dispatcher.release(self.db, self.restaurant_id, courier_id)
+        self.assertEqual(handed_out.count(self.couriers[0]), 5)
+        self.assertEqual(handed_out.count(self.couriers[1]), 5)
+
+
+class TestCourierDispatcherWithPositions(unittest.TestCase):
+    def setUp(self):
+        self.restaurant_id = uuid4()
+        self.couriers = [uuid4(), uuid4(), uuid4()]
+        self.db = FakeCouriersTable(self.restaurant_id, self.couriers)
+        self.index = CourierIndex()
+        for offset, courier_id in enumerate(self.couriers):
+            self.index.update_position(courier_id, 42.69 + offset * 0.01, 23.32)
+        self.dispatcher = CourierDispatcher(index=self.index)
+
+    def test_queue_does_not_grow_with_deliveries(self):
+        for _ in range(1000):
+            courier_id = self.dispatcher.claim(self.db, self.restaurant_id, near=(42.69, 23.32))
+            self.dispatcher.release(self.db, self.restaurant_id, courier_id)
+        self.assertLessEqual(len(self.dispatcher._queues[self.restaurant_id]), 2 * len(self.couriers))
+        self.assertEqual(self.db.failed_claims, 0)
+
+    def test_courier_claimed_by_position_is_not_queued(self):
+        nearest = self.dispatcher.claim(self.db, self.restaurant_id, near=(42.69, 23.32))
+        self.assertEqual(nearest, self.couriers[0])
+        # Without a position to search from the queue hands out the other two only
+        others = {self.dispatcher.claim(self.db, self.restaurant_id) for _ in range(2)}
+        self.assertEqual(others, set(self.couriers[1:]))
+        self.assertIsNone(self.dispatcher.claim(self.db, self.restaurant_id))
+        self.assertEqual(self.db.failed_claims, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
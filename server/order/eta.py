@@ -0,0 +1,69 @@
+import threading
+from datetime import timedelta
+
+DEFAULT_PREP_MINUTES = 20.0
+QUEUE_MINUTES_PER_ORDER = 2.0  # extra kitchen time per order already waiting
+COURIER_SPEED_KMH = 20.0
+HANDOVER_MINUTES = 5.0
+PREP_SMOOTHING = 0.1  # weight of the newest delivery in the prep time average
+MIN_ETA_MINUTES = 15.0
+
+
+class EtaEstimator:
+    """In-memory delivery time model per restaurant.
+
+    ETA = prep time + open orders * QUEUE_MINUTES_PER_ORDER + travel time.
+    Prep time is an exponential moving average of what delivered orders really
+    took minus their travel time, updated on every delivery; the open order
+    count follows order creation and completion. Estimates never touch the
+    database, a background refresh reloads the stored averages.
+    """
+
+    def __init__(self):
+        self._prep_minutes = {}  # restaurant_id -> (average prep minutes, samples)
+        self._open_orders = {}  # restaurant_id -> orders not delivered or canceled yet
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def travel_minutes(distance_km: float):
+        return distance_km / COURIER_SPEED_KMH * 60
+
+    def estimate(self, restaurant_id, distance_km: float):
+        with self._lock:
+            prep_minutes, _ = self._prep_minutes.get(restaurant_id, (DEFAULT_PREP_MINUTES, 0))
+            open_orders = self._open_orders.get(restaurant_id, 0)
+        minutes = (
+            prep_minutes
+            + open_orders * QUEUE_MINUTES_PER_ORDER
+            + self.travel_minutes(distance_km)
+            + HANDOVER_MINUTES
+        )
+        return timedelta(minutes=max(minutes, MIN_ETA_MINUTES))
+
+    def order_opened(self, restaurant_id):
+        with self._lock:
+            self._open_orders[restaurant_id] = self._open_orders.get(restaurant_id, 0) + 1
+
+    def order_closed(self, restaurant_id):
+        with self._lock:
+            self._open_orders[restaurant_id] = max(self._open_orders.get(restaurant_id, 0) - 1, 0)
+
+    def record_delivery(self, restaurant_id, fulfilment_minutes: float, distance_km: float):
+        """Fold a delivered order into the prep average; returns the new (average, samples)."""
+        observed = fulfilment_minutes - self.travel_minutes(distance_km) - HANDOVER_MINUTES
+        observed = min(max(observed, 0.0), 180.0)
+        with self._lock:
+            average, samples = self._prep_minutes.get(restaurant_id, (DEFAULT_PREP_MINUTES, 0))
+            # Plain mean while there are few samples, then a moving average
+            weight = max(PREP_SMOOTHING, 1.0 / (samples + 1))
+            average += weight * (observed - average)
+            self._prep_minutes[restaurant_id] = (average, samples + 1)
+            return average, samples + 1
+
+    def load_prep_minutes(self, restaurant_id, average: float, samples: int):
+        with self._lock:
+            self._prep_minutes[restaurant_id] = (average, samples)
+
+    def set_open_orders(self, restaurant_id, open_orders: int):
+        with self._lock:
+            self._open_orders[restaurant_id] = open_orders
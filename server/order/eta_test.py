@@ -0,0 +1,72 @@
+import unittest
+from uuid import uuid4
+
+from eta import DEFAULT_PREP_MINUTES, HANDOVER_MINUTES, MIN_ETA_MINUTES, QUEUE_MINUTES_PER_ORDER, EtaEstimator
+
+
+def minutes(delta):
+    return delta.total_seconds() / 60
+
+
+class EtaEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.estimator = EtaEstimator()
+        self.restaurant_id = uuid4()
+
+    def test_unknown_restaurant_uses_default_prep_time(self):
+        eta = self.estimator.estimate(self.restaurant_id, 5.0)
+        expected = DEFAULT_PREP_MINUTES + EtaEstimator.travel_minutes(5.0) + HANDOVER_MINUTES
+        self.assertAlmostEqual(minutes(eta), expected)
+
+    def test_farther_addresses_take_longer(self):
+        near = self.estimator.estimate(self.restaurant_id, 1.0)
+        far = self.estimator.estimate(self.restaurant_id, 10.0)
+        self.assertGreater(far, near)
+
+    def test_open_orders_add_queue_time(self):
+        before = self.estimator.estimate(self.restaurant_id, 3.0)
+        for _ in range(4):
+            self.estimator.order_opened(self.restaurant_id)
+        after = self.estimator.estimate(self.restaurant_id, 3.0)
+        self.assertAlmostEqual(minutes(after - before), 4 * QUEUE_MINUTES_PER_ORDER)
+
+        for _ in range(6):
+            self.estimator.order_closed(self.restaurant_id)
+        self.assertEqual(self.estimator.estimate(self.restaurant_id, 3.0), before)
+
+    def test_recounted_open_orders_replace_local_counts(self):
+        for _ in range(3):
+            self.estimator.order_opened(self.restaurant_id)
+        self.estimator.set_open_orders(self.restaurant_id, 1)
+        self.estimator.order_opened(self.restaurant_id)
+        expected = (DEFAULT_PREP_MINUTES + 2 * QUEUE_MINUTES_PER_ORDER + EtaEstimator.travel_minutes(3.0)
+                    + HANDOVER_MINUTES)
+        self.assertAlmostEqual(minutes(self.estimator.estimate(self.restaurant_id, 3.0)), expected)
+
+    def test_deliveries_move_prep_time_towards_observed(self):
+        distance = 4.0
+        slow = 50.0 + EtaEstimator.travel_minutes(distance) + HANDOVER_MINUTES
+        average, samples = self.estimator.record_delivery(self.restaurant_id, slow, distance)
+        # The first sample replaces the default outright
+        self.assertAlmostEqual(average, 50.0)
+        self.assertEqual(samples, 1)
+        for _ in range(200):
+            average, samples = self.estimator.record_delivery(self.restaurant_id, slow - 30.0, distance)
+        self.assertAlmostEqual(average, 20.0, places=3)
+        self.assertEqual(samples, 201)
+
+    def test_other_restaurants_are_not_affected(self):
+        self.estimator.record_delivery(self.restaurant_id, 120.0, 1.0)
+        self.estimator.order_opened(self.restaurant_id)
+        other = uuid4()
+        self.assertAlmostEqual(
+            minutes(self.estimator.estimate(other, 0.0)), DEFAULT_PREP_MINUTES + HANDOVER_MINUTES
+        )
+
+    def test_estimate_has_a_floor(self):
+        self.estimator.load_prep_minutes(self.restaurant_id, 0.0, 10)
+        self.assertEqual(minutes(self.estimator.estimate(self.restaurant_id, 0.0)), MIN_ETA_MINUTES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""In-process fan-out of order events, per restaurant (kitchen screens) or per
+order (customers tracking their order).
+
+Every event gets the next offset of its key and is kept in a short per-key
+history, so a client that reconnects can pass the last offset it saw and get
+what it missed. Each subscriber has a bounded buffer; one that falls behind
+is cut off (and resumes from its offset) rather than slowing down everybody
+else. Offsets are only meaningful together with the epoch of
+the feed, which changes whenever the process restarts.
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from uuid import uuid4
+
+
+class FeedOverflow(Exception):
+    """The subscriber did not keep up and has to reconnect."""
+
+
+class Subscription:
+    def __init__(self, loop, buffer_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def put(self, event):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout=None):
+        """Next event, None after timeout seconds without one."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is None:
+            raise FeedOverflow()
+        return event
+
+
+class EventFeed:
+    def __init__(self, history_size=500, buffer_size=100, max_keys=None):
+        self.epoch = uuid4().hex[:12]
+        self.history_size = history_size
+        self.buffer_size = buffer_size
+        self.max_keys = max_keys  # keys without subscribers beyond this are forgotten, oldest first
+        self._offsets = {}  # key -> last offset
+        self._history = OrderedDict()  # key -> deque of events, least recently published first
+        self._subscribers = {}  # key -> set of Subscription
+        self._lock = threading.Lock()
+
+    def publish(self, key, event_type, data):
+        """Send an event to the subscribers of key; safe to call from any thread."""
+        with self._lock:
+            offset = self._offsets.get(key, 0) + 1
+            self._offsets[key] = offset
+            event = {"offset": offset, "type": event_type, "data": data}
+            self._history.setdefault(key, deque(maxlen=self.history_size)).append(event)
+            self._history.move_to_end(key)
+            self._forget_old_keys()
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The subscriber's loop is closed
+                self.unsubscribe(key, subscription)
+        return event
+
+    def _forget_old_keys(self):
+        # A forgotten key starts again at offset 1, so keys with subscribers are kept
+        if self.max_keys is None:
+            return
+        for _ in range(len(self._history)):
+            if len(self._history) <= self.max_keys:
+                break
+            key = next(iter(self._history))
+            if key in self._subscribers:
+                self._history.move_to_end(key)
+                continue
+            del self._history[key]
+            del self._offsets[key]
+
+    def last_offset(self, key):
+        with self._lock:
+            return self._offsets.get(key, 0)
+
+    def subscribe(self, key, epoch=None, offset=None):
+        """Returns (subscription, backlog, reset).
+
+        backlog holds the retained events after offset. reset is True when the
+        events since offset cannot be replayed (other epoch or too old), so
+        the client has to reload the queue first.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            history = list(self._history.get(key, ()))
+            last = self._offsets.get(key, 0)
+            self._subscribers.setdefault(key, set()).add(subscription)
+        if offset is None:
+            return subscription, [], False
+        if epoch != self.epoch or offset > last:
+            return subscription, [], True
+        backlog = [event for event in history if event["offset"] > offset]
+        # Anything between offset and the oldest retained event is lost
+        reset = offset < last and (not backlog or backlog[0]["offset"] != offset + 1)
+        return subscription, ([] if reset else backlog), reset
+
+    def unsubscribe(self, key, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def subscriber_count(self, key):
+        with self._lock:
+            return len(self._subscribers.get(key, ()))
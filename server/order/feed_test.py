@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import unittest
+from uuid import uuid4
+
+from feed import FeedOverflow, EventFeed
+
+
+class EventFeedTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.feed = EventFeed(history_size=5, buffer_size=3)
+        self.restaurant_id = uuid4()
+
+    async def test_subscribers_get_events_of_their_restaurant(self):
+        subscription, backlog, reset = self.feed.subscribe(self.restaurant_id)
+        self.assertEqual((backlog, reset), ([], False))
+        self.feed.publish(uuid4(), "order_created", {"order_id": "other"})
+        self.feed.publish(self.restaurant_id, "order_created", {"order_id": "a"})
+        event = await subscription.get(timeout=1)
+        self.assertEqual(event, {"offset": 1, "type": "order_created", "data": {"order_id": "a"}})
+        self.assertIsNone(await subscription.get(timeout=0.01))
+
+    async def test_publish_from_another_thread(self):
+        subscription, _, _ = self.feed.subscribe(self.restaurant_id)
+        thread = threading.Thread(target=self.feed.publish, args=(self.restaurant_id, "status_changed", {}))
+        thread.start()
+        thread.join()
+        self.assertEqual((await subscription.get(timeout=1))["offset"], 1)
+
+    async def test_slow_subscriber_is_cut_off(self):
+        slow, _, _ = self.feed.subscribe(self.restaurant_id)
+        for n in range(4):
+            self.feed.publish(self.restaurant_id, "order_created", {"n": n})
+        await asyncio.sleep(0)
+        with self.assertRaises(FeedOverflow):
+            await slow.get(timeout=1)
+
+    async def test_resume_replays_missed_events(self):
+        for n in range(4):
+            self.feed.publish(self.restaurant_id, "order_created", {"n": n})
+        _, backlog, reset = self.feed.subscribe(self.restaurant_id, self.feed.epoch, 2)
+        self.assertFalse(reset)
+        self.assertEqual([event["offset"] for event in backlog], [3, 4])
+        _, backlog, reset = self.feed.subscribe(self.restaurant_id, self.feed.epoch, 4)
+        self.assertEqual((backlog, reset), ([], False))
+
+    async def test_resume_needs_a_reset_when_events_are_gone(self):
+        for n in range(8):
+            self.feed.publish(self.restaurant_id, "order_created", {"n": n})
+        # History keeps offsets 4-8, so 3 is still replayable and 2 is not
+        self.assertFalse(self.feed.subscribe(self.restaurant_id, self.feed.epoch, 3)[2])
+        self.assertTrue(self.feed.subscribe(self.restaurant_id, self.feed.epoch, 2)[2])
+        self.assertTrue(self.feed.subscribe(self.restaurant_id, "restarted", 8)[2])
+        self.assertTrue(self.feed.subscribe(self.restaurant_id, self.feed.epoch, 9)[2])
+
+    async def test_old_keys_are_forgotten(self):
+        feed = EventFeed(history_size=5, buffer_size=3, max_keys=2)
+        subscribed, first, second = uuid4(), uuid4(), uuid4()
+        feed.subscribe(subscribed)
+        for key in (subscribed, first, second):
+            feed.publish(key, "status_changed", {})
+        self.assertEqual(feed.last_offset(subscribed), 1)
+        self.assertEqual(feed.last_offset(first), 0)
+        self.assertEqual(feed.last_offset(second), 1)
+
+    async def test_unsubscribe(self):
+        subscription, _, _ = self.feed.subscribe(self.restaurant_id)
+        self.assertEqual(self.feed.subscriber_count(self.restaurant_id), 1)
+        self.feed.unsubscribe(self.restaurant_id, subscription)
+        self.assertEqual(self.feed.subscriber_count(self.restaurant_id), 0)
+        self.feed.publish(self.restaurant_id, "order_created", {})
+
+
+if __name__ == "__main__":
+    unittest.main()
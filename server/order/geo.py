@@ -0,0 +1,129 @@
+import math
+import threading
+from collections import defaultdict
+
+# Cells are geohash cells of precision 6 (15 latitude bits, 15 longitude bits),
+# roughly 0.6 km x 0.9 km in Sofia, addressed by their integer row and column.
+GEOHASH_BITS = 15
+LAT_CELL = 180.0 / (1 << GEOHASH_BITS)
+LON_CELL = 360.0 / (1 << GEOHASH_BITS)
+EARTH_RADIUS_KM = 6371.0
+KM_PER_LAT_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def cell_of(latitude: float, longitude: float):
+    return int((latitude + 90.0) / LAT_CELL), int((longitude + 180.0) / LON_CELL)
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float):
+    # Haversine; accurate to well under a percent at delivery distances
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class CourierIndex:
+    """Geohash grid of the live positions of available couriers, per restaurant.
+
+    Position updates and availability changes are O(1). A nearest query walks
+    rings of cells outwards from the restaurant and stops as soon as no
+    unvisited cell can hold anything closer than the k-th courier found, so it
+    only looks at couriers near the restaurant, however many there are.
+    """
+
+    def __init__(self):
+        self._positions = {}  # courier_id -> (latitude, longitude, cell)
+        self._available = defaultdict(set)  # courier_id -> restaurants it is free for
+        self._grids = defaultdict(lambda: defaultdict(set))  # restaurant_id -> cell -> couriers
+        self._lock = threading.Lock()
+
+    def _place(self, restaurant_id, courier_id):
+        position = self._positions.get(courier_id)
+        if position:
+            self._grids[restaurant_id][position[2]].add(courier_id)
+
+    def _unplace(self, restaurant_id, courier_id):
+        position = self._positions.get(courier_id)
+        if not position:
+            return
+        grid = self._grids.get(restaurant_id)
+        if grid is None:
+            return
+        cell = grid.get(position[2])
+        if cell is not None:
+            cell.discard(courier_id)
+            if not cell:
+                del grid[position[2]]
+
+    def update_position(self, courier_id, latitude: float, longitude: float):
+        with self._lock:
+            restaurants = self._available.get(courier_id, ())
+            for restaurant_id in restaurants:
+                self._unplace(restaurant_id, courier_id)
+            self._positions[courier_id] = (latitude, longitude, cell_of(latitude, longitude))
+            for restaurant_id in restaurants:
+                self._place(restaurant_id, courier_id)
+
+    def set_available(self, restaurant_id, courier_id, available: bool):
+        with self._lock:
+            restaurants = self._available.get(courier_id, set())
+            if available and restaurant_id not in restaurants:
+                self._available[courier_id].add(restaurant_id)
+                self._place(restaurant_id, courier_id)
+            elif not available and restaurant_id in restaurants:
+                self._unplace(restaurant_id, courier_id)
+                restaurants.discard(restaurant_id)
+                if not restaurants:
+                    del self._available[courier_id]
+
+    def clear_restaurant(self, restaurant_id):
+        with self._lock:
+            self._grids.pop(restaurant_id, None)
+            for courier_id in [c for c, r in self._available.items() if restaurant_id in r]:
+                restaurants = self._available[courier_id]
+                restaurants.discard(restaurant_id)
+                if not restaurants:
+                    del self._available[courier_id]
+
+    def nearest(self, restaurant_id, latitude: float, longitude: float, k: int = 5, max_km: float = 20.0):
+        """Up to k (distance_km, courier_id) pairs, closest first, within max_km."""
+        with self._lock:
+            grid = self._grids.get(restaurant_id)
+            if not grid:
+                return []
+            row, col = cell_of(latitude, longitude)
+            cell_height_km = LAT_CELL * KM_PER_LAT_DEGREE
+            cell_width_km = LON_CELL * KM_PER_LAT_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+            cell_km = min(cell_height_km, cell_width_km)
+            max_ring = int(max_km / cell_km) + 1
+            if len(grid) <= (2 * max_ring + 1) ** 2 // 16:
+                # Few occupied cells: checking them all beats walking empty rings
+                cells = [list(grid.keys())]
+            else:
+                cells = (self._ring(row, col, ring) for ring in range(max_ring + 1))
+            found = []
+            for ring, ring_cells in enumerate(cells):
+                for cell in ring_cells:
+                    for courier_id in grid.get(cell, ()):
+                        courier_lat, courier_lon, _ = self._positions[courier_id]
+                        distance = distance_km(latitude, longitude, courier_lat, courier_lon)
+                        if distance <= max_km:
+                            found.append((distance, courier_id))
+                found.sort(key=lambda candidate: candidate[0])
+                # Anything outside this ring is at least ring * cell_km away
+                if len(found) >= k and found[k - 1][0] <= ring * cell_km:
+                    break
+            return found[:k]
+
+    @staticmethod
+    def _ring(row, col, ring):
+        if ring == 0:
+            return [(row, col)]
+        cells = []
+        for d in range(-ring, ring + 1):
+            cells.append((row - ring, col + d))
+            cells.append((row + ring, col + d))
+        for d in range(-ring + 1, ring):
+            cells.append((row + d, col - ring))
+            cells.append((row + d, col + ring))
+        return cells
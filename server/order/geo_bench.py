@@ -0,0 +1,76 @@
+"""Benchmark CourierIndex against a linear scan with simulated couriers.
+
+    python geo_bench.py [--couriers 10000] [--restaurants 1] [--queries 2000]
+"""
+import argparse
+import random
+import time
+from uuid import uuid4
+
+from geo import CourierIndex, distance_km
+
+# Greater Sofia
+LAT_RANGE = (42.60, 42.78)
+LON_RANGE = (23.20, 23.45)
+
+
+def random_point(rng):
+    return rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--couriers", type=int, default=10000)
+    parser.add_argument("--restaurants", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    restaurants = [uuid4() for _ in range(args.restaurants)]
+    couriers = [(uuid4(), rng.choice(restaurants), *random_point(rng)) for _ in range(args.couriers)]
+
+    index = CourierIndex()
+    started = time.perf_counter()
+    for courier_id, restaurant_id, latitude, longitude in couriers:
+        index.update_position(courier_id, latitude, longitude)
+        index.set_available(restaurant_id, courier_id, True)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for courier_id, _, latitude, longitude in couriers:
+        index.update_position(courier_id, latitude + rng.uniform(-0.001, 0.001), longitude + rng.uniform(-0.001, 0.001))
+    updates = time.perf_counter() - started
+    positions = {courier_id: index._positions[courier_id][:2] for courier_id, *_ in couriers}
+
+    queries = [(rng.choice(restaurants), *random_point(rng)) for _ in range(args.queries)]
+    started = time.perf_counter()
+    indexed = [index.nearest(restaurant_id, latitude, longitude, k=args.k) for restaurant_id, latitude, longitude in queries]
+    index_time = time.perf_counter() - started
+
+    by_restaurant = {}
+    for courier_id, restaurant_id, *_ in couriers:
+        by_restaurant.setdefault(restaurant_id, []).append(courier_id)
+    started = time.perf_counter()
+    scanned = []
+    for restaurant_id, latitude, longitude in queries:
+        distances = sorted(
+            (distance_km(latitude, longitude, *positions[courier_id]), courier_id)
+            for courier_id in by_restaurant.get(restaurant_id, ())
+        )
+        scanned.append([candidate for candidate in distances if candidate[0] <= 20.0][:args.k])
+    scan_time = time.perf_counter() - started
+
+    mismatches = sum(
+        [c for _, c in a] != [c for _, c in b] for a, b in zip(indexed, scanned)
+    )
+    print(f"{args.couriers} couriers, {args.restaurants} restaurants, k={args.k}")
+    print(f"build:          {build * 1000:8.1f} ms")
+    print(f"position moves: {args.couriers / updates:10.0f} /s")
+    print(f"index nearest:  {index_time / args.queries * 1e6:8.1f} us/query")
+    print(f"linear scan:    {scan_time / args.queries * 1e6:8.1f} us/query")
+    print(f"mismatches:     {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
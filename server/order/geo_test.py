@@ -0,0 +1,49 @@
+import random
+import unittest
+from uuid import uuid4
+
+from geo import CourierIndex, distance_km
+
+
+class TestCourierIndex(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.index = CourierIndex()
+        self.restaurant_id = uuid4()
+        self.positions = {}
+        for _ in range(2000):
+            courier_id = uuid4()
+            self.positions[courier_id] = (self.rng.uniform(42.6, 42.78), self.rng.uniform(23.2, 23.45))
+            self.index.update_position(courier_id, *self.positions[courier_id])
+            self.index.set_available(self.restaurant_id, courier_id, True)
+
+    def brute_force(self, latitude, longitude, k):
+        return sorted(
+            (distance_km(latitude, longitude, *position), courier_id)
+            for courier_id, position in self.positions.items()
+        )[:k]
+
+    def test_nearest_matches_brute_force(self):
+        for _ in range(50):
+            latitude, longitude = self.rng.uniform(42.6, 42.78), self.rng.uniform(23.2, 23.45)
+            self.assertEqual(
+                [c for _, c in self.index.nearest(self.restaurant_id, latitude, longitude, k=5)],
+                [c for _, c in self.brute_force(latitude, longitude, 5)],
+            )
+
+    def test_unavailable_courier_is_not_returned(self):
+        nearest = self.index.nearest(self.restaurant_id, 42.69, 23.32, k=1)[0][1]
+        self.index.set_available(self.restaurant_id, nearest, False)
+        self.assertNotIn(nearest, [c for _, c in self.index.nearest(self.restaurant_id, 42.69, 23.32, k=5)])
+
+    def test_moved_courier_is_found_at_new_position(self):
+        courier_id = next(iter(self.positions))
+        self.index.update_position(courier_id, 42.70001, 23.30001)
+        self.assertEqual(self.index.nearest(self.restaurant_id, 42.7, 23.3, k=1)[0][1], courier_id)
+
+    def test_other_restaurants_couriers_are_ignored(self):
+        self.assertEqual(self.index.nearest(uuid4(), 42.69, 23.32), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""Revenue, order counts, baskets, discount usage and delivery times from the order archive.
+
+Reads the files written by archive_orders.py (see archive.py) and prints one
+CSV row per restaurant and day, per restaurant or per day:
+
+    python order_analytics.py [--from 2025-01-01] [--to 2025-12-31] [--by restaurant-day|restaurant|day]
+
+Parsing JSON is the slow part, so the first run over a day stores its orders
+as .npy columns under <archive>/columns/<day>/ and later runs memory-map those
+instead. The columns are rebuilt when the day's archive files have changed.
+All figures are computed on whole columns with NumPy; only delivered orders
+count towards revenue, baskets and delivery times.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import date
+
+import numpy as np
+
+COLUMNS = ("created_day", "restaurant", "delivered", "canceled", "total_cents", "item_count",
+           "discount_percentage", "delivery_minutes")
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def archive_days(root, first_day=None, last_day=None):
+    days = []
+    for name in os.listdir(root):
+        try:
+            day = date.fromisoformat(name)
+        except ValueError:
+            continue  # index/, columns/
+        if (first_day is None or day >= first_day) and (last_day is None or day <= last_day):
+            days.append(name)
+    return sorted(days)
+
+
+def parse_orders(paths):
+    """Columns of the orders in the given <restaurant_id>.jsonl.gz files, and the restaurant ids."""
+    restaurants, codes, created, delivered_at, statuses, totals, items, discounts, deliveries = (
+        [], [], [], [], [], [], [], [], []
+    )
+    for code, path in enumerate(paths):
+        restaurants.append(os.path.basename(path).split(".")[0])
+        with gzip.open(path, "rt") as archive_file:
+            for line in archive_file:
+                order = json.loads(line)
+                codes.append(code)
+                created.append(order["created_at"])
+                delivered_at.append(order.get("delivery_time") or "NaT")
+                statuses.append(order.get("status"))
+                totals.append(order.get("total_price") or "0")
+                items.append(sum((order.get("products") or {}).values()))
+                discounts.append(order.get("discount_percentage") or 0)
+                deliveries.append(order.get("delivery_method") == "delivery")
+
+    statuses = np.array(statuses, dtype=object)
+    created = np.array(created, dtype="datetime64[s]")
+    delivered = statuses == "Delivered"
+    delivery_minutes = (np.array(delivered_at, dtype="datetime64[s]") - created) / np.timedelta64(1, "m")
+    columns = {
+        "created_day": created.astype("datetime64[D]").astype(np.int32),
+        "restaurant": np.array(codes, dtype=np.int32),
+        "delivered": delivered,
+        "canceled": statuses == "Canceled",
+        "total_cents": np.rint(np.array(totals, dtype=np.float64) * 100).astype(np.int64),
+        "item_count": np.array(items, dtype=np.int32),
+        "discount_percentage": np.array(discounts, dtype=np.int16),
+        # Pickups have no delivery time worth reporting
+        "delivery_minutes": np.where(delivered & np.array(deliveries, dtype=bool), delivery_minutes, np.nan),
+    }
+    return columns, restaurants
+
+
+def load_day(root, day):
+    """(columns, restaurant ids) of one archived day, memory-mapped from the column cache."""
+    day_dir = os.path.join(root, day)
+    paths = sorted(os.path.join(day_dir, name) for name in os.listdir(day_dir) if name.endswith(".jsonl.gz"))
+    # The archive only ever appends, so file sizes tell whether the cache is current
+    source = {os.path.basename(path): os.path.getsize(path) for path in paths}
+    cache_dir = os.path.join(root, "columns", day)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        manifest = None
+
+    if manifest is None or manifest["source"] != source:
+        columns, restaurants = parse_orders(paths)
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(cache_dir, f"{name}.npy"), columns[name])
+        # Written last, so a cache interrupted halfway is rebuilt
+        with open(manifest_path, "w") as manifest_file:
+            json.dump({"source": source, "restaurants": restaurants}, manifest_file)
+        return columns, restaurants
+
+    columns = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+    return columns, manifest["restaurants"]
+
+
+def load_archive(root, first_day=None, last_day=None):
+    """Columns of every archived order in the date range, restaurant codes shared across days."""
+    restaurant_codes = {}
+    parts = {name: [] for name in COLUMNS}
+    for day in archive_days(root, first_day, last_day):
+        columns, restaurants = load_day(root, day)
+        codes = np.array([restaurant_codes.setdefault(r, len(restaurant_codes)) for r in restaurants], dtype=np.int32)
+        for name in COLUMNS:
+            parts[name].append(codes[columns[name]] if name == "restaurant" else columns[name])
+    columns = {
+        name: np.concatenate(values) if values else np.empty(0, dtype=np.float64 if name == "delivery_minutes" else np.int64)
+        for name, values in parts.items()
+    }
+    return columns, list(restaurant_codes)
+
+
+def group_percentiles(groups, values, group_count, quantiles=QUANTILES):
+    """Linearly interpolated quantiles of values per group (as np.percentile), NaN values ignored.
+
+    Returns a (group_count, len(quantiles)) array, NaN for groups without values.
+    """
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    result = np.full((group_count, len(quantiles)), np.nan)
+    present = counts > 0
+    for column, quantile in enumerate(quantiles):
+        position = starts[present] + quantile * (counts[present] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        result[present, column] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return result
+
+
+def report(columns, by="restaurant-day"):
+    """Figures per group as a dict of equally long arrays, groups sorted by restaurant and day."""
+    day = columns["created_day"].astype(np.int64)
+    restaurant = columns["restaurant"].astype(np.int64)
+    if by == "restaurant-day":
+        keys = restaurant * (day.max(initial=0) - day.min(initial=0) + 1) + (day - day.min(initial=0))
+    elif by == "restaurant":
+        keys = restaurant
+    else:
+        keys = day
+    unique_keys, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    group_count = len(unique_keys)
+
+    delivered = np.asarray(columns["delivered"], dtype=bool)
+    orders = np.bincount(groups, minlength=group_count)
+    delivered_orders = np.bincount(groups, weights=delivered, minlength=group_count)
+    revenue_cents = np.bincount(groups, weights=np.where(delivered, columns["total_cents"], 0), minlength=group_count)
+    items = np.bincount(groups, weights=np.where(delivered, columns["item_count"], 0), minlength=group_count)
+    discounted = np.bincount(groups, weights=delivered & (np.asarray(columns["discount_percentage"]) > 0),
+                             minlength=group_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        figures = {
+            "restaurant": restaurant[first],
+            "day": day[first],
+            "orders": orders,
+            "delivered": delivered_orders.astype(np.int64),
+            "canceled": np.bincount(groups, weights=columns["canceled"], minlength=group_count).astype(np.int64),
+            "revenue": revenue_cents / 100,
+            "average_basket": revenue_cents / delivered_orders / 100,
+            "average_items": items / delivered_orders,
+            "discount_share": discounted / delivered_orders,
+        }
+    percentiles = group_percentiles(groups, np.asarray(columns["delivery_minutes"], dtype=np.float64), group_count)
+    for column, quantile in enumerate(QUANTILES):
+        figures[f"delivery_minutes_p{round(quantile * 100)}"] = percentiles[:, column]
+    return figures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="first_day", type=date.fromisoformat)
+    parser.add_argument("--to", dest="last_day", type=date.fromisoformat)
+    parser.add_argument("--by", choices=("restaurant-day", "restaurant", "day"), default="restaurant-day")
+    parser.add_argument("--archive-dir", default=os.getenv("ORDER_ARCHIVE_DIR", "order-archive"))
+    args = parser.parse_args()
+
+    columns, restaurants = load_archive(args.archive_dir, args.first_day, args.last_day)
+    figures = report(columns, args.by)
+    names = [name for name in figures if not (name == "day" and args.by == "restaurant")
+             and not (name == "restaurant" and args.by == "day")]
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["restaurant_id" if name == "restaurant" else name for name in names])
+    for row in range(len(figures["orders"])):
+        values = []
+        for name in names:
+            value = figures[name][row]
+            if name == "restaurant":
+                values.append(restaurants[value])
+            elif name == "day":
+                values.append(np.datetime64(int(value), "D"))
+            elif isinstance(value, np.floating):
+                values.append("" if np.isnan(value) else round(float(value), 2))
+            else:
+                values.append(int(value))
+        writer.writerow(values)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import numpy as np
+
+from archive import OrderArchive
+from order_analytics import group_percentiles, load_archive, load_day, report
+
+
+def archived_order(restaurant_id, created_at, status="Delivered", total_price="10.00", minutes=30,
+                   discount_percentage=None, delivery_method="delivery"):
+    return {
+        "order_id": uuid4(), "restaurant_id": restaurant_id, "created_at": created_at, "status": status,
+        "total_price": total_price, "products": {uuid4(): 2, uuid4(): 1},
+        "discount_percentage": discount_percentage, "delivery_method": delivery_method,
+        "delivery_time": created_at + timedelta(minutes=minutes) if status == "Delivered" else None,
+    }
+
+
+class GroupPercentilesTest(unittest.TestCase):
+    def test_matches_numpy_percentile_per_group(self):
+        rng = np.random.default_rng(7)
+        groups = rng.integers(0, 5, 500)
+        values = rng.exponential(30, 500)
+        values[rng.random(500) < 0.1] = np.nan
+        result = group_percentiles(groups, values, 6, (0.5, 0.9, 0.99))
+        for group in range(5):
+            in_group = values[(groups == group) & ~np.isnan(values)]
+            np.testing.assert_allclose(result[group], np.percentile(in_group, [50, 90, 99]))
+        self.assertTrue(np.isnan(result[5]).all())
+
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = OrderArchive(self.directory.name)
+        self.first, self.second = uuid4(), uuid4()
+        day = datetime(2025, 3, 1, 12)
+        self.archive.write([
+            archived_order(self.first, day, total_price="10.00", minutes=20, discount_percentage=10),
+            archived_order(self.first, day, total_price="30.50", minutes=40),
+            archived_order(self.first, day, status="Canceled", total_price="99.00"),
+            archived_order(self.first, day, total_price="5.00", minutes=500, delivery_method="pickup"),
+            archived_order(self.first, day + timedelta(days=1), total_price="12.00"),
+            archived_order(self.second, day, total_price="8.25", minutes=35),
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_figures_per_restaurant_and_day(self):
+        columns, restaurants = load_archive(self.directory.name)
+        figures = report(columns)
+        rows = {
+            (restaurants[figures["restaurant"][row]], str(np.datetime64(int(figures["day"][row]), "D"))): row
+            for row in range(len(figures["orders"]))
+        }
+        row = rows[(str(self.first), "2025-03-01")]
+        self.assertEqual(figures["orders"][row], 4)
+        self.assertEqual(figures["delivered"][row], 3)
+        self.assertEqual(figures["canceled"][row], 1)
+        self.assertAlmostEqual(figures["revenue"][row], 45.50)
+        self.assertAlmostEqual(figures["average_basket"][row], 45.50 / 3)
+        self.assertAlmostEqual(figures["average_items"][row], 3)
+        self.assertAlmostEqual(figures["discount_share"][row], 1 / 3)
+        # The pickup is not a delivery time
+        self.assertAlmostEqual(figures["delivery_minutes_p50"][row], 30)
+        self.assertEqual(len(rows), 3)
+
+    def test_by_restaurant(self):
+        columns, restaurants = load_archive(self.directory.name)
+        figures = report(columns, by="restaurant")
+        revenue = {restaurants[figures["restaurant"][row]]: figures["revenue"][row] for row in range(2)}
+        self.assertAlmostEqual(revenue[str(self.first)], 57.50)
+        self.assertAlmostEqual(revenue[str(self.second)], 8.25)
+
+    def test_column_cache_follows_the_archive(self):
+        self.assertNotIsInstance(load_day(self.directory.name, "2025-03-01")[0]["total_cents"], np.memmap)
+        self.assertIsInstance(load_day(self.directory.name, "2025-03-01")[0]["total_cents"], np.memmap)
+        columns, _ = load_archive(self.directory.name)
+        self.assertEqual(len(columns["total_cents"]), 6)
+        self.archive.write([archived_order(self.second, datetime(2025, 3, 2, 9))])
+        columns, _ = load_archive(self.directory.name)
+        self.assertEqual(len(columns["total_cents"]), 7)
+        columns, _ = load_archive(self.directory.name, last_day=datetime(2025, 3, 1).date())
+        self.assertEqual(len(columns["total_cents"]), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
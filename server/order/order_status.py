@@ -0,0 +1,28 @@
+"""Order statuses and the transitions allowed between them.
+
+Every status change goes through these tables, so the order service can apply
+a transition as one conditional write: UPDATE ... IF status IN the statuses
+the new one may follow.
+"""
+
+ORDER_TRANSITIONS = {
+    "Pending": ("In Progress", "Delivered", "Canceled"),
+    "In Progress": ("Delivered", "Canceled"),
+    "Delivered": (),
+    "Canceled": (),
+}
+
+ORDER_STATUSES = tuple(ORDER_TRANSITIONS)
+OPEN_ORDER_STATUSES = tuple(status for status, following in ORDER_TRANSITIONS.items() if following)
+CLOSED_ORDER_STATUSES = tuple(status for status, following in ORDER_TRANSITIONS.items() if not following)
+# Customers may cancel only until the kitchen starts on the order
+CUSTOMER_CANCELABLE_STATUSES = ("Pending",)
+
+
+def can_transition(current, new):
+    return new in ORDER_TRANSITIONS.get(current, ())
+
+
+def previous_statuses(new):
+    # The statuses an order must be in to move to new
+    return tuple(status for status, following in ORDER_TRANSITIONS.items() if new in following)
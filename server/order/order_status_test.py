@@ -0,0 +1,42 @@
+import unittest
+
+from order_status import (
+    CLOSED_ORDER_STATUSES,
+    OPEN_ORDER_STATUSES,
+    ORDER_STATUSES,
+    can_transition,
+    previous_statuses,
+)
+
+
+class OrderStatusTest(unittest.TestCase):
+    def test_open_and_closed_split_all_statuses(self):
+        self.assertEqual(OPEN_ORDER_STATUSES, ("Pending", "In Progress"))
+        self.assertEqual(CLOSED_ORDER_STATUSES, ("Delivered", "Canceled"))
+        self.assertEqual(set(OPEN_ORDER_STATUSES + CLOSED_ORDER_STATUSES), set(ORDER_STATUSES))
+
+    def test_closed_orders_stay_closed(self):
+        for closed in CLOSED_ORDER_STATUSES:
+            for status in ORDER_STATUSES:
+                self.assertFalse(can_transition(closed, status))
+
+    def test_no_transition_back_or_to_itself(self):
+        self.assertTrue(can_transition("Pending", "In Progress"))
+        self.assertFalse(can_transition("In Progress", "Pending"))
+        for status in ORDER_STATUSES:
+            self.assertFalse(can_transition(status, status))
+
+    def test_previous_statuses_match_transitions(self):
+        for new in ORDER_STATUSES:
+            for current in ORDER_STATUSES:
+                self.assertEqual(current in previous_statuses(new), can_transition(current, new))
+        self.assertEqual(previous_statuses("Pending"), ())
+        self.assertEqual(previous_statuses("Delivered"), ("Pending", "In Progress"))
+
+    def test_unknown_status(self):
+        self.assertFalse(can_transition("Lost", "Pending"))
+        self.assertEqual(previous_statuses("Lost"), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,22 @@
-from datetime import datetime, timedelta
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional
 from uuid import UUID
 from uuid import uuid4
 
 from cassandra.cluster import Cluster
-from fastapi import FastAPI, HTTPException, Depends, status
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+from cassandra.query import BatchStatement, ValueSequence
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 
@@ -20,6 +32,19 @@ from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
 from geopy.exc import GeocoderTimedOut
 
+from cache import TTLCache, VersionedCache
+from archive import OrderArchive
+from archive_orders import archive_rows
+from batching import OrderBatcher, PendingOrder
+from dispatch import CourierDispatcher
+from eta import EtaEstimator
+from feed import EventFeed, FeedOverflow
+from geo import CourierIndex
+from order_status import (
+    CLOSED_ORDER_STATUSES, CUSTOMER_CANCELABLE_STATUSES, OPEN_ORDER_STATUSES, ORDER_STATUSES, previous_statuses
+)
+from pricing import delivery_fee_cents, from_cents, menu_to_cents, price_basket, price_baskets, to_cents
+
 # Initialize FastAPI app
 app = FastAPI(title="Order Microservice")
 
@@ -27,6 +52,7 @@ app = FastAPI(title="Order Microservice")
 # Security configurations
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 SECRET_KEY = "your-secret-key"  # Move to environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -45,19 +71,367 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_stream_user(header_token: Optional[str] = Depends(optional_oauth2_scheme), token: Optional[str] = None):
+    # EventSource cannot send headers, so streams also take the token as ?token=
+    if not (header_token or token):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await get_current_user(header_token or token)
+
 # Database connection
-# def get_db_session():
-#     cluster = Cluster(['host.docker.internal'], protocol_version=4)
-#     session = cluster.connect('pantastic')
-#     return session
+db_session = None
 
 def get_db_session():
-    import os
-    # Get the Cassandra host from the environment variable
-    cassandra_host = os.getenv("CASSANDRA_HOST", "127.0.0.1")  # Default to localhost if not set
-    cluster = Cluster([cassandra_host], protocol_version=4)
-    session = cluster.connect('pantastic')  # Replace 'pantastic' with your keyspace name
-    return session
+    # One Cluster per process, shared by requests and the background batch assigner
+    global db_session
+    if db_session is None:
+        # Get the Cassandra host from the environment variable
+        cassandra_host = os.getenv("CASSANDRA_HOST", "127.0.0.1")  # Default to localhost if not set
+        cluster = Cluster([cassandra_host], protocol_version=4)
+        db_session = cluster.connect('pantastic')  # Replace 'pantastic' with your keyspace name
+    return db_session
+
+# Restaurant rows change a few times a day, so they are cached in-process.
+# The restaurant service calls /internal/restaurants/{id}/invalidate on every write,
+# the TTL only bounds staleness if a notification gets lost.
+RESTAURANT_CACHE_TTL_SECONDS = int(os.getenv("RESTAURANT_CACHE_TTL_SECONDS", "300"))
+RESTAURANT_CACHE_MAX_SIZE = int(os.getenv("RESTAURANT_CACHE_MAX_SIZE", "10000"))
+restaurant_cache = TTLCache(ttl=RESTAURANT_CACHE_TTL_SECONDS, max_size=RESTAURANT_CACHE_MAX_SIZE)
+
+def get_restaurant(db, restaurant_id):
+    restaurant_row = restaurant_cache.get(restaurant_id)
+    if restaurant_row is None:
+        restaurant_row = db.execute(
+            "SELECT latitude, longitude, deleted_at FROM restaurants WHERE restaurant_id = %s",
+            [restaurant_id],
+        ).one()
+        if restaurant_row:
+            restaurant_cache.set(restaurant_id, restaurant_row)
+    if restaurant_row and restaurant_row.deleted_at:
+        # Deleted restaurants stay in the table until the restaurant service purges them
+        return None
+    return restaurant_row
+
+# Couriers are claimed per order and released when the order is delivered or canceled.
+# Live positions pushed by the restaurant service let the nearest free courier go first.
+courier_index = CourierIndex()
+dispatcher = CourierDispatcher(index=courier_index)
+
+def finish_delivery(db, order_id, restaurant_id, courier_id):
+    # A batched courier stays busy until every order of the run is done
+    if order_batcher is None or order_batcher.finish(courier_id, order_id):
+        dispatcher.release(db, restaurant_id, courier_id)
+
+def get_delivery_person_details(db, delivery_person_id):
+    delivery_person_row = db.execute(
+        "SELECT name, phone FROM delivery_people WHERE delivery_person_id = %s",
+        [delivery_person_id],
+    ).one()
+    if not delivery_person_row:
+        return None, None
+    return delivery_person_row.name, delivery_person_row.phone
+
+# Order batching: with a window > 0 new orders wait up to that many seconds so
+# orders of one restaurant going to the same neighborhood share one courier run.
+# 0 (the default) assigns a courier inside create_order as before.
+ORDER_BATCH_WINDOW_SECONDS = float(os.getenv("ORDER_BATCH_WINDOW_SECONDS", "0"))
+ORDER_BATCH_MAX_SIZE = int(os.getenv("ORDER_BATCH_MAX_SIZE", "3"))
+ORDER_BATCH_MAX_SPREAD_KM = float(os.getenv("ORDER_BATCH_MAX_SPREAD_KM", "1.5"))
+order_batcher = (
+    OrderBatcher(ORDER_BATCH_WINDOW_SECONDS, ORDER_BATCH_MAX_SIZE, ORDER_BATCH_MAX_SPREAD_KM)
+    if ORDER_BATCH_WINDOW_SECONDS > 0 else None
+)
+
+def assign_due_batches(db):
+    for group in order_batcher.take_due():
+        first = group[0]
+        courier_id = dispatcher.claim(db, first.restaurant_id, near=first.restaurant_location)
+        if not courier_id:
+            order_batcher.requeue(group)
+            continue
+        name, phone = get_delivery_person_details(db, courier_id)
+        order_batcher.start_run(courier_id, group)
+        for pending in group:
+            # Conditional: an order canceled meanwhile must not get a courier (or be
+            # recreated, if it was purged already)
+            result = db.execute(
+                """
+                UPDATE orders SET delivery_person = %s, delivery_person_name = %s, delivery_person_phone = %s
+                WHERE order_id = %s IF status IN %s
+                """,
+                (courier_id, name, phone, pending.order_id, ValueSequence(OPEN_ORDER_STATUSES)),
+            )
+            if not result.was_applied:
+                finish_delivery(db, pending.order_id, first.restaurant_id, courier_id)
+                continue
+            order_events.publish(
+                pending.order_id,
+                "courier_assigned",
+                {"order_id": str(pending.order_id), "delivery_person_name": name, "delivery_person_phone": phone},
+            )
+
+def recover_batched_orders(db):
+    # Orders waiting in the batcher are lost when the process stops. Open orders
+    # of the last ORDER_QUEUE_DAYS days that still have no courier are put back,
+    # re-geocoded since only the address is stored.
+    recovered = 0
+    today = datetime.utcnow().date()
+    for restaurant_row in db.execute("SELECT restaurant_id, latitude, longitude, deleted_at FROM restaurants"):
+        if restaurant_row.deleted_at:
+            continue
+        restaurant_location = (float(restaurant_row.latitude), float(restaurant_row.longitude))
+        for days_ago in range(ORDER_QUEUE_DAYS):
+            rows = db.execute(
+                "SELECT order_id, status, address FROM orders_by_restaurant_status WHERE restaurant_id = %s AND day = %s",
+                (restaurant_row.restaurant_id, today - timedelta(days=days_ago)),
+            )
+            for row in rows:
+                if row.status not in OPEN_ORDER_STATUSES:
+                    continue
+                order_row = db.execute("SELECT delivery_person FROM orders WHERE order_id = %s", [row.order_id]).one()
+                if not order_row or order_row.delivery_person:
+                    continue
+                try:
+                    destination = get_lat_long(row.address)
+                except HTTPException:
+                    # Pickups and addresses that no longer resolve are grouped from the restaurant
+                    destination = restaurant_location
+                order_batcher.add(PendingOrder(
+                    row.order_id, restaurant_row.restaurant_id, restaurant_location, destination, time.monotonic()
+                ))
+                recovered += 1
+    return recovered
+
+async def assign_batches_periodically():
+    # Recovery runs before the first round, so no recovered order is in flight twice
+    try:
+        recovered = await asyncio.to_thread(recover_batched_orders, get_db_session())
+        if recovered:
+            print(f"Recovered {recovered} orders without a courier")
+    except Exception as e:
+        print(f"Failed to recover batched orders: {str(e)}")
+    while True:
+        await asyncio.sleep(min(ORDER_BATCH_WINDOW_SECONDS, 1))
+        try:
+            await asyncio.to_thread(assign_due_batches, get_db_session())
+        except Exception as e:
+            print(f"Failed to assign order batches: {str(e)}")
+
+@app.on_event("startup")
+async def start_batch_assigner():
+    if order_batcher is not None:
+        asyncio.create_task(assign_batches_periodically())
+
+# Delivery estimates per restaurant: prep time averages learned from delivered
+# orders (stored in restaurant_prep_times) plus the open orders of the
+# restaurant. Those are recounted from orders_by_restaurant_status on every
+# refresh, so all instances agree and a restart does not reset them; in between
+# each instance adjusts the counts for the orders it opens and closes.
+ETA_REFRESH_SECONDS = int(os.getenv("ETA_REFRESH_SECONDS", "60"))
+eta_estimator = EtaEstimator()
+
+def refresh_prep_times(db):
+    rows = db.execute("SELECT restaurant_id, prep_minutes, samples FROM restaurant_prep_times")
+    for row in rows:
+        eta_estimator.load_prep_minutes(row.restaurant_id, row.prep_minutes, row.samples)
+
+def record_delivery(db, order_row, delivered_at):
+    if order_row.delivery_distance_km is None:
+        # Orders stored before distances were kept say nothing about prep time
+        return
+    fulfilment_minutes = (delivered_at - order_row.created_at).total_seconds() / 60
+    prep_minutes, samples = eta_estimator.record_delivery(
+        order_row.restaurant_id, fulfilment_minutes, order_row.delivery_distance_km
+    )
+    db.execute(
+        "UPDATE restaurant_prep_times SET prep_minutes = %s, samples = %s, updated_at = %s WHERE restaurant_id = %s",
+        (prep_minutes, samples, delivered_at, order_row.restaurant_id),
+    )
+
+def refresh_open_orders(db):
+    today = datetime.utcnow().date()
+    restaurant_ids = [row.restaurant_id for row in db.execute("SELECT restaurant_id, deleted_at FROM restaurants")
+                      if not row.deleted_at]
+    partitions = [(restaurant_id, today - timedelta(days=days_ago))
+                  for restaurant_id in restaurant_ids for days_ago in range(ORDER_QUEUE_DAYS)]
+    results = execute_concurrent_with_args(
+        db, "SELECT status FROM orders_by_restaurant_status WHERE restaurant_id = %s AND day = %s",
+        partitions, concurrency=32,
+    )
+    open_orders = dict.fromkeys(restaurant_ids, 0)
+    for (restaurant_id, _), (_, rows) in zip(partitions, results):
+        open_orders[restaurant_id] += sum(1 for row in rows if row.status in OPEN_ORDER_STATUSES)
+    for restaurant_id, count in open_orders.items():
+        eta_estimator.set_open_orders(restaurant_id, count)
+
+async def refresh_prep_times_periodically():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_prep_times, get_db_session())
+            await asyncio.to_thread(refresh_open_orders, get_db_session())
+        except Exception as e:
+            print(f"Failed to refresh delivery estimates: {str(e)}")
+        await asyncio.sleep(ETA_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def start_prep_time_refresher():
+    asyncio.create_task(refresh_prep_times_periodically())
+
+# Status changes are appended to order_status_history. Canceled orders stay in
+# orders with status Canceled; the purge job moves them (and their history) to
+# the order archive once PURGE_RETENTION_DAYS have passed, a whole day of
+# purge_queue at a time, so cancellations no longer leave tombstones in front
+# of live reads. Older closed orders are archived by archive_orders.py after
+# ARCHIVE_AFTER_DAYS; tracking falls back to the archive for both.
+PURGE_RETENTION_DAYS = int(os.getenv("PURGE_RETENTION_DAYS", "7"))
+PURGE_LOOKBACK_DAYS = int(os.getenv("PURGE_LOOKBACK_DAYS", "7"))
+PURGE_INTERVAL_SECONDS = int(os.getenv("PURGE_INTERVAL_SECONDS", "3600"))
+PURGE_CONCURRENCY = 32
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+order_archive = OrderArchive(os.getenv("ORDER_ARCHIVE_DIR", "order-archive"))
+
+def status_change_writes(order_id, status, changed_by, changed_at):
+    writes = [(
+        "INSERT INTO order_status_history (order_id, changed_at, status, changed_by) VALUES (%s, %s, %s, %s)",
+        (order_id, changed_at, status, changed_by),
+    )]
+    if status == "Canceled":
+        writes.append((
+            "INSERT INTO purge_queue (day, kind, id) VALUES (%s, %s, %s)",
+            (changed_at.date(), "order", order_id),
+        ))
+    return writes
+
+def transition_order(db, order_row, new_status, changed_by, changed_at, restaurant_id=None, from_statuses=None,
+                     **columns):
+    # One conditional write per transition: it only applies if the order is in a
+    # status new_status may follow (see order_status.py), or one of
+    # from_statuses, so two workers cannot both deliver an order. With
+    # restaurant_id it also has to belong to that restaurant. order_row is the
+    # order as read before (order_id, customer_id, restaurant_id, created_at and
+    # delivery_person); the write also requires the same courier, so one
+    # assigned meanwhile is not left busy. The history and the views are then
+    # written in one batch. Returns (applied, current status, order_row); the
+    # status is None when the order does not exist or belongs to another
+    # restaurant.
+    assignments = ", ".join(["status = %s"] + [f"{column} = %s" for column in columns])
+    conditions = "status IN %s AND delivery_person = %s"
+    from_statuses = from_statuses or previous_statuses(new_status)
+    if restaurant_id is not None:
+        conditions += " AND restaurant_id = %s"
+    while True:
+        params = [new_status, *columns.values(), order_row.order_id, ValueSequence(from_statuses),
+                  order_row.delivery_person]
+        if restaurant_id is not None:
+            params.append(restaurant_id)
+        result = db.execute(f"UPDATE orders SET {assignments} WHERE order_id = %s IF {conditions}", params)
+        if result.was_applied:
+            break
+        current = result.one()
+        if restaurant_id is not None and getattr(current, "restaurant_id", None) != restaurant_id:
+            return False, None, order_row
+        current_status = getattr(current, "status", None)
+        if current_status not in from_statuses:
+            return False, current_status, order_row
+        # Only the courier changed: one was assigned since order_row was read
+        order_row = order_row._replace(delivery_person=current.delivery_person)
+
+    batch = BatchStatement()
+    for query, params in status_change_writes(order_row.order_id, new_status, changed_by, changed_at):
+        batch.add(query, params)
+    for query, params in view_writes(order_row, {"status": new_status}):
+        batch.add(query, params)
+    db.execute(batch)
+    publish_order_change(order_row, {"status": new_status})
+    return True, new_status, order_row
+
+def purge_days(today):
+    # Days old enough to purge; earlier days are looked at again in case a run failed
+    return [today - timedelta(days=PURGE_RETENTION_DAYS + offset) for offset in range(1, PURGE_LOOKBACK_DAYS + 1)]
+
+def purge_canceled_orders(db):
+    purged = 0
+    for day in purge_days(datetime.utcnow().date()):
+        rows = db.execute("SELECT id FROM purge_queue WHERE day = %s AND kind = %s", (day, "order"))
+        order_ids = [(row.id,) for row in rows]
+        if not order_ids:
+            continue
+        # Archived first, so order history, tracking and analytics keep them
+        order_rows = execute_concurrent_with_args(
+            db, "SELECT * FROM orders WHERE order_id = %s", order_ids, concurrency=PURGE_CONCURRENCY
+        )
+        archive_rows(db, order_archive, [row for _, result in order_rows for row in result],
+                     concurrency=PURGE_CONCURRENCY)
+        execute_concurrent_with_args(
+            db, "DELETE FROM orders WHERE order_id = %s", order_ids, concurrency=PURGE_CONCURRENCY
+        )
+        execute_concurrent_with_args(
+            db, "DELETE FROM order_status_history WHERE order_id = %s", order_ids, concurrency=PURGE_CONCURRENCY
+        )
+        # One range tombstone for the day instead of one per queued order
+        db.execute("DELETE FROM purge_queue WHERE day = %s AND kind = %s", (day, "order"))
+        purged += len(order_ids)
+    return purged
+
+async def purge_periodically():
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        try:
+            purged = await asyncio.to_thread(purge_canceled_orders, get_db_session())
+            if purged:
+                print(f"Purged {purged} canceled orders")
+        except Exception as e:
+            print(f"Failed to purge canceled orders: {str(e)}")
+
+@app.on_event("startup")
+async def start_purger():
+    asyncio.create_task(purge_periodically())
+
+# Menu prices per restaurant, keyed by the menu version the restaurant service
+# bumps on every item change (it notifies /internal/restaurants/{id}/menu-version).
+MENU_CACHE_TTL_SECONDS = int(os.getenv("MENU_CACHE_TTL_SECONDS", "600"))
+MENU_CACHE_MAX_SIZE = int(os.getenv("MENU_CACHE_MAX_SIZE", "5000"))
+menu_cache = VersionedCache(ttl=MENU_CACHE_TTL_SECONDS, max_size=MENU_CACHE_MAX_SIZE)
+
+def get_menu_version(db, restaurant_id):
+    version_row = db.execute(
+        "SELECT version FROM menu_versions WHERE restaurant_id = %s", [restaurant_id]
+    ).one()
+    return version_row.version if version_row else 0
+
+def get_menu_prices(db, restaurant_id):
+    # Returns {item_id: price in cents} for the whole menu of the restaurant
+    item_prices = menu_cache.get(restaurant_id)
+    if item_prices is None:
+        # Read the version first so a concurrent edit makes this load stale, not wrong
+        version = get_menu_version(db, restaurant_id)
+        rows = db.execute(
+            "SELECT item_id, price, deleted_at FROM items WHERE restaurant_id = %s ALLOW FILTERING",
+            [restaurant_id],
+        )
+        item_prices = menu_to_cents({row.item_id: row.price for row in rows if row.deleted_at is None})
+        menu_cache.set(restaurant_id, version, item_prices)
+    return item_prices
+
+# Discount rows carry a Cassandra TTL derived from expires_at. Active codes are
+# cached until they expire, capped so deletions by the admin API are picked up.
+DISCOUNT_CACHE_MAX_TTL_SECONDS = int(os.getenv("DISCOUNT_CACHE_MAX_TTL_SECONDS", "300"))
+discount_cache = TTLCache(ttl=DISCOUNT_CACHE_MAX_TTL_SECONDS, max_size=100000)
+
+def get_active_discount(db, discount_code):
+    discount_row = discount_cache.get(discount_code)
+    if discount_row is None:
+        discount_row = db.execute(
+            "SELECT discount_percentage, expires_at FROM discounts_by_code WHERE discount_code = %s",
+            [discount_code],
+        ).one()
+        if not discount_row:
+            return None
+        # Rows written before discounts had a TTL can still be past their expiry
+        seconds_left = (discount_row.expires_at - datetime.utcnow()).total_seconds()
+        if seconds_left <= 0:
+            return None
+        discount_cache.set(discount_code, discount_row, ttl=min(seconds_left, DISCOUNT_CACHE_MAX_TTL_SECONDS))
+    return discount_row
 
 class Order(BaseModel):
     restaurant_id: UUID
@@ -66,6 +440,7 @@ class Order(BaseModel):
     payment_method: str
     delivery_method: str  # "delivery" or "pickup"
     address: Optional[str] = None  # Required if delivery_method is "delivery"
+    quote_id: Optional[str] = None  # From POST /orders/quote, skips re-pricing while valid
 
 class UpdateOrderRequest(BaseModel):
     order_id: UUID
@@ -88,19 +463,55 @@ class Discount(BaseModel):
 class AddDiscountRequest(BaseModel):
     discounts: List[Discount]
 
-# Helper function to check if the user is a worker
+class CourierPosition(BaseModel):
+    delivery_person_id: UUID
+    latitude: float
+    longitude: float
+
+class BulkOrderRequest(BaseModel):
+    orders: List[Order]
+
+Worker = namedtuple("Worker", ["worker_id", "restaurant_id"])
+
+# Workers made before restaurant assignments keep updating any order until they
+# are assigned (see assign_workers.py); set to 0 once every worker is
+UNASSIGNED_WORKERS_ALLOWED = os.getenv("UNASSIGNED_WORKERS_ALLOWED", "1") == "1"
+
+# Helper function to check if the user is a worker; workers act only on the
+# orders of the restaurant they are assigned to (customers.restaurant_id)
 def verify_worker(
-    current_user: str = Depends(get_current_user),  # Now returns a string
+    current_user: UUID = Depends(get_current_user),
     session: Session = Depends(get_db_session),
 ):
-    user_query = "SELECT worker FROM customers WHERE customer_id = %s"
+    user_query = "SELECT worker, restaurant_id FROM customers WHERE customer_id = %s"
     user_result = session.execute(user_query, [current_user]).one()
 
     if not user_result or user_result.worker != 1:
         raise HTTPException(status_code=403, detail="Worker privileges required")
+    if not user_result.restaurant_id and not UNASSIGNED_WORKERS_ALLOWED:
+        raise HTTPException(status_code=403, detail="Worker is not assigned to a restaurant")
+
+    return Worker(current_user, user_result.restaurant_id)
+
+# Helper function to check if the user is an admin
+def verify_admin(
+    current_user: UUID = Depends(get_current_user),
+    session: Session = Depends(get_db_session),
+):
+    user_query = "SELECT admin FROM customers WHERE customer_id = %s"
+    user_result = session.execute(user_query, [current_user]).one()
+
+    if not user_result or user_result.admin != 1:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
 
     return current_user
 
+def to_utc_naive(value: datetime):
+    # Cassandra timestamps in this service are naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 def get_lat_long(address):
     geolocator = Nominatim(user_agent="myGeocoder", timeout=10)  # Set a timeout
     try:
@@ -123,42 +534,165 @@ def get_lat_long(address):
             detail=f"An error occurred while processing the address: {str(e)}",
         )
 
-@app.post("/orders")
-async def create_order(
-    order: Order,
-    current_user: UUID = Depends(get_current_user),
-    db=Depends(get_db_session),
-):
-    if order.delivery_method == "delivery" and not order.address:
-        raise HTTPException(status_code=400, detail="Address is required for delivery")
-
-    order_id = uuid4()
-    delivery_person = None
-    delivery_person_name = None
-    delivery_person_phone = None
-    restaurant_id = order.restaurant_id
-
-    restaurant_row = db.execute(
-        "SELECT latitude, longitude FROM restaurants WHERE restaurant_id = %s",
-        [restaurant_id],
-    ).one()
+INSERT_ORDER_QUERY = """
+    INSERT INTO orders (order_id, customer_id, restaurant_id, products, total_price, discount, payment_method,
+                        delivery_method, address, status, created_at, estimated_delivery_time, delivery_person,
+                        delivery_person_name, delivery_person_phone, delivery_fee, delivery_distance_km,
+                        item_prices, discount_percentage, discount_code)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Result of pricing an order, amounts in cents; item_prices are the unit prices
+# of the ordered items
+Pricing = namedtuple(
+    "Pricing", ["total_price", "delivery_fee", "distance_km", "item_prices", "discount_percentage"]
+)
+
+def order_insert_params(order_id, current_user, order: Order, pricing: Pricing, created_at, estimated_delivery_time,
+                        courier):
+    # courier is the (delivery_person, name, phone) triple from claim_courier
+    delivery_person, delivery_person_name, delivery_person_phone = courier
+    return (
+        order_id,
+        current_user,
+        order.restaurant_id,
+        order.products,
+        from_cents(pricing.total_price),
+        # discount holds the applied percentage, as the cart endpoints store it;
+        # the code itself goes to discount_code
+        pricing.discount_percentage,
+        order.payment_method,
+        order.delivery_method,
+        order.address,
+        "Pending",
+        created_at,
+        estimated_delivery_time,
+        delivery_person,
+        delivery_person_name,
+        delivery_person_phone,
+        from_cents(pricing.delivery_fee),
+        pricing.distance_km,
+        {item_id: from_cents(price) for item_id, price in pricing.item_prices.items()},
+        pricing.discount_percentage,
+        order.discount,
+    )
 
-    if not restaurant_row:
-        raise HTTPException(
-            status_code=404,
-            detail="Restaurant not found",
+# Worker queues: orders_by_restaurant_status has one partition per restaurant
+# and day, clustered by creation time. The status is updated in place on every
+# transition, so the queue never collects tombstones; rows expire after a week.
+ORDER_QUEUE_DAYS = int(os.getenv("ORDER_QUEUE_DAYS", "2"))
+
+INSERT_QUEUE_QUERY = """
+    INSERT INTO orders_by_restaurant_status (restaurant_id, day, order_id, customer_id, status, created_at,
+                                             products, delivery_method, address, estimated_delivery_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Kitchen screens subscribe to /orders/feed and get every queue change of
+# their restaurant pushed (order_created, status_changed, order_updated)
+FEED_HISTORY_SIZE = int(os.getenv("FEED_HISTORY_SIZE", "500"))
+FEED_BUFFER_SIZE = int(os.getenv("FEED_BUFFER_SIZE", "100"))
+FEED_PING_SECONDS = int(os.getenv("FEED_PING_SECONDS", "20"))
+kitchen_feed = EventFeed(history_size=FEED_HISTORY_SIZE, buffer_size=FEED_BUFFER_SIZE)
+
+# Customers follow their order on /orders/{id}/events (SSE) or by long-polling
+# /orders/{id}/status with If-None-Match; both are woken by order_events
+ORDER_EVENTS_MAX_ORDERS = int(os.getenv("ORDER_EVENTS_MAX_ORDERS", "10000"))
+LONG_POLL_SECONDS = int(os.getenv("LONG_POLL_SECONDS", "25"))
+order_events = EventFeed(history_size=20, buffer_size=20, max_keys=ORDER_EVENTS_MAX_ORDERS)
+
+def queue_entry(order_id, current_user, order: Order, created_at, estimated_delivery_time):
+    return {
+        "order_id": order_id,
+        "customer_id": current_user,
+        "status": "Pending",
+        "created_at": created_at,
+        "products": order.products,
+        "delivery_method": order.delivery_method,
+        "address": order.address,
+        "estimated_delivery_time": estimated_delivery_time,
+    }
+
+# Order history: orders_by_customer holds a summary of every order of a
+# customer, newest first, for GET /orders
+ORDER_HISTORY_MAX_PAGE_SIZE = 100
+
+INSERT_HISTORY_QUERY = """
+    INSERT INTO orders_by_customer (customer_id, created_at, order_id, restaurant_id, status, total_price, item_count)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+QUEUE_COLUMNS = ("status", "products", "delivery_method", "address", "estimated_delivery_time")
+HISTORY_COLUMNS = ("status", "total_price", "item_count")
+
+def order_writes(entry, order: Order, pricing: Pricing, courier):
+    # The order, its queue entry and its history summary are written in one
+    # logged batch, so a stored order always shows up in both
+    batch = BatchStatement()
+    batch.add(
+        INSERT_ORDER_QUERY,
+        order_insert_params(entry["order_id"], entry["customer_id"], order, pricing, entry["created_at"],
+                            entry["estimated_delivery_time"], courier),
+    )
+    batch.add(INSERT_QUEUE_QUERY, (order.restaurant_id, entry["created_at"].date(), *entry.values()))
+    batch.add(
+        INSERT_HISTORY_QUERY,
+        (entry["customer_id"], entry["created_at"], entry["order_id"], order.restaurant_id, entry["status"],
+         from_cents(pricing.total_price), sum(order.products.values())),
+    )
+    return batch
+
+def view_writes(order_row, columns):
+    # Statements mirroring changed order columns into orders_by_restaurant_status
+    # and orders_by_customer; order_row needs order_id, customer_id,
+    # restaurant_id and created_at
+    queued = {column: value for column, value in columns.items() if column in QUEUE_COLUMNS}
+    summary = {column: value for column, value in columns.items() if column in HISTORY_COLUMNS}
+    writes = []
+    if queued:
+        writes.append((
+            f"""
+            UPDATE orders_by_restaurant_status SET {", ".join(f"{column} = %s" for column in queued)}
+            WHERE restaurant_id = %s AND day = %s AND created_at = %s AND order_id = %s
+            """,
+            [*queued.values(), order_row.restaurant_id, order_row.created_at.date(), order_row.created_at,
+             order_row.order_id],
+        ))
+    if summary:
+        writes.append((
+            f"""
+            UPDATE orders_by_customer SET {", ".join(f"{column} = %s" for column in summary)}
+            WHERE customer_id = %s AND created_at = %s AND order_id = %s
+            """,
+            [*summary.values(), order_row.customer_id, order_row.created_at, order_row.order_id],
+        ))
+    return writes
+
+def publish_order_change(order_row, columns):
+    event_type = "status_changed" if "status" in columns else "order_updated"
+    queued = {column: value for column, value in columns.items() if column in QUEUE_COLUMNS}
+    if queued:
+        kitchen_feed.publish(
+            order_row.restaurant_id, event_type, jsonable_encoder({"order_id": order_row.order_id, **queued})
         )
-
+    order_events.publish(order_row.order_id, event_type, jsonable_encoder({"order_id": order_row.order_id, **columns}))
+
+def update_order_views(db, order_row, **columns):
+    # Writes both views in one batch and tells the feeds
+    if "products" in columns:
+        columns["item_count"] = sum(columns["products"].values())
+    writes = view_writes(order_row, columns)
+    if writes:
+        batch = BatchStatement()
+        for query, params in writes:
+            batch.add(query, params)
+        db.execute(batch)
+    publish_order_change(order_row, columns)
+
+def delivery_fee_for(restaurant_row, delivery_coordinates):
+    # Returns (delivery_fee in cents, distance_km)
     restaurant_coordinates = (restaurant_row.latitude, restaurant_row.longitude)
 
-    # Fetch delivery address coordinates
-    delivery_coordinates = get_lat_long(order.address)
-    if not delivery_coordinates:
-        raise HTTPException(
-            status_code=400,
-            detail="Could not retrieve coordinates for the delivery address",
-        )
-
     # Calculate the distance between the restaurant and the delivery address
     distance_km = geodesic(restaurant_coordinates, delivery_coordinates).km
 
@@ -169,115 +703,534 @@ async def create_order(
             detail=f"Delivery distance of {distance_km:.2f} km exceeds the maximum allowed distance of 20 km",
         )
 
-    # Calculate the delivery fee
-    delivery_coefficient = 2.5  # Example coefficient (you can adjust this value)
-    delivery_fee = delivery_coefficient * distance_km
-
-
-  # Fetch all item prices in a single query
-    placeholders = ','.join(['%s'] * len(order.products.keys()))
-    query = f"SELECT item_id, price FROM items WHERE restaurant_id = %s AND item_id IN ({placeholders}) ALLOW FILTERING"
-    params = [restaurant_id] + list(order.products.keys())  # Convert dict_keys to a list
-
-    rows = db.execute(query, params)
-
-
-    # Build a dictionary of item prices
-    item_prices = {row.item_id: row.price for row in rows}
+    return delivery_fee_cents(distance_km), distance_km
 
-    # Calculate the total price
-    total_price = 0
-    for item_id, quantity in order.products.items():
+def check_items(products, item_prices):
+    for item_id in products:
         if item_id not in item_prices:
             raise HTTPException(
                 status_code=404,
                 detail=f"Item with ID {item_id} not found in the specified restaurant",
             )
-        total_price += item_prices[item_id] * quantity
 
-    # Apply discount if provided
+def order_basket(db, order: Order, restaurant_row, delivery_coordinates):
+    # Everything pricing needs: (products, menu prices, discount_percentage, delivery_fee, distance_km)
+    delivery_fee, distance_km = delivery_fee_for(restaurant_row, delivery_coordinates)
+
+    # Item prices come from the cached menu of the restaurant
+    menu_prices = get_menu_prices(db, order.restaurant_id)
+
+    discount_percentage = None
     if order.discount:
-        discount_row = db.execute(
-            "SELECT discount_percentage, expires_at FROM discounts WHERE discount_code = %s",
-            [order.discount],
-        ).one()
+        discount_row = get_active_discount(db, order.discount)
         if not discount_row:
-            raise HTTPException(status_code=404, detail="Invalid discount code")
-        if discount_row.expires_at < datetime.utcnow():
-            raise HTTPException(status_code=400, detail="Discount code has expired")
+            raise HTTPException(status_code=404, detail="Invalid or expired discount code")
         discount_percentage = discount_row.discount_percentage
-        total_price -= total_price * (discount_percentage / 100)
 
-    total_price = float(total_price)
-    total_price += delivery_fee  # Add delivery fee to the total price
+    check_items(order.products, menu_prices)
+    return order.products, menu_prices, discount_percentage, delivery_fee, distance_km
+
+def basket_pricing(basket, price):
+    products, menu_prices, discount_percentage, delivery_fee, distance_km = basket
+    # The order keeps what each item cost, so edits can be re-priced without the menu
+    item_prices = {item_id: menu_prices[item_id] for item_id in products}
+    return Pricing(price.total, delivery_fee, distance_km, item_prices, discount_percentage)
+
+def price_order(db, order: Order, restaurant_row, delivery_coordinates):
+    basket = order_basket(db, order, restaurant_row, delivery_coordinates)
+    return basket_pricing(basket, price_basket(*basket[:4]))
+
+# Quotes are signed tokens carrying the priced result, so any instance can accept
+# them without a lookup. They are only honoured for the same customer, the same
+# priced fields and the menu version they were computed at.
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "300"))
+QUOTED_FIELDS = {"restaurant_id", "products", "discount", "delivery_method", "address"}
+
+def quoted_fields_hash(order: Order):
+    body = json.dumps(jsonable_encoder(order, include=QUOTED_FIELDS), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def create_quote(order: Order, current_user, pricing: Pricing, delivery_coordinates):
+    expires_at = datetime.utcnow() + timedelta(seconds=QUOTE_TTL_SECONDS)
+    # No "sub" claim, so a quote can never pass as an access token
+    claims = {
+        "customer_id": str(current_user),
+        "order": quoted_fields_hash(order),
+        "menu_version": menu_cache.get_version(order.restaurant_id),
+        "currency_unit": "cents",
+        "total_price": pricing.total_price,
+        "delivery_fee": pricing.delivery_fee,
+        "distance_km": pricing.distance_km,
+        "item_prices": {str(item_id): price for item_id, price in pricing.item_prices.items()},
+        "discount_percentage": pricing.discount_percentage,
+        "delivery_coordinates": list(delivery_coordinates),
+        "exp": expires_at,
+    }
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM), expires_at
+
+def valid_quote(order: Order, current_user):
+    # The quote claims if they still apply to this order, otherwise None
+    if not order.quote_id:
+        return None
+    try:
+        claims = jwt.decode(order.quote_id, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp"]})
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid quote")
+    if (
+        claims.get("customer_id") != str(current_user)
+        or claims.get("currency_unit") != "cents"
+        or claims.get("order") != quoted_fields_hash(order)
+        or claims.get("menu_version") is None
+        or claims["menu_version"] != menu_cache.get_version(order.restaurant_id)
+    ):
+        return None
+    return claims
+
+def quoted_pricing(claims):
+    return Pricing(
+        claims["total_price"],
+        claims["delivery_fee"],
+        claims["distance_km"],
+        {UUID(item_id): price for item_id, price in claims["item_prices"].items()},
+        claims["discount_percentage"],
+    )
+
+def claim_courier(db, restaurant_id, restaurant_location):
+    # Returns (delivery_person, name, phone); with batching the courier comes later
+    if order_batcher is not None:
+        return None, None, None
 
-    # Retrieve delivery people from the restaurant
-    restaurant_row = db.execute(
-        "SELECT delivery_people FROM restaurants WHERE restaurant_id = %s",
-        [restaurant_id],
-    ).one()
+    # Claim the nearest free courier of the restaurant (least loaded when positions are unknown)
+    delivery_person = dispatcher.claim(db, restaurant_id, near=restaurant_location)
 
-    if not restaurant_row or not restaurant_row.delivery_people:
+    if not delivery_person:
         raise HTTPException(
             status_code=404,
-            detail="No delivery people available for the specified restaurant",
+            detail="No available delivery person for the specified restaurant",
         )
 
-    # Extract delivery people UUIDs and their statuses
-    delivery_people_map = restaurant_row.delivery_people  # This is a map<UUID, TEXT>
-    available_delivery_person = None
+    # Retrieve the delivery person's details from the delivery_people table
+    delivery_person_name, delivery_person_phone = get_delivery_person_details(db, delivery_person)
+    return delivery_person, delivery_person_name, delivery_person_phone
+
+def order_stored(restaurant_id, restaurant_location, delivery_coordinates, entry):
+    eta_estimator.order_opened(restaurant_id)
+    kitchen_feed.publish(restaurant_id, "order_created", jsonable_encoder(entry))
+    if order_batcher is not None:
+        # A courier is assigned when the batching window of the restaurant closes
+        order_batcher.add(
+            PendingOrder(entry["order_id"], restaurant_id, restaurant_location, delivery_coordinates, time.monotonic())
+        )
 
-    for delivery_person_id, status in delivery_people_map.items():
-        if status == "Assigned":  # Check if the delivery person is available
-            available_delivery_person = delivery_person_id
-            break
+def place_order(db, order: Order, current_user, order_id):
+    # Prices the order, assigns a courier and stores it; returns the response body
+    if order.delivery_method == "delivery" and not order.address:
+        raise HTTPException(status_code=400, detail="Address is required for delivery")
+
+    restaurant_id = order.restaurant_id
+
+    restaurant_row = get_restaurant(db, restaurant_id)
 
-    if not available_delivery_person:
+    if not restaurant_row:
         raise HTTPException(
             status_code=404,
-            detail="No available delivery person for the specified restaurant",
+            detail="Restaurant not found",
         )
 
-    # Retrieve the delivery person's details from the delivery_people table
-    delivery_person_row = db.execute(
-        "SELECT name, phone FROM delivery_people WHERE delivery_person_id = %s",
-        [available_delivery_person],
-    ).one()
+    quote = valid_quote(order, current_user)
+    if quote:
+        pricing = quoted_pricing(quote)
+        delivery_coordinates = tuple(quote["delivery_coordinates"])
+    else:
+        # Fetch delivery address coordinates
+        delivery_coordinates = get_lat_long(order.address)
+        if not delivery_coordinates:
+            raise HTTPException(
+                status_code=400,
+                detail="Could not retrieve coordinates for the delivery address",
+            )
 
-    if delivery_person_row:
-        delivery_person = available_delivery_person
-        delivery_person_name = delivery_person_row.name
-        delivery_person_phone = delivery_person_row.phone
+        pricing = price_order(db, order, restaurant_row, delivery_coordinates)
 
-    estimated_delivery_time = datetime.utcnow() + timedelta(minutes=90)
+    restaurant_location = (float(restaurant_row.latitude), float(restaurant_row.longitude))
+    courier = claim_courier(db, restaurant_id, restaurant_location)
+    delivery_person = courier[0]
+
+    created_at = datetime.utcnow()
+    estimated_delivery_time = created_at + eta_estimator.estimate(restaurant_id, pricing.distance_km)
+    entry = queue_entry(order_id, current_user, order, created_at, estimated_delivery_time)
 
     # Insert the order into the database
+    try:
+        db.execute(order_writes(entry, order, pricing, courier))
+    except Exception:
+        # Do not keep the courier busy for an order that was never stored
+        if delivery_person:
+            dispatcher.release(db, restaurant_id, delivery_person)
+        raise
+
+    order_stored(restaurant_id, restaurant_location, delivery_coordinates, entry)
+    return {
+        "message": "Order created successfully",
+        "order_id": str(order_id),
+        "total_price": float(from_cents(pricing.total_price)),
+        "estimated_delivery_time": estimated_delivery_time.isoformat(),
+    }
+
+@app.post("/orders/quote")
+async def quote_order(
+    order: Order,
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    if order.delivery_method == "delivery" and not order.address:
+        raise HTTPException(status_code=400, detail="Address is required for delivery")
+
+    restaurant_row = get_restaurant(db, order.restaurant_id)
+    if not restaurant_row:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+
+    delivery_coordinates = get_lat_long(order.address)
+    pricing = price_order(db, order, restaurant_row, delivery_coordinates)
+    quote_id, expires_at = create_quote(order, current_user, pricing, delivery_coordinates)
+    return {
+        "quote_id": quote_id,
+        "total_price": float(from_cents(pricing.total_price)),
+        "delivery_fee": float(from_cents(pricing.delivery_fee)),
+        "distance_km": pricing.distance_km,
+        "expires_at": expires_at.isoformat(),
+    }
+
+# Async intake: with ORDER_INTAKE_ASYNC=1, POST /orders only runs the cheap checks,
+# stores the request in order_intake and answers 202. A pool of in-process workers
+# then prices the order, assigns a courier and inserts it under the same order id;
+# clients poll GET /orders/intake/{order_id} for the outcome.
+ORDER_INTAKE_ASYNC = os.getenv("ORDER_INTAKE_ASYNC", "0") == "1"
+ORDER_INTAKE_WORKERS = int(os.getenv("ORDER_INTAKE_WORKERS", "8"))
+ORDER_INTAKE_TTL_SECONDS = int(os.getenv("ORDER_INTAKE_TTL_SECONDS", "86400"))
+ORDER_INTAKE_STALE_SECONDS = 300  # a Processing claim this old was left by a crashed instance
+intake_queue = None
+
+def validate_order(db, order: Order):
+    # Everything that can be checked without geocoding or reading the menu
+    if order.delivery_method == "delivery" and not order.address:
+        raise HTTPException(status_code=400, detail="Address is required for delivery")
+    if not order.products or any(quantity <= 0 for quantity in order.products.values()):
+        raise HTTPException(status_code=400, detail="Order must contain items with positive quantities")
+    if not get_restaurant(db, order.restaurant_id):
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+
+def enqueue_order(db, order: Order, current_user, order_id):
+    validate_order(db, order)
+    now = datetime.utcnow()
+    db.execute(
+        """
+        INSERT INTO order_intake (order_id, customer_id, request, status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        USING TTL %s
+        """,
+        (order_id, current_user, order.model_dump_json(), "Queued", now, now, ORDER_INTAKE_TTL_SECONDS),
+    )
+    intake_queue.put_nowait(order_id)
+    return {"message": "Order accepted", "order_id": str(order_id), "status": "Queued"}
+
+def process_intake(db, order_id):
+    # The claim keeps two workers (or instances) from placing the same order
+    claim = db.execute(
+        """
+        UPDATE order_intake USING TTL %s SET status = %s, updated_at = %s
+        WHERE order_id = %s IF status = %s
+        """,
+        (ORDER_INTAKE_TTL_SECONDS, "Processing", datetime.utcnow(), order_id, "Queued"),
+    )
+    if not claim.was_applied:
+        return
+    intake_row = db.execute(
+        "SELECT customer_id, request FROM order_intake WHERE order_id = %s", [order_id]
+    ).one()
+    try:
+        order = Order.model_validate_json(intake_row.request)
+        result = place_order(db, order, intake_row.customer_id, order_id)
+        status = "Completed"
+    except HTTPException as e:
+        result = {"status_code": e.status_code, "detail": e.detail}
+        status = "Failed"
+    except Exception as e:
+        print(f"Failed to place queued order {order_id}: {str(e)}")
+        result = {"status_code": 500, "detail": "The order could not be placed"}
+        status = "Failed"
     db.execute(
+        "UPDATE order_intake USING TTL %s SET status = %s, result = %s, updated_at = %s WHERE order_id = %s",
+        (ORDER_INTAKE_TTL_SECONDS, status, json.dumps(result), datetime.utcnow(), order_id),
+    )
+
+def recover_intake(db):
+    # Requests left behind by a restart; only read once at startup
+    order_ids = [
+        row.order_id
+        for row in db.execute("SELECT order_id FROM order_intake WHERE status = %s ALLOW FILTERING", ["Queued"])
+    ]
+    stale_before = datetime.utcnow() - timedelta(seconds=ORDER_INTAKE_STALE_SECONDS)
+    rows = db.execute(
+        "SELECT order_id, updated_at FROM order_intake WHERE status = %s ALLOW FILTERING", ["Processing"]
+    )
+    for row in rows:
+        if row.updated_at > stale_before:
+            continue
+        result = db.execute(
+            """
+            UPDATE order_intake USING TTL %s SET status = %s, updated_at = %s
+            WHERE order_id = %s IF status = %s AND updated_at = %s
+            """,
+            (ORDER_INTAKE_TTL_SECONDS, "Queued", datetime.utcnow(), row.order_id, "Processing", row.updated_at),
+        )
+        if result.was_applied:
+            order_ids.append(row.order_id)
+    return order_ids
+
+async def run_intake_worker():
+    while True:
+        order_id = await intake_queue.get()
+        try:
+            await asyncio.to_thread(process_intake, get_db_session(), order_id)
+        except Exception as e:
+            print(f"Failed to process queued order {order_id}: {str(e)}")
+
+@app.on_event("startup")
+async def start_intake_workers():
+    global intake_queue
+    if not ORDER_INTAKE_ASYNC:
+        return
+    intake_queue = asyncio.Queue()
+    try:
+        for order_id in await asyncio.to_thread(recover_intake, get_db_session()):
+            intake_queue.put_nowait(order_id)
+    except Exception as e:
+        print(f"Failed to recover queued orders: {str(e)}")
+    for _ in range(ORDER_INTAKE_WORKERS):
+        asyncio.create_task(run_intake_worker())
+
+def order_response(body):
+    return JSONResponse(status_code=202, content=body) if ORDER_INTAKE_ASYNC else body
+
+# Clients send an Idempotency-Key header when they may retry POST /orders. The
+# first request claims the key with a lightweight transaction and stores its
+# response; retries with the same key get that response back from one read.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def request_fingerprint(order: Order):
+    body = json.dumps(jsonable_encoder(order), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def stored_response(idempotency_row, fingerprint):
+    if idempotency_row.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different order")
+    if idempotency_row.response is None:
+        raise HTTPException(status_code=409, detail="An order with this Idempotency-Key is still being processed")
+    return json.loads(idempotency_row.response)
+
+@app.post("/orders")
+async def create_order(
+    order: Order,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    handle_order = enqueue_order if ORDER_INTAKE_ASYNC else place_order
+    if idempotency_key is None:
+        return order_response(handle_order(db, order, current_user, uuid4()))
+
+    if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+
+    # Keys are scoped to the customer, so clients cannot collide with each other
+    fingerprint = request_fingerprint(order)
+    idempotency_row = db.execute(
+        "SELECT request_hash, response FROM order_idempotency WHERE customer_id = %s AND idempotency_key = %s",
+        [current_user, idempotency_key],
+    ).one()
+    if idempotency_row:
+        return order_response(stored_response(idempotency_row, fingerprint))
+
+    order_id = uuid4()
+    claim = db.execute(
         """
-        INSERT INTO orders (order_id, customer_id, restaurant_id, products, total_price, discount, payment_method,
-                            delivery_method, address, status, created_at, estimated_delivery_time, delivery_person,
-                            delivery_person_name, delivery_person_phone)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO order_idempotency (customer_id, idempotency_key, order_id, request_hash, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+        IF NOT EXISTS
+        USING TTL %s
         """,
-        (
-            order_id,
-            current_user,
-            order.restaurant_id,
-            order.products,
-            total_price,
-            order.discount,
-            order.payment_method,
-            order.delivery_method,
-            order.address,
-            "Pending",
-            datetime.utcnow(),
-            estimated_delivery_time,
-            delivery_person,
-            delivery_person_name,
-            delivery_person_phone,
-        ),
+        (current_user, idempotency_key, order_id, fingerprint, datetime.utcnow(), IDEMPOTENCY_TTL_SECONDS),
     )
-    return {"message": "Order created successfully", "order_id": str(order_id)}
+    if not claim.was_applied:
+        # A concurrent retry claimed the key first
+        return order_response(stored_response(claim.one(), fingerprint))
+
+    try:
+        response = handle_order(db, order, current_user, order_id)
+    except Exception:
+        # Nothing was stored, so a retry with the same key may try again
+        db.execute(
+            "DELETE FROM order_idempotency WHERE customer_id = %s AND idempotency_key = %s",
+            [current_user, idempotency_key],
+        )
+        raise
+
+    db.execute(
+        """
+        UPDATE order_idempotency USING TTL %s SET response = %s
+        WHERE customer_id = %s AND idempotency_key = %s
+        """,
+        (IDEMPOTENCY_TTL_SECONDS, json.dumps(response), current_user, idempotency_key),
+    )
+    return order_response(response)
+
+@app.get("/orders/intake/{order_id}")
+async def get_order_intake_status(
+    order_id: UUID,
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    intake_row = db.execute(
+        "SELECT customer_id, status, result FROM order_intake WHERE order_id = %s", [order_id]
+    ).one()
+    if not intake_row or intake_row.customer_id != current_user:
+        raise HTTPException(status_code=404, detail="Order not found or not authorized")
+
+    response = {"order_id": str(order_id), "status": intake_row.status}
+    if intake_row.status == "Completed":
+        response["result"] = json.loads(intake_row.result)
+    elif intake_row.status == "Failed":
+        response["error"] = json.loads(intake_row.result)
+    return response
+
+# Bulk orders for catering and corporate accounts. Restaurants and addresses shared
+# by several orders are looked up once per request (menus and discounts come from
+# their caches) and the inserts go out concurrently. A plain def, so FastAPI runs
+# it in its threadpool: geocoding and courier claims for up to
+# BULK_ORDER_MAX_SIZE orders would otherwise hold up every feed and long poll.
+BULK_ORDER_MAX_SIZE = int(os.getenv("BULK_ORDER_MAX_SIZE", "200"))
+BULK_ORDER_CONCURRENCY = int(os.getenv("BULK_ORDER_CONCURRENCY", "32"))
+
+@app.post("/orders/bulk")
+def create_orders_bulk(
+    data: BulkOrderRequest,
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    if not 0 < len(data.orders) <= BULK_ORDER_MAX_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"A bulk request takes between 1 and {BULK_ORDER_MAX_SIZE} orders"
+        )
+
+    restaurants = {}  # restaurant_id -> row, or None if it does not exist
+    coordinates = {}  # address -> (latitude, longitude), or the HTTPException geocoding raised
+    results = [None] * len(data.orders)
+    prepared = []  # (index, order, restaurant_location, delivery_coordinates, basket)
+    placed = []  # (index, restaurant_id, restaurant_location, delivery_coordinates, courier, queue entry)
+    statements = []
+
+    def geocode(address):
+        if address not in coordinates:
+            try:
+                coordinates[address] = get_lat_long(address)
+            except HTTPException as e:
+                coordinates[address] = e
+        if isinstance(coordinates[address], HTTPException):
+            raise coordinates[address]
+        return coordinates[address]
+
+    for index, order in enumerate(data.orders):
+        restaurant_id = order.restaurant_id
+        try:
+            if order.delivery_method == "delivery" and not order.address:
+                raise HTTPException(status_code=400, detail="Address is required for delivery")
+            if restaurant_id not in restaurants:
+                restaurants[restaurant_id] = get_restaurant(db, restaurant_id)
+            restaurant_row = restaurants[restaurant_id]
+            if not restaurant_row:
+                raise HTTPException(status_code=404, detail="Restaurant not found")
+            delivery_coordinates = geocode(order.address)
+            basket = order_basket(db, order, restaurant_row, delivery_coordinates)
+        except HTTPException as e:
+            results[index] = {"status": "failed", "status_code": e.status_code, "detail": e.detail}
+            continue
+        except Exception as e:
+            print(f"Failed to prepare bulk order {index}: {str(e)}")
+            results[index] = {"status": "failed", "status_code": 500, "detail": "The order could not be placed"}
+            continue
+        restaurant_location = (float(restaurant_row.latitude), float(restaurant_row.longitude))
+        prepared.append((index, order, restaurant_location, delivery_coordinates, basket))
+
+    # All baskets are priced in one call
+    prices = price_baskets([basket[:4] for *_, basket in prepared])
+    for (index, order, restaurant_location, delivery_coordinates, basket), price in zip(prepared, prices):
+        restaurant_id = order.restaurant_id
+        pricing = basket_pricing(basket, price)
+        try:
+            courier = claim_courier(db, restaurant_id, restaurant_location)
+        except HTTPException as e:
+            results[index] = {"status": "failed", "status_code": e.status_code, "detail": e.detail}
+            continue
+        except Exception as e:
+            # Keep going: couriers claimed for earlier orders are released below if needed
+            print(f"Failed to assign a courier to bulk order {index}: {str(e)}")
+            results[index] = {"status": "failed", "status_code": 500, "detail": "The order could not be placed"}
+            continue
+
+        created_at = datetime.utcnow()
+        estimated_delivery_time = created_at + eta_estimator.estimate(restaurant_id, pricing.distance_km)
+        entry = queue_entry(uuid4(), current_user, order, created_at, estimated_delivery_time)
+        placed.append((index, restaurant_id, restaurant_location, delivery_coordinates, courier, entry))
+        statements.append((order_writes(entry, order, pricing, courier), None))
+
+    writes = execute_concurrent(db, statements, concurrency=BULK_ORDER_CONCURRENCY, raise_on_first_error=False)
+    for (index, restaurant_id, restaurant_location, delivery_coordinates, courier, entry), (success, _) in zip(
+        placed, writes
+    ):
+        if not success:
+            if courier[0]:
+                dispatcher.release(db, restaurant_id, courier[0])
+            results[index] = {"status": "failed", "status_code": 500, "detail": "The order could not be stored"}
+            continue
+        order_stored(restaurant_id, restaurant_location, delivery_coordinates, entry)
+        results[index] = {
+            "status": "created",
+            "order_id": str(entry["order_id"]),
+            "estimated_delivery_time": entry["estimated_delivery_time"].isoformat(),
+        }
+
+    created = sum(result["status"] == "created" for result in results)
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+def reprice_items(db, order_row, products):
+    # Items already on the order keep the price they were ordered at; only newly
+    # added items are looked up, from the menu cache when it has them
+    item_prices = {
+        item_id: to_cents(price) for item_id, price in (order_row.item_prices or {}).items() if item_id in products
+    }
+    if any(item_id not in item_prices for item_id in products):
+        menu_prices = get_menu_prices(db, order_row.restaurant_id)
+        for item_id in products:
+            if item_id not in item_prices and item_id in menu_prices:
+                item_prices[item_id] = menu_prices[item_id]
+    return item_prices
+
+def order_discount_percentage(db, order_row):
+    # Orders stored before discount_percentage existed have the percentage in
+    # discount (cart endpoints) or only their code
+    if order_row.discount_percentage is not None:
+        return order_row.discount_percentage
+    if order_row.discount is not None:
+        return int(order_row.discount)
+    if order_row.discount_code:
+        discount_row = get_active_discount(db, order_row.discount_code)
+        if discount_row:
+            return discount_row.discount_percentage
+    return None
 
 #TODO need to make checks for everything in this function
 @app.put("/orders")
@@ -294,6 +1247,9 @@ async def update_order(
     if not order_row:
         raise HTTPException(status_code=404, detail="Order not found or not authorized")
 
+    if order_row.status in CLOSED_ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Cannot edit a {order_row.status.lower()} order")
+
     if datetime.utcnow() > order_row.created_at + timedelta(minutes=30):
         raise HTTPException(
             status_code=400, detail="Cannot edit the order after 30 minutes of creation"
@@ -303,6 +1259,8 @@ async def update_order(
     params = []
 
     if data.products:
+        if any(quantity <= 0 for quantity in data.products.values()):
+            raise HTTPException(status_code=400, detail="Order must contain items with positive quantities")
         updates.append("products = %s")
         params.append(data.products)
     if data.delivery_method:
@@ -315,10 +1273,49 @@ async def update_order(
     if not updates:
         raise HTTPException(status_code=400, detail="No fields to update")
 
+    estimated_delivery_time = None
+    # Re-price from what changed: the fee only needs geocoding for a new address
+    # (or an order stored before fees were kept), items only for new products
+    address = data.address or order_row.address
+    fee_changed = address != order_row.address or order_row.delivery_fee is None
+    if fee_changed:
+        restaurant_row = get_restaurant(db, order_row.restaurant_id)
+        if not restaurant_row:
+            raise HTTPException(status_code=404, detail="Restaurant not found")
+        delivery_fee, distance_km = delivery_fee_for(restaurant_row, get_lat_long(address))
+        updates += ["delivery_fee = %s", "delivery_distance_km = %s"]
+        params += [from_cents(delivery_fee), distance_km]
+        if data.address:
+            # A new address moves the delivery estimate too
+            estimated_delivery_time = order_row.created_at + eta_estimator.estimate(order_row.restaurant_id, distance_km)
+            updates.append("estimated_delivery_time = %s")
+            params.append(estimated_delivery_time)
+    else:
+        delivery_fee = to_cents(order_row.delivery_fee)
+
+    total_price = order_row.total_price
+    if data.products or fee_changed:
+        products = data.products or order_row.products
+        item_prices = reprice_items(db, order_row, products)
+        check_items(products, item_prices)
+        discount_percentage = order_discount_percentage(db, order_row)
+        total_price = from_cents(price_basket(products, item_prices, discount_percentage, delivery_fee).total)
+        updates += ["total_price = %s", "item_prices = %s", "discount_percentage = %s"]
+        params += [total_price, {item_id: from_cents(price) for item_id, price in item_prices.items()},
+                   discount_percentage]
+
     params.append(data.order_id)
     query = f"UPDATE orders SET {', '.join(updates)} WHERE order_id = %s"
     db.execute(query, params)
-    return {"message": "Order updated successfully"}
+    changed = {
+        "products": data.products,
+        "delivery_method": data.delivery_method,
+        "address": data.address,
+        "estimated_delivery_time": estimated_delivery_time,
+        "total_price": total_price if total_price != order_row.total_price else None,
+    }
+    update_order_views(db, order_row, **{column: value for column, value in changed.items() if value is not None})
+    return {"message": "Order updated successfully", "total_price": float(total_price)}
 
 @app.delete("/orders")
 async def cancel_order(
@@ -334,76 +1331,448 @@ async def cancel_order(
     if not order_row:
         raise HTTPException(status_code=404, detail="Order not found or not authorized")
 
-    if datetime.utcnow() > order_row.estimated_delivery_time - timedelta(minutes=30):
-        raise HTTPException(
-            status_code=400, detail="Cannot cancel the order within 30 minutes of delivery"
-        )
+    if order_row.status in CLOSED_ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Order is already {order_row.status.lower()}")
+
+    if order_row.status not in CUSTOMER_CANCELABLE_STATUSES:
+        raise HTTPException(status_code=400, detail="Cannot cancel an order the kitchen has started")
 
-    db.execute("DELETE FROM orders WHERE order_id = %s", [data.order_id])
+    # Canceling is a status change; the row is purged later (see purge_canceled_orders)
+    applied, current_status, order_row = transition_order(
+        db, order_row, "Canceled", current_user, datetime.utcnow(), from_statuses=CUSTOMER_CANCELABLE_STATUSES
+    )
+    if not applied:
+        if current_status is None:
+            raise HTTPException(status_code=404, detail="Order not found or not authorized")
+        # Delivered (or canceled) since it was read above
+        raise HTTPException(status_code=409, detail=f"Order is already {current_status.lower()}")
+    eta_estimator.order_closed(order_row.restaurant_id)
+    if order_batcher is not None:
+        order_batcher.discard(data.order_id)
+    if order_row.delivery_person:
+        finish_delivery(db, data.order_id, order_row.restaurant_id, order_row.delivery_person)
     return {"message": "Order canceled successfully"}
 
 
-#TODO need to make checks if the worker is working in the resuaurant
 @app.put("/orders/status")
 async def update_order_status(
     data: UpdateOrderStatusRequest,
-    worker: UUID = Depends(verify_worker),
+    worker: Worker = Depends(verify_worker),
     db=Depends(get_db_session),
 ):
-    if data.status not in ["Pending", "In Progress", "Delivered", "Canceled"]:
+    if data.status not in ORDER_STATUSES:
         raise HTTPException(
-            status_code=400, detail="Invalid status. Allowed values are: Pending, In Progress, Delivered, Canceled"
+            status_code=400, detail=f"Invalid status. Allowed values are: {', '.join(ORDER_STATUSES)}"
         )
-    
-    if data.status == "Delivered":
-        order_row = db.execute(
-            "SELECT * FROM orders WHERE order_id = %s ALLOW FILTERING",
-            [data.order_id],
-        ).one()
 
-        if not order_row:
+    # Read once up front: the conditional update returns no columns when it applies
+    order_row = db.execute(
+        """
+        SELECT order_id, customer_id, restaurant_id, created_at, delivery_distance_km, delivery_person
+        FROM orders WHERE order_id = %s
+        """,
+        [data.order_id],
+    ).one()
+    if not order_row or (worker.restaurant_id is not None and order_row.restaurant_id != worker.restaurant_id):
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    changed_at = datetime.utcnow()
+    columns = {"delivery_time": changed_at} if data.status == "Delivered" else {}
+    applied, current_status, order_row = transition_order(
+        db, order_row, data.status, worker.worker_id, changed_at, worker.restaurant_id, **columns
+    )
+    if not applied:
+        if current_status is None:
             raise HTTPException(status_code=404, detail="Order not found")
+        raise HTTPException(
+            status_code=409, detail=f"Order is {current_status}, it cannot be changed to {data.status}"
+        )
 
-        if order_row.status == "Delivered":
-            raise HTTPException(status_code=400, detail="Order is already marked as Delivered")
+    if data.status in CLOSED_ORDER_STATUSES:
+        if data.status == "Delivered":
+            record_delivery(db, order_row, changed_at)
+        # Only open orders can be closed, so this one was counted as open
+        eta_estimator.order_closed(order_row.restaurant_id)
+        if order_batcher is not None:
+            order_batcher.discard(data.order_id)
+        if order_row.delivery_person:
+            finish_delivery(db, data.order_id, order_row.restaurant_id, order_row.delivery_person)
+    return {"message": "Order status updated successfully", "status": data.status}
 
-        delivered_at = datetime.utcnow()
-        db.execute(
-            "UPDATE orders SET delivery_time = %s WHERE order_id = %s",
-            [delivered_at, data.order_id],
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row.created_at.isoformat(), str(row.order_id)]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), UUID(order_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/orders")
+async def list_orders(
+    limit: int = Query(20, ge=1, le=ORDER_HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    # The current user's orders, newest first. Pass next_cursor back as cursor
+    # (with the same filters) for the next page.
+    if status is not None and status not in ORDER_STATUSES:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid status. Allowed values are: {', '.join(ORDER_STATUSES)}"
         )
 
+    # Cassandra does not mix single and multi-column clustering restrictions,
+    # so all of them use the tuple form; a cursor is always below until
+    conditions = ["customer_id = %s"]
+    params = [current_user]
+    if cursor:
+        conditions.append("(created_at, order_id) < (%s, %s)")
+        params += decode_cursor(cursor)
+    elif until:
+        conditions.append("(created_at) < (%s)")
+        params.append(to_utc_naive(until))
+    if since:
+        conditions.append("(created_at) >= (%s)")
+        params.append(to_utc_naive(since))
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+
+    # One row more than asked tells whether there is a next page
+    query = f"""
+        SELECT created_at, order_id, restaurant_id, status, total_price, item_count
+        FROM orders_by_customer WHERE {' AND '.join(conditions)} LIMIT %s
+    """
+    if status:
+        # Filtering inside one customer's partition
+        query += " ALLOW FILTERING"
+    rows = db.execute(query, params + [limit + 1]).all()
+    page = rows[:limit]
+    return {
+        "orders": [row._asdict() for row in page],
+        "next_cursor": encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
+
+@app.get("/orders/queue")
+async def get_order_queue(
+    status: Optional[str] = None,
+    worker: Worker = Depends(verify_worker),
+    db=Depends(get_db_session),
+):
+    # Orders of the worker's restaurant from the last ORDER_QUEUE_DAYS days, oldest
+    # first; all open orders unless a status is given
+    if worker.restaurant_id is None:
+        raise HTTPException(status_code=403, detail="Worker is not assigned to a restaurant")
+    if status is not None and status not in ORDER_STATUSES:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid status. Allowed values are: {', '.join(ORDER_STATUSES)}"
+        )
+    statuses = (status,) if status else OPEN_ORDER_STATUSES
+    today = datetime.utcnow().date()
+    orders = []
+    for days_ago in reversed(range(ORDER_QUEUE_DAYS)):
+        rows = db.execute(
+            """
+            SELECT order_id, customer_id, status, created_at, products, delivery_method, address, estimated_delivery_time
+            FROM orders_by_restaurant_status WHERE restaurant_id = %s AND day = %s
+            """,
+            (worker.restaurant_id, today - timedelta(days=days_ago)),
+        )
+        orders += [row._asdict() for row in rows if row.status in statuses]
+    return orders
+
+@app.websocket("/orders/feed")
+async def order_feed(websocket: WebSocket, token: str, epoch: Optional[str] = None, offset: Optional[int] = None):
+    # Browsers cannot set headers on WebSockets, so the token comes as a query
+    # parameter. After a reconnect pass the epoch and last offset received to
+    # get the missed events; "reset": true in the hello means reload /orders/queue.
+    try:
+        worker = verify_worker(await get_current_user(token), get_db_session())
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    if worker.restaurant_id is None:
+        # The feed is per restaurant, as is /orders/queue
+        await websocket.close(code=1008, reason="Worker is not assigned to a restaurant")
+        return
+
+    await websocket.accept()
+    subscription, backlog, reset = kitchen_feed.subscribe(worker.restaurant_id, epoch, offset)
+    try:
+        await websocket.send_json({"type": "hello", "epoch": kitchen_feed.epoch, "reset": reset})
+        for event in backlog:
+            await websocket.send_json(event)
+        while True:
+            event = await subscription.get(timeout=FEED_PING_SECONDS)
+            # A ping every FEED_PING_SECONDS of silence finds dead connections
+            await websocket.send_json(event or {"type": "ping"})
+    except FeedOverflow:
+        # Too far behind; the client reconnects with its last offset
+        await websocket.close(code=1013, reason="Feed buffer overflow")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        kitchen_feed.unsubscribe(worker.restaurant_id, subscription)
+
+TRACKING_COLUMNS = (
+    "status", "delivery_person_name", "delivery_person_phone", "estimated_delivery_time", "delivery_time"
+)
+
+def may_be_archived(db, order_id, customer_id):
+    # Only closed orders of the customer old enough to be purged or archived
+    # are looked up in the archive; anything else is simply not found
+    summary = db.execute(
+        "SELECT created_at, status FROM orders_by_customer WHERE customer_id = %s AND order_id = %s ALLOW FILTERING",
+        [customer_id, order_id],
+    ).one()
+    archived_before = datetime.utcnow() - timedelta(days=min(PURGE_RETENTION_DAYS, ARCHIVE_AFTER_DAYS))
+    return bool(summary) and summary.status in CLOSED_ORDER_STATUSES and summary.created_at < archived_before
 
-    db.execute(
-        "UPDATE orders SET status = %s WHERE order_id = %s",
-        [data.status, data.order_id],
+async def order_tracking(db, order_id, current_user):
+    # Returns (what a customer sees of the order, its version for ETags)
+    order_row = db.execute(
+        f"SELECT customer_id, {', '.join(TRACKING_COLUMNS)} FROM orders WHERE order_id = %s",
+        [order_id],
+    ).one()
+    if order_row:
+        order = order_row._asdict()
+    elif may_be_archived(db, order_id, current_user):
+        # Reads the archive's index and a gzip member from disk
+        order = await asyncio.to_thread(order_archive.get, order_id)
+    else:
+        order = None
+    if not order or str(order["customer_id"]) != str(current_user):
+        raise HTTPException(status_code=404, detail="Order not found or not authorized")
+    state = jsonable_encoder({"order_id": order_id, **{column: order.get(column) for column in TRACKING_COLUMNS}})
+    version = hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()[:16]
+    return state, version
+
+def sse_message(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/orders/{order_id}/events")
+async def stream_order_events(
+    order_id: UUID,
+    last_event_id: Optional[str] = Header(None),
+    current_user: UUID = Depends(get_stream_user),
+    db=Depends(get_db_session),
+):
+    # Server-sent events: a snapshot of the order, then status changes, courier
+    # assignment and ETA updates until it is delivered or canceled. Browsers
+    # resend the last event id on reconnect and get only what they missed.
+    epoch, _, offset = (last_event_id or "").partition(":")
+    offset = int(offset) if offset.isdigit() else None
+    # Subscribe before reading the order so no change falls in between
+    subscription, backlog, reset = order_events.subscribe(order_id, epoch, offset)
+    try:
+        state, version = await order_tracking(db, order_id, current_user)
+    except HTTPException:
+        order_events.unsubscribe(order_id, subscription)
+        raise
+
+    async def events():
+        try:
+            if offset is None or reset:
+                event_id = f"{order_events.epoch}:{order_events.last_offset(order_id)}"
+                yield sse_message(event_id, "snapshot", {**state, "version": version})
+                if state["status"] in CLOSED_ORDER_STATUSES:
+                    return
+            pending = list(backlog)
+            while True:
+                event = pending.pop(0) if pending else await subscription.get(timeout=FEED_PING_SECONDS)
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_message(f"{order_events.epoch}:{event['offset']}", event["type"], event["data"])
+                if event["data"].get("status") in CLOSED_ORDER_STATUSES:
+                    return
+        except FeedOverflow:
+            # The browser reconnects with its last event id
+            return
+        finally:
+            order_events.unsubscribe(order_id, subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return {"message": "Order status updated successfully"}
-
-
-
-# @app.post("/discounts")
-# async def add_discounts(
-#     data: AddDiscountRequest,
-#     worker: UUID = Depends(verify_worker),
-#     db=Depends(get_db_session),
-# ):
-#     for discount in data.discounts:
-#         discount_id = uuid4()
-#         db.execute(
-#             """
-#             INSERT INTO discounts (discount_id, discount_code, discount_percentage, created_at, expires_at)
-#             VALUES (%s, %s, %s, %s, %s)
-#             """,
-#             (
-#                 discount_id,
-#                 discount.discount_code,
-#                 discount.discount_percentage,
-#                 datetime.utcnow(),
-#                 discount.expires_at,
-#             ),
-#         )
-#     return {"message": "Discounts added successfully"}
+
+@app.get("/orders/{order_id}/status")
+async def get_order_status(
+    order_id: UUID,
+    if_none_match: Optional[str] = Header(None),
+    current_user: UUID = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    # Long-poll fallback for clients without SSE: with the ETag of the last
+    # response in If-None-Match the request waits up to LONG_POLL_SECONDS for a
+    # change and answers 304 if there was none
+    subscription = order_events.subscribe(order_id)[0] if if_none_match else None
+    try:
+        state, version = await order_tracking(db, order_id, current_user)
+        etag = f'"{version}"'
+        if if_none_match == etag and state["status"] not in CLOSED_ORDER_STATUSES:
+            try:
+                if await subscription.get(timeout=LONG_POLL_SECONDS):
+                    state, version = await order_tracking(db, order_id, current_user)
+                    etag = f'"{version}"'
+            except FeedOverflow:
+                pass
+    finally:
+        if subscription is not None:
+            order_events.unsubscribe(order_id, subscription)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(state, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+# /internal/* is only for the restaurant service, which sends INTERNAL_TOKEN in
+# X-Internal-Token; without a configured token every call is refused
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+
+def verify_internal(x_internal_token: Optional[str] = Header(None)):
+    if not INTERNAL_TOKEN or not hmac.compare_digest(x_internal_token or "", INTERNAL_TOKEN):
+        raise HTTPException(status_code=403, detail="Internal endpoint")
+
+@app.post("/internal/restaurants/{restaurant_id}/invalidate", dependencies=[Depends(verify_internal)])
+async def invalidate_restaurant(restaurant_id: UUID):
+    # Called by the restaurant service after it changes a restaurant row
+    restaurant_cache.invalidate(restaurant_id)
+    dispatcher.forget(restaurant_id)
+    return {"message": "Restaurant cache invalidated"}
+
+@app.post("/internal/restaurants/{restaurant_id}/menu-version", dependencies=[Depends(verify_internal)])
+async def menu_version_changed(restaurant_id: UUID, version: int):
+    # Called by the restaurant service after add/update/delete of menu items
+    menu_cache.bump(restaurant_id, version)
+    return {"message": "Menu cache invalidated"}
+
+
+@app.post("/internal/couriers/positions", dependencies=[Depends(verify_internal)])
+async def update_courier_positions(positions: List[CourierPosition]):
+    # Called by the restaurant service with the latest courier positions it received
+    for position in positions:
+        courier_index.update_position(position.delivery_person_id, position.latitude, position.longitude)
+    return {"message": "Courier positions updated", "count": len(positions)}
+
+
+# Bulk discount creation for marketing campaigns
+BULK_DISCOUNT_CONCURRENCY = int(os.getenv("BULK_DISCOUNT_CONCURRENCY", "64"))
+BULK_DISCOUNT_CHUNK_SIZE = 1000
+
+@app.post("/discounts")
+async def add_discounts(
+    data: AddDiscountRequest,
+    admin: UUID = Depends(verify_admin),
+    db=Depends(get_db_session),
+):
+    # discounts_by_code is keyed by the code, so IF NOT EXISTS makes uniqueness a
+    # single lightweight transaction instead of a read-before-write scan
+    insert_by_code = db.prepare(
+        """
+        INSERT INTO discounts_by_code (discount_code, discount_id, discount_percentage, created_by, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        IF NOT EXISTS
+        USING TTL ?
+        """
+    )
+    insert_discount = db.prepare(
+        """
+        INSERT INTO discounts (discount_id, created_by, discount_code, created_at, discount_percentage, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        USING TTL ?
+        """
+    )
+    # Lets the discount Bloom filters of other instances pick the new codes up
+    insert_by_day = db.prepare(
+        "INSERT INTO discount_codes_by_day (day, created_at, discount_code) VALUES (?, ?, ?) USING TTL ?"
+    )
+    release_code = db.prepare("DELETE FROM discounts_by_code WHERE discount_code = ? IF discount_id = ?")
+    delete_discount = db.prepare("DELETE FROM discounts WHERE discount_id = ?")
+
+    def results():
+        started = time.monotonic()
+        counts = {"created": 0, "duplicate": 0, "expired": 0, "invalid": 0, "error": 0}
+
+        for start in range(0, len(data.discounts), BULK_DISCOUNT_CHUNK_SIZE):
+            chunk = data.discounts[start:start + BULK_DISCOUNT_CHUNK_SIZE]
+            created_at = datetime.utcnow()
+            statuses = {}
+            rows = []
+            for index, discount in enumerate(chunk):
+                expires_at = to_utc_naive(discount.expires_at)
+                ttl_seconds = int((expires_at - created_at).total_seconds())
+                if ttl_seconds <= 0:
+                    statuses[index] = "expired"
+                    continue
+                if not 0 < discount.discount_percentage <= 100:
+                    statuses[index] = "invalid"
+                    continue
+                rows.append((index, (discount.discount_code, uuid4(), discount.discount_percentage,
+                                     admin, created_at, expires_at, ttl_seconds)))
+
+            claims = execute_concurrent_with_args(
+                db, insert_by_code, [params for _, params in rows],
+                concurrency=BULK_DISCOUNT_CONCURRENCY, raise_on_first_error=False,
+            )
+            created = []
+            for (index, params), (success, result) in zip(rows, claims):
+                if not success:
+                    statuses[index] = "error"
+                elif not result.was_applied:
+                    statuses[index] = "duplicate"
+                else:
+                    statuses[index] = "created"
+                    code, discount_id, percentage, created_by, created_on, expires_at, ttl_seconds = params
+                    created.append((index, (discount_id, created_by, code, created_on, percentage, expires_at, ttl_seconds)))
+
+            writes = execute_concurrent_with_args(
+                db, insert_discount, [params for _, params in created],
+                concurrency=BULK_DISCOUNT_CONCURRENCY, raise_on_first_error=False,
+            )
+            listed = execute_concurrent_with_args(
+                db, insert_by_day,
+                [(created_on.date(), created_on, code, ttl_seconds)
+                 for _, (_, _, code, created_on, _, _, ttl_seconds) in created],
+                concurrency=BULK_DISCOUNT_CONCURRENCY, raise_on_first_error=False,
+            )
+            failed = [
+                (index, params)
+                for (index, params), (success, _), (listed_ok, _) in zip(created, writes, listed)
+                if not (success and listed_ok)
+            ]
+            # A claimed code is already live at checkout, so a code whose other
+            # writes failed is taken back and can simply be resubmitted
+            released = execute_concurrent_with_args(
+                db, release_code, [(code, discount_id) for _, (discount_id, _, code, *_) in failed],
+                concurrency=BULK_DISCOUNT_CONCURRENCY, raise_on_first_error=False,
+            )
+            execute_concurrent_with_args(
+                db, delete_discount, [(discount_id,) for _, (discount_id, *_) in failed],
+                concurrency=BULK_DISCOUNT_CONCURRENCY, raise_on_first_error=False,
+            )
+            for (index, _), (success, _) in zip(failed, released):
+                # Otherwise it stays live and counts as created
+                if success:
+                    statuses[index] = "error"
+
+            for index, discount in enumerate(chunk):
+                counts[statuses[index]] += 1
+                yield json.dumps({"discount_code": discount.discount_code, "status": statuses[index]}) + "\n"
+
+        elapsed = time.monotonic() - started
+        summary = dict(counts, requested=len(data.discounts), seconds=round(elapsed, 3),
+                       codes_per_second=round(len(data.discounts) / elapsed, 1) if elapsed else None)
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
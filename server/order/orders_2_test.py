@@ -0,0 +1,472 @@
+import json
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from uuid import uuid4
+
+from cassandra.query import BatchStatement, ValueSequence
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import orders_2
+
+
+class FakeSession:
+    """Statements go to handle(query, params), which returns rows or raises."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.executed = []
+
+    def prepare(self, query):
+        return " ".join(query.split())
+
+    def execute(self, query, params=None):
+        if isinstance(query, BatchStatement):
+            # Statements of a batch are recorded one by one, with their values bound
+            for _, statement, _ in query._statements_and_parameters:
+                self.executed.append((" ".join(statement.split()), None))
+            return Applied(True)
+        query = " ".join(str(query).split())
+        self.executed.append((query, params))
+        return self.handle(query, params)
+
+    def queries(self, prefix):
+        return [params for query, params in self.executed if query.startswith(prefix)]
+
+
+def execute_concurrent_with_args(session, statement, parameters, concurrency=None, raise_on_first_error=True):
+    results = []
+    for params in parameters:
+        try:
+            results.append((True, session.execute(statement, params)))
+        except Exception as e:
+            if raise_on_first_error:
+                raise
+            results.append((False, e))
+    return results
+
+
+class Applied(list):
+    def __init__(self, applied, rows=()):
+        super().__init__(rows)
+        self.was_applied = applied
+
+    def one(self):
+        return self[0] if self else None
+
+
+class AddDiscountsTest(unittest.TestCase):
+    def setUp(self):
+        self.failing = set()  # statement prefixes that fail
+        self.claimed = {}
+        self.db = FakeSession(self.handle)
+        orders_2.app.dependency_overrides[orders_2.get_db_session] = lambda: self.db
+        orders_2.app.dependency_overrides[orders_2.verify_admin] = lambda: uuid4()
+        patcher = patch.object(orders_2, "execute_concurrent_with_args", execute_concurrent_with_args)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(orders_2.app.dependency_overrides.clear)
+
+    def handle(self, query, params):
+        if any(query.startswith(prefix) for prefix in self.failing):
+            raise RuntimeError("write timeout")
+        if query.startswith("INSERT INTO discounts_by_code"):
+            if params[0] in self.claimed:
+                return Applied(False)
+            self.claimed[params[0]] = params[1]
+            return Applied(True)
+        if query.startswith("DELETE FROM discounts_by_code"):
+            applied = self.claimed.get(params[0]) == params[1]
+            if applied:
+                del self.claimed[params[0]]
+            return Applied(applied)
+        return Applied(True)
+
+    def add(self, *codes):
+        expires_at = (datetime.utcnow() + timedelta(days=1)).isoformat()
+        response = TestClient(orders_2.app).post("/discounts", json={"discounts": [
+            {"discount_code": code, "discount_percentage": 10, "expires_at": expires_at} for code in codes
+        ]})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        return [line["status"] for line in lines[:-1]]
+
+    def test_created_and_duplicate(self):
+        self.assertEqual(self.add("SPRING10", "SPRING10"), ["created", "duplicate"])
+        self.assertIn("SPRING10", self.claimed)
+        self.assertEqual(self.add("SPRING10"), ["duplicate"])
+
+    def test_failed_code_is_released_and_can_be_resubmitted(self):
+        self.failing.add("INSERT INTO discount_codes_by_day")
+        self.assertEqual(self.add("SPRING10"), ["error"])
+        self.assertNotIn("SPRING10", self.claimed)
+        self.assertEqual(len(self.db.queries("DELETE FROM discounts WHERE")), 1)
+        self.failing.clear()
+        self.assertEqual(self.add("SPRING10"), ["created"])
+
+    def test_code_that_cannot_be_released_counts_as_created(self):
+        self.failing.update({"INSERT INTO discounts ", "DELETE FROM discounts_by_code"})
+        self.assertEqual(self.add("SPRING10"), ["created"])
+        self.assertIn("SPRING10", self.claimed)
+
+
+OrderRow = namedtuple("OrderRow", ["order_id", "customer_id", "restaurant_id", "created_at", "status",
+                                   "delivery_person", "delivery_distance_km"])
+
+
+def make_order(**columns):
+    return OrderRow(**{"order_id": uuid4(), "customer_id": uuid4(), "restaurant_id": uuid4(),
+                       "created_at": datetime.utcnow(), "status": "Pending", "delivery_person": None,
+                       "delivery_distance_km": 2.0, **columns})
+
+
+class OrdersTable:
+    """One order: read is what SELECTs return, stored what the conditional
+    UPDATE sees, so a change made in between can be simulated."""
+
+    def __init__(self, order_row):
+        self.read = self.stored = order_row
+
+    def handle(self, query, params):
+        if query.startswith("SELECT") and "FROM orders WHERE" in query:
+            return Applied(True, [self.read] if self.read else [])
+        if query.startswith("UPDATE orders SET"):
+            at = next(i for i, param in enumerate(params) if isinstance(param, ValueSequence))
+            from_statuses, delivery_person, restaurant_id = params[at], params[at + 1], params[at + 2:]
+            if self.stored is None:
+                return Applied(False, [SimpleNamespace()])
+            if (self.stored.status in from_statuses and self.stored.delivery_person == delivery_person
+                    and (not restaurant_id or self.stored.restaurant_id == restaurant_id[0])):
+                self.stored = self.stored._replace(status=params[0])
+                return Applied(True)
+            return Applied(False, [self.stored])
+        return Applied(True)
+
+
+class TransitionOrderTest(unittest.TestCase):
+    def transition(self, order_row, new_status, restaurant_id=None, stored=None, **kwargs):
+        self.table = OrdersTable(order_row)
+        if stored is not None:
+            self.table.stored = stored
+        self.db = FakeSession(self.table.handle)
+        return orders_2.transition_order(self.db, order_row, new_status, uuid4(), datetime.utcnow(),
+                                         restaurant_id, **kwargs)
+
+    def test_applied(self):
+        order_row = make_order()
+        applied, status, returned = self.transition(order_row, "In Progress", order_row.restaurant_id)
+        self.assertEqual((applied, status, returned), (True, "In Progress", order_row))
+        self.assertEqual(self.table.stored.status, "In Progress")
+        self.assertEqual(len(self.db.queries("INSERT INTO order_status_history")), 1)
+        self.assertEqual(len(self.db.queries("UPDATE orders_by_restaurant_status")), 1)
+        self.assertEqual(len(self.db.queries("UPDATE orders_by_customer")), 1)
+
+    def test_retries_when_only_the_courier_changed(self):
+        order_row = make_order()
+        courier_id = uuid4()
+        applied, status, returned = self.transition(order_row, "Delivered",
+                                                    stored=order_row._replace(delivery_person=courier_id))
+        self.assertEqual((applied, status), (True, "Delivered"))
+        # The courier assigned meanwhile comes back, so the caller releases it
+        self.assertEqual(returned.delivery_person, courier_id)
+        updates = self.db.queries("UPDATE orders SET")
+        self.assertEqual([params[-1] for params in updates], [None, courier_id])
+
+    def test_other_restaurant(self):
+        order_row = make_order()
+        self.assertEqual(self.transition(order_row, "In Progress", uuid4()), (False, None, order_row))
+        self.assertEqual(self.db.queries("INSERT INTO order_status_history"), [])
+
+    def test_missing_order(self):
+        order_row = make_order()
+        self.table = OrdersTable(None)
+        db = FakeSession(self.table.handle)
+        applied, status, _ = orders_2.transition_order(db, order_row, "In Progress", uuid4(), datetime.utcnow())
+        self.assertEqual((applied, status), (False, None))
+
+    def test_status_that_cannot_change(self):
+        order_row = make_order(status="Delivered")
+        self.assertEqual(self.transition(order_row, "In Progress"), (False, "Delivered", order_row))
+        self.assertEqual(len(self.db.queries("UPDATE orders SET")), 1)
+        self.assertEqual(self.db.queries("INSERT INTO order_status_history"), [])
+
+    def test_from_statuses(self):
+        order_row = make_order(status="In Progress")
+        applied, status, _ = self.transition(order_row, "Canceled", from_statuses=("Pending",))
+        self.assertEqual((applied, status), (False, "In Progress"))
+
+
+class OrderEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.user_id = uuid4()
+        self.table = OrdersTable(make_order(customer_id=self.user_id))
+        self.order_id = self.table.read.order_id
+        self.db = FakeSession(self.table.handle)
+        orders_2.app.dependency_overrides[orders_2.get_db_session] = lambda: self.db
+        orders_2.app.dependency_overrides[orders_2.get_current_user] = lambda: self.user_id
+        self.addCleanup(orders_2.app.dependency_overrides.clear)
+        self.client = TestClient(orders_2.app)
+
+
+class UpdateOrderStatusTest(OrderEndpointTest):
+    def setUp(self):
+        super().setUp()
+        self.restaurant_id = self.table.read.restaurant_id
+        orders_2.app.dependency_overrides[orders_2.verify_worker] = \
+            lambda: orders_2.Worker(self.user_id, self.restaurant_id)
+
+    def update(self, status="In Progress"):
+        return self.client.put("/orders/status", json={"order_id": str(self.order_id), "status": status})
+
+    def test_updated(self):
+        response = self.update()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.table.stored.status, "In Progress")
+
+    def test_missing_order(self):
+        self.table.read = None
+        self.assertEqual(self.update().status_code, 404)
+        self.assertEqual(self.db.queries("UPDATE orders SET"), [])
+
+    def test_order_of_another_restaurant(self):
+        self.restaurant_id = uuid4()
+        self.assertEqual(self.update().status_code, 404)
+        self.assertEqual(self.db.queries("UPDATE orders SET"), [])
+
+    def test_order_gone_before_the_update(self):
+        self.table.stored = None
+        self.assertEqual(self.update().status_code, 404)
+
+    def test_conflict(self):
+        self.table.stored = self.table.read._replace(status="Delivered")
+        response = self.update()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["detail"], "Order is Delivered, it cannot be changed to In Progress")
+
+    def test_invalid_status(self):
+        self.assertEqual(self.update("Lost").status_code, 400)
+
+
+class CancelOrderTest(OrderEndpointTest):
+    def cancel(self):
+        return self.client.request("DELETE", "/orders", json={"order_id": str(self.order_id)})
+
+    def test_canceled(self):
+        self.assertEqual(self.cancel().status_code, 200)
+        self.assertEqual(self.table.stored.status, "Canceled")
+        self.assertEqual(len(self.db.queries("INSERT INTO purge_queue")), 1)
+
+    def test_missing_order(self):
+        self.table.read = None
+        self.assertEqual(self.cancel().status_code, 404)
+
+    def test_closed_order(self):
+        self.table.read = self.table.read._replace(status="Delivered")
+        response = self.cancel()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Order is already delivered")
+
+    def test_order_the_kitchen_started(self):
+        self.table.read = self.table.read._replace(status="In Progress")
+        self.assertEqual(self.cancel().status_code, 400)
+        self.assertEqual(self.db.queries("UPDATE orders SET"), [])
+
+    def test_started_before_the_update(self):
+        self.table.stored = self.table.read._replace(status="In Progress")
+        response = self.cancel()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["detail"], "Order is already in progress")
+
+    def test_order_gone_before_the_update(self):
+        self.table.stored = None
+        self.assertEqual(self.cancel().status_code, 404)
+
+
+class IdempotencyTest(OrderEndpointTest):
+    def setUp(self):
+        super().setUp()
+        self.keys = {}
+        self.select_misses = False  # a concurrent retry claims the key after the read
+        self.db = FakeSession(self.handle)
+        self.place_order = Mock(side_effect=lambda db, order, user, order_id: {"order_id": str(order_id)})
+        patcher = patch.object(orders_2, "place_order", self.place_order)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.order = {"restaurant_id": str(uuid4()), "products": {str(uuid4()): 1},
+                      "payment_method": "card", "delivery_method": "pickup"}
+
+    def handle(self, query, params):
+        if query.startswith("SELECT request_hash, response FROM order_idempotency"):
+            row = None if self.select_misses else self.keys.get(tuple(params))
+            return Applied(True, [row] if row else [])
+        if query.startswith("INSERT INTO order_idempotency"):
+            key = tuple(params[:2])
+            if key in self.keys:
+                return Applied(False, [self.keys[key]])
+            self.keys[key] = SimpleNamespace(request_hash=params[3], response=None)
+            return Applied(True)
+        if query.startswith("UPDATE order_idempotency"):
+            self.keys[tuple(params[2:])].response = params[1]
+        if query.startswith("DELETE FROM order_idempotency"):
+            del self.keys[tuple(params)]
+        return Applied(True)
+
+    def post(self, key="retry-1", order=None):
+        headers = {} if key is None else {"Idempotency-Key": key}
+        return self.client.post("/orders", json=order or self.order, headers=headers)
+
+    def test_retry_gets_the_first_response(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.post().json(), first.json())
+        self.assertEqual(self.place_order.call_count, 1)
+
+    def test_without_key(self):
+        self.post(None)
+        self.post(None)
+        self.assertEqual(self.place_order.call_count, 2)
+        self.assertEqual(self.db.executed, [])
+
+    def test_key_used_for_another_order(self):
+        self.post()
+        response = self.post(order={**self.order, "delivery_method": "delivery", "address": "Main St 1"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.place_order.call_count, 1)
+
+    def test_first_request_still_processing(self):
+        self.keys[(self.user_id, "retry-1")] = SimpleNamespace(
+            request_hash=orders_2.request_fingerprint(orders_2.Order(**self.order)), response=None
+        )
+        self.assertEqual(self.post().status_code, 409)
+        self.place_order.assert_not_called()
+
+    def test_key_claimed_concurrently(self):
+        first = self.post()
+        self.select_misses = True
+        self.assertEqual(self.post().json(), first.json())
+        self.assertEqual(self.place_order.call_count, 1)
+
+    def test_failed_order_releases_the_key(self):
+        self.place_order.side_effect = HTTPException(status_code=404, detail="Restaurant not found")
+        self.assertEqual(self.post().status_code, 404)
+        self.assertEqual(self.keys, {})
+        self.place_order.side_effect = lambda db, order, user, order_id: {"order_id": str(order_id)}
+        self.assertEqual(self.post().status_code, 200)
+
+    def test_invalid_key(self):
+        self.assertEqual(self.post("x" * (orders_2.IDEMPOTENCY_KEY_MAX_LENGTH + 1)).status_code, 400)
+        self.place_order.assert_not_called()
+
+
+class ValidQuoteTest(unittest.TestCase):
+    def setUp(self):
+        self.customer_id = uuid4()
+        self.item_id = uuid4()
+        self.order = orders_2.Order(restaurant_id=uuid4(), products={self.item_id: 2}, payment_method="card",
+                                    delivery_method="delivery", address="Main St 1")
+        orders_2.menu_cache.set(self.order.restaurant_id, 3, {self.item_id: 450})
+        self.pricing = orders_2.Pricing(1150, 250, 1.2, {self.item_id: 450}, None)
+
+    def quoted(self, order=None, customer_id=None):
+        quote_id, _ = orders_2.create_quote(self.order, self.customer_id, self.pricing, (52.5, 13.4))
+        order = (order or self.order).model_copy(update={"quote_id": quote_id})
+        return orders_2.valid_quote(order, customer_id or self.customer_id)
+
+    def test_valid(self):
+        claims = self.quoted()
+        self.assertEqual(orders_2.quoted_pricing(claims), self.pricing)
+        self.assertEqual(claims["delivery_coordinates"], [52.5, 13.4])
+
+    def test_no_quote(self):
+        self.assertIsNone(orders_2.valid_quote(self.order, self.customer_id))
+
+    def test_other_customer(self):
+        self.assertIsNone(self.quoted(customer_id=uuid4()))
+
+    def test_changed_order(self):
+        self.assertIsNone(self.quoted(self.order.model_copy(update={"products": {self.item_id: 3}})))
+        # Fields that do not change the price may differ
+        self.assertIsNotNone(self.quoted(self.order.model_copy(update={"payment_method": "cash"})))
+
+    def test_menu_changed(self):
+        quote_id, _ = orders_2.create_quote(self.order, self.customer_id, self.pricing, (52.5, 13.4))
+        orders_2.menu_cache.bump(self.order.restaurant_id, 4)
+        self.assertIsNone(orders_2.valid_quote(self.order.model_copy(update={"quote_id": quote_id}),
+                                               self.customer_id))
+
+    def test_menu_not_cached(self):
+        self.order = self.order.model_copy(update={"restaurant_id": uuid4()})
+        self.assertIsNone(self.quoted())
+
+    def test_expired(self):
+        with patch.object(orders_2, "QUOTE_TTL_SECONDS", -10):
+            self.assertIsNone(self.quoted())
+
+    def test_invalid(self):
+        with self.assertRaises(HTTPException) as raised:
+            orders_2.valid_quote(self.order.model_copy(update={"quote_id": "not-a-quote"}), self.customer_id)
+        self.assertEqual(raised.exception.status_code, 400)
+
+
+class RepriceItemsTest(unittest.TestCase):
+    def setUp(self):
+        self.kept, self.added = uuid4(), uuid4()
+        self.order_row = SimpleNamespace(restaurant_id=uuid4(), item_prices={self.kept: Decimal("4.50")})
+        self.menu_prices = Mock(return_value={self.kept: 999, self.added: 300})
+        patcher = patch.object(orders_2, "get_menu_prices", self.menu_prices)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_items_keep_their_price(self):
+        self.assertEqual(orders_2.reprice_items(None, self.order_row, {self.kept: 2}), {self.kept: 450})
+        self.menu_prices.assert_not_called()
+
+    def test_added_items_are_looked_up(self):
+        self.assertEqual(orders_2.reprice_items(None, self.order_row, {self.kept: 1, self.added: 1}),
+                         {self.kept: 450, self.added: 300})
+        self.menu_prices.assert_called_once_with(None, self.order_row.restaurant_id)
+
+    def test_removed_and_unknown_items(self):
+        unknown = uuid4()
+        self.assertEqual(orders_2.reprice_items(None, self.order_row, {self.added: 1, unknown: 1}),
+                         {self.added: 300})
+
+    def test_order_without_item_prices(self):
+        self.order_row.item_prices = None
+        self.assertEqual(orders_2.reprice_items(None, self.order_row, {self.kept: 1}), {self.kept: 999})
+
+
+class OrderDiscountPercentageTest(unittest.TestCase):
+    def setUp(self):
+        self.active_discount = Mock(return_value=SimpleNamespace(discount_percentage=15))
+        patcher = patch.object(orders_2, "get_active_discount", self.active_discount)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def percentage(self, discount_percentage=None, discount=None, discount_code=None):
+        order_row = SimpleNamespace(discount_percentage=discount_percentage, discount=discount,
+                                    discount_code=discount_code)
+        return orders_2.order_discount_percentage(None, order_row)
+
+    def test_stored_percentage(self):
+        self.assertEqual(self.percentage(10, Decimal("20"), "SPRING"), 10)
+        self.active_discount.assert_not_called()
+
+    def test_cart_discount(self):
+        self.assertEqual(self.percentage(discount=Decimal("20")), 20)
+
+    def test_code_only(self):
+        self.assertEqual(self.percentage(discount_code="SPRING"), 15)
+        self.active_discount.return_value = None
+        self.assertIsNone(self.percentage(discount_code="EXPIRED"))
+
+    def test_no_discount(self):
+        self.assertIsNone(self.percentage())
+        self.active_discount.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Order pricing in integer minor units (cents).
+
+Menu prices are converted to cents once, when a menu is loaded. From there on
+subtotals, discounts and delivery fees are exact integers with a single
+rounding rule (half up), so the same basket always prices to the same cent.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+
+DELIVERY_FEE_CENTS_PER_KM = 250
+DELIVERY_FEE_BAND_METERS = 100  # the fee grows per started band, not per meter
+
+PriceBreakdown = namedtuple("PriceBreakdown", ["subtotal", "discount", "delivery_fee", "total"])
+
+
+class UnknownItemError(KeyError):
+    """An ordered item has no price."""
+
+    def __init__(self, item_id):
+        super().__init__(item_id)
+        self.item_id = item_id
+
+
+def to_cents(amount):
+    # Decimal, int, float or str amount -> int cents
+    return int(Decimal(str(amount)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def menu_to_cents(prices):
+    return {item_id: to_cents(price) for item_id, price in prices.items()}
+
+
+def delivery_fee_cents(distance_km: float):
+    # Distances are rounded to whole meters first so float noise cannot change a band
+    meters = round(distance_km * 1000)
+    bands = -(-meters // DELIVERY_FEE_BAND_METERS)
+    return bands * DELIVERY_FEE_CENTS_PER_KM * DELIVERY_FEE_BAND_METERS // 1000
+
+
+def price_basket(products, unit_prices, discount_percentage=None, delivery_fee: int = 0):
+    """Price one basket; products maps item to quantity, unit_prices item to cents."""
+    subtotal = 0
+    try:
+        for item_id, quantity in products.items():
+            subtotal += unit_prices[item_id] * quantity
+    except KeyError as e:
+        raise UnknownItemError(e.args[0]) from None
+    # Percentages are whole numbers, so half-up rounding stays in integers
+    discount = (subtotal * discount_percentage + 50) // 100 if discount_percentage else 0
+    return PriceBreakdown(subtotal, discount, delivery_fee, subtotal - discount + delivery_fee)
+
+
+def price_baskets(baskets):
+    """Price many baskets in one call.
+
+    Each basket is (products, unit_prices, discount_percentage, delivery_fee);
+    the result is the price_basket breakdown of each, in order.
+    """
+    return [price_basket(*basket) for basket in baskets]
+
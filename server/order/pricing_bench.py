@@ -0,0 +1,67 @@
+"""Benchmark basket pricing: Decimal per item against integer cents.
+
+    python pricing_bench.py [--baskets 100000] [--menu-size 60] [--items 4]
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+from uuid import uuid4
+
+from pricing import delivery_fee_cents, from_cents, price_basket
+
+
+def decimal_total(products, prices, discount_percentage, distance_km):
+    # How create_order used to price: Decimal prices, float discount and fee
+    total_price = 0
+    for item_id, quantity in products.items():
+        if item_id not in prices:
+            raise KeyError(item_id)
+        total_price += prices[item_id] * quantity
+    if discount_percentage:
+        total_price -= total_price * discount_percentage / 100
+    return float(total_price) + 2.5 * distance_km
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baskets", type=int, default=100000)
+    parser.add_argument("--menu-size", type=int, default=60)
+    parser.add_argument("--items", type=int, default=4, help="distinct items per basket")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per variant, the best one counts")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    menu_cents = {uuid4(): rng.randint(150, 4000) for _ in range(args.menu_size)}
+    menu_decimal = {item_id: from_cents(cents) for item_id, cents in menu_cents.items()}
+    orders = []
+    for _ in range(args.baskets):
+        products = {item_id: rng.randint(1, 3) for item_id in rng.sample(list(menu_cents), args.items)}
+        orders.append((products, rng.choice([None, 10, 15, 25]), rng.uniform(0.5, 20)))
+
+    def best(run):
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = run()
+            times.append(time.perf_counter() - started)
+        return min(times), result
+
+    decimal_time, _ = best(lambda: [
+        decimal_total(products, menu_decimal, discount_percentage, distance_km)
+        for products, discount_percentage, distance_km in orders
+    ])
+
+    baskets = [
+        (products, menu_cents, discount_percentage, delivery_fee_cents(distance_km))
+        for products, discount_percentage, distance_km in orders
+    ]
+    single_time, _ = best(lambda: [price_basket(*basket) for basket in baskets])
+
+    print(f"{args.baskets} baskets, {args.items} items each, menu of {args.menu_size}")
+    print(f"decimal per item:  {args.baskets / decimal_time:12.0f} baskets/s")
+    print(f"cents per basket:  {args.baskets / single_time:12.0f} baskets/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import random
+import unittest
+from decimal import ROUND_HALF_UP, Decimal
+from uuid import uuid4
+
+from pricing import (
+    PriceBreakdown,
+    UnknownItemError,
+    delivery_fee_cents,
+    from_cents,
+    menu_to_cents,
+    price_basket,
+    price_baskets,
+    to_cents,
+)
+
+RUNS = 500
+
+
+def random_menu(rng, size=20):
+    return {uuid4(): rng.randint(1, 50000) for _ in range(size)}
+
+
+def random_basket(rng, menu):
+    items = rng.sample(list(menu), rng.randint(0, min(8, len(menu))))
+    products = {item_id: rng.randint(1, 20) for item_id in items}
+    discount_percentage = rng.choice([None, 0, rng.randint(1, 100)])
+    return products, menu, discount_percentage, delivery_fee_cents(rng.uniform(0, 20))
+
+
+class PricingPropertiesTest(unittest.TestCase):
+    """Randomised checks of the pricing invariants, seeded so failures reproduce."""
+
+    def setUp(self):
+        self.rng = random.Random(20250301)
+
+    def test_total_adds_up(self):
+        for _ in range(RUNS):
+            menu = random_menu(self.rng)
+            price = price_basket(*random_basket(self.rng, menu))
+            self.assertEqual(price.total, price.subtotal - price.discount + price.delivery_fee)
+            self.assertTrue(0 <= price.discount <= price.subtotal)
+            self.assertTrue(all(isinstance(amount, int) for amount in price))
+
+    def test_matches_decimal_reference(self):
+        for _ in range(RUNS):
+            menu = random_menu(self.rng)
+            products, _, discount_percentage, fee = random_basket(self.rng, menu)
+            subtotal = sum((from_cents(menu[item_id]) * quantity for item_id, quantity in products.items()), Decimal(0))
+            discount = (subtotal * (discount_percentage or 0) / 100).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            expected = subtotal - discount + from_cents(fee)
+            price = price_basket(products, menu, discount_percentage, fee)
+            self.assertEqual(from_cents(price.total), expected)
+
+    def test_item_order_does_not_matter(self):
+        for _ in range(RUNS):
+            menu = random_menu(self.rng)
+            products, _, discount_percentage, fee = random_basket(self.rng, menu)
+            shuffled = list(products.items())
+            self.rng.shuffle(shuffled)
+            self.assertEqual(
+                price_basket(products, menu, discount_percentage, fee),
+                price_basket(dict(shuffled), menu, discount_percentage, fee),
+            )
+
+    def test_batch_matches_single(self):
+        for _ in range(RUNS // 10):
+            menus = [random_menu(self.rng) for _ in range(3)]
+            baskets = [random_basket(self.rng, self.rng.choice(menus)) for _ in range(self.rng.randint(0, 50))]
+            self.assertEqual(price_baskets(baskets), [price_basket(*basket) for basket in baskets])
+
+    def test_more_items_never_cost_less(self):
+        for _ in range(RUNS):
+            menu = random_menu(self.rng)
+            products, _, discount_percentage, fee = random_basket(self.rng, menu)
+            more = dict(products)
+            item_id = self.rng.choice(list(menu))
+            more[item_id] = more.get(item_id, 0) + 1
+            self.assertGreaterEqual(
+                price_basket(more, menu, discount_percentage, fee).total,
+                price_basket(products, menu, discount_percentage, fee).total,
+            )
+
+    def test_delivery_fee_is_monotonic_in_bands(self):
+        distances = sorted(self.rng.uniform(0, 20) for _ in range(RUNS))
+        fees = [delivery_fee_cents(distance) for distance in distances]
+        self.assertEqual(fees, sorted(fees))
+        self.assertTrue(all(fee % 25 == 0 for fee in fees))
+
+
+class PricingTest(unittest.TestCase):
+    def test_cents_round_trip(self):
+        self.assertEqual(to_cents(Decimal("10.50")), 1050)
+        self.assertEqual(to_cents("0.005"), 1)
+        self.assertEqual(to_cents(2.675), 268)
+        self.assertEqual(from_cents(1050), Decimal("10.50"))
+        self.assertEqual(menu_to_cents({"a": Decimal("1.99")}), {"a": 199})
+
+    def test_delivery_fee_bands(self):
+        self.assertEqual(delivery_fee_cents(0), 0)
+        self.assertEqual(delivery_fee_cents(0.001), 25)
+        self.assertEqual(delivery_fee_cents(0.1), 25)
+        self.assertEqual(delivery_fee_cents(0.1004), 25)
+        self.assertEqual(delivery_fee_cents(0.101), 50)
+        self.assertEqual(delivery_fee_cents(4.0), 1000)
+
+    def test_discount_rounds_half_up(self):
+        self.assertEqual(price_basket({"a": 1}, {"a": 150}, 15), PriceBreakdown(150, 23, 0, 127))
+        self.assertEqual(price_basket({"a": 1}, {"a": 999}, 100, 300), PriceBreakdown(999, 999, 300, 300))
+
+    def test_unknown_item(self):
+        with self.assertRaises(UnknownItemError) as raised:
+            price_basket({"a": 1, "b": 2}, {"a": 100})
+        self.assertEqual(raised.exception.item_id, "b")
+        with self.assertRaises(UnknownItemError):
+            price_baskets([({"a": 1}, {"a": 100}, None, 0), ({"c": 1}, {"a": 100}, None, 0)])
+
+    def test_empty_batch(self):
+        self.assertEqual(price_baskets([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
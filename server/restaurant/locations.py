@@ -0,0 +1,55 @@
+import threading
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime
+
+Position = namedtuple("Position", ["latitude", "longitude", "recorded_at"])
+
+
+def hour_bucket(recorded_at: datetime):
+    # courier_locations partitions are one courier-hour each
+    return recorded_at.replace(minute=0, second=0, microsecond=0)
+
+
+class LocationStore:
+    """Latest known position per courier plus the points not yet written out.
+
+    Reports arriving out of order are kept for the track but never move the
+    latest position backwards. Pending points are bounded per courier, so a
+    stalled flusher cannot grow memory without limit.
+    """
+
+    def __init__(self, max_pending_per_courier: int = 64):
+        self.max_pending_per_courier = max_pending_per_courier
+        self._latest = {}  # courier_id -> Position
+        self._pending = self._new_pending()
+        self._lock = threading.Lock()
+
+    def _new_pending(self):
+        return defaultdict(lambda: deque(maxlen=self.max_pending_per_courier))
+
+    def record(self, courier_id, latitude: float, longitude: float, recorded_at: datetime):
+        position = Position(latitude, longitude, recorded_at)
+        with self._lock:
+            self._pending[courier_id].append(position)
+            latest = self._latest.get(courier_id)
+            if latest is None or latest.recorded_at <= recorded_at:
+                self._latest[courier_id] = position
+                return True
+            return False
+
+    def latest(self, courier_id):
+        return self._latest.get(courier_id)
+
+    def latest_all(self):
+        with self._lock:
+            return dict(self._latest)
+
+    def drain(self):
+        """Take every pending point, grouped as {(courier_id, bucket): [Position]}."""
+        with self._lock:
+            pending, self._pending = self._pending, self._new_pending()
+        partitions = defaultdict(list)
+        for courier_id, positions in pending.items():
+            for position in positions:
+                partitions[(courier_id, hour_bucket(position.recorded_at))].append(position)
+        return partitions
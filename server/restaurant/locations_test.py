@@ -0,0 +1,48 @@
+import unittest
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from locations import LocationStore, hour_bucket
+
+
+class LocationStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = LocationStore(max_pending_per_courier=3)
+        self.courier = uuid4()
+        self.now = datetime(2025, 5, 1, 10, 59, 30)
+
+    def test_latest_never_moves_backwards(self):
+        self.assertTrue(self.store.record(self.courier, 42.0, 23.0, self.now))
+        self.assertFalse(self.store.record(self.courier, 41.0, 22.0, self.now - timedelta(seconds=5)))
+        self.assertEqual(self.store.latest(self.courier).latitude, 42.0)
+        # The late report is still part of the track
+        self.assertEqual(len(self.store.drain()[(self.courier, hour_bucket(self.now))]), 2)
+
+    def test_drain_groups_by_courier_hour_and_empties(self):
+        other = uuid4()
+        self.store.record(self.courier, 42.0, 23.0, self.now)
+        self.store.record(self.courier, 42.1, 23.1, self.now + timedelta(minutes=1))
+        self.store.record(other, 42.2, 23.2, self.now)
+        partitions = self.store.drain()
+        self.assertEqual(
+            {key: len(positions) for key, positions in partitions.items()},
+            {
+                (self.courier, datetime(2025, 5, 1, 10)): 1,
+                (self.courier, datetime(2025, 5, 1, 11)): 1,
+                (other, datetime(2025, 5, 1, 10)): 1,
+            },
+        )
+        self.assertEqual(self.store.drain(), {})
+        # Latest positions survive a drain
+        self.assertEqual(self.store.latest(self.courier).latitude, 42.1)
+
+    def test_pending_points_are_bounded(self):
+        for second in range(10):
+            self.store.record(self.courier, 42.0, 23.0, self.now - timedelta(seconds=10 - second))
+        positions = self.store.drain()[(self.courier, hour_bucket(self.now))]
+        self.assertEqual([p.recorded_at for p in positions],
+                         [self.now - timedelta(seconds=s) for s in (3, 2, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Copy restaurants.delivery_people maps into couriers_by_restaurant.
+
+Reads restaurants page by page so it works at any size, and prints the paging
+state after every page so an interrupted run can continue with --resume.
+Existing couriers_by_restaurant rows are never overwritten, so the migration
+can be re-run safely while the services are live.
+
+    python migrate_couriers.py [--page-size 500] [--resume HEX] [--clear-map]
+"""
+import argparse
+import os
+from datetime import datetime
+
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+
+def migrate(session, page_size, paging_state=None, clear_map=False):
+    select = SimpleStatement("SELECT restaurant_id, delivery_people FROM restaurants", fetch_size=page_size)
+    insert = session.prepare(
+        """
+        INSERT INTO couriers_by_restaurant (restaurant_id, delivery_person_id, status, assigned_at, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        IF NOT EXISTS
+        """
+    )
+    clear = session.prepare("UPDATE restaurants SET delivery_people = null WHERE restaurant_id = ?")
+
+    restaurants = couriers = 0
+    while True:
+        result = session.execute(select, paging_state=paging_state)
+        rows = result.current_rows
+        now = datetime.utcnow()
+        params = [
+            (row.restaurant_id, courier_id, courier_status, now, now)
+            for row in rows
+            for courier_id, courier_status in (row.delivery_people or {}).items()
+        ]
+        execute_concurrent_with_args(session, insert, params, concurrency=50)
+        if clear_map:
+            migrated = [(row.restaurant_id,) for row in rows if row.delivery_people]
+            execute_concurrent_with_args(session, clear, migrated, concurrency=50)
+
+        restaurants += len(rows)
+        couriers += len(params)
+        paging_state = result.paging_state
+        print(f"{restaurants} restaurants, {couriers} couriers migrated"
+              + (f", resume with --resume {paging_state.hex()}" if paging_state else ""))
+        if not paging_state:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--resume", help="paging state printed by a previous run")
+    parser.add_argument("--clear-map", action="store_true",
+                        help="empty restaurants.delivery_people once it has been copied")
+    args = parser.parse_args()
+
+    cluster = Cluster([os.getenv("CASSANDRA_HOST", "127.0.0.1")], protocol_version=4)
+    session = cluster.connect("pantastic")
+    try:
+        migrate(session, args.page_size, bytes.fromhex(args.resume) if args.resume else None, args.clear_map)
+    finally:
+        cluster.shutdown()
@@ -1,14 +1,20 @@
-from datetime import datetime, timedelta
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Optional
 from uuid import UUID
 from uuid import uuid4
 
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
 from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
 from fastapi.security import OAuth2PasswordBearer
 
 from passlib.context import CryptContext
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from cassandra.cluster import Session
 from fastapi import Depends
 from typing import Dict, List
@@ -19,6 +25,9 @@ import json
 
 from geopy.geocoders import Nominatim
 
+from cache import TTLCache, VersionedCache
+from locations import LocationStore, hour_bucket
+
 # Initialize FastAPI app
 app = FastAPI(title="restaurant Microservice")
 
@@ -31,6 +40,7 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 AUTH_SERVICE_URL = "http://user_service:8000"  # Replace with the actual URL of your auth service
+ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order_service:8003")
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     async with httpx.AsyncClient() as client:
@@ -44,13 +54,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 #     cluster = Cluster(['host.docker.internal'], protocol_version=4)
 #     session = cluster.connect('pantastic')
 #     return session
+db_session = None
+
 def get_db_session():
-    import os
-    # Get the Cassandra host from the environment variable
-    cassandra_host = os.getenv("CASSANDRA_HOST", "127.0.0.1")  # Default to localhost if not set
-    cluster = Cluster([cassandra_host], protocol_version=4)
-    session = cluster.connect('pantastic')  # Replace 'pantastic' with your keyspace name
-    return session
+    # One Cluster per process: connecting per request cannot keep up with location ingest
+    global db_session
+    if db_session is None:
+        # Get the Cassandra host from the environment variable
+        cassandra_host = os.getenv("CASSANDRA_HOST", "127.0.0.1")  # Default to localhost if not set
+        cluster = Cluster([cassandra_host], protocol_version=4)
+        db_session = cluster.connect('pantastic')  # Replace 'pantastic' with your keyspace name
+    return db_session
 
 
 # Models
@@ -81,6 +95,14 @@ class AssignDeliveryPersonRequest(BaseModel):
     restaurant_id: UUID
     delivery_person_id: UUID
 
+class AssignCourierAccountRequest(BaseModel):
+    customer_id: UUID
+    delivery_person_id: UUID
+
+class AssignWorkerRequest(BaseModel):
+    restaurant_id: UUID
+    worker_id: UUID
+
 class User(BaseModel):
     user_id: UUID
     admin: bool
@@ -107,6 +129,15 @@ class DeleteItemRequest(BaseModel):
 class GetItemsRequest(BaseModel):
     restaurant_id: UUID
 
+class CourierLocation(BaseModel):
+    delivery_person_id: UUID
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    recorded_at: Optional[datetime] = None  # Defaults to the time the report is received
+
+class CourierLocationsRequest(BaseModel):
+    locations: List[CourierLocation]
+
 def verify_admin(
     current_user: str = Depends(get_current_user),  # current_user is a string (from token)
     session: Session = Depends(get_db_session),
@@ -134,10 +165,117 @@ def get_coordinates(address):
         #return location.latitude, location.longitude
     return None
 
+# Sent as X-Internal-Token on calls to the order service's /internal/* endpoints
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+INTERNAL_HEADERS = {"X-Internal-Token": INTERNAL_TOKEN}
+
+async def notify_restaurant_changed(restaurant_id):
+    # The order service caches restaurant rows; tell it to drop this one.
+    # Best effort only, the order service cache TTL covers lost notifications.
+    try:
+        async with httpx.AsyncClient(timeout=2) as client:
+            await client.post(
+                f"{ORDER_SERVICE_URL}/internal/restaurants/{restaurant_id}/invalidate", headers=INTERNAL_HEADERS
+            )
+    except httpx.HTTPError:
+        pass
+
+# Serialized GET /{restaurant_id}/items payloads, keyed by menu version
+MENU_CACHE_TTL_SECONDS = int(os.getenv("MENU_CACHE_TTL_SECONDS", "600"))
+MENU_CACHE_MAX_SIZE = int(os.getenv("MENU_CACHE_MAX_SIZE", "5000"))
+menu_cache = VersionedCache(ttl=MENU_CACHE_TTL_SECONDS, max_size=MENU_CACHE_MAX_SIZE)
+
+def get_menu_version(db, restaurant_id):
+    version_row = db.execute(
+        "SELECT version FROM menu_versions WHERE restaurant_id = %s", [restaurant_id]
+    ).one()
+    return version_row.version if version_row else 0
+
+async def bump_menu_version(db, restaurant_id):
+    # Every menu edit bumps the version so cached menus here and in the
+    # order service are dropped
+    db.execute(
+        "UPDATE menu_versions SET version = version + 1 WHERE restaurant_id = %s",
+        [restaurant_id],
+    )
+    version = get_menu_version(db, restaurant_id)
+    menu_cache.bump(restaurant_id, version)
+    try:
+        async with httpx.AsyncClient(timeout=2) as client:
+            await client.post(
+                f"{ORDER_SERVICE_URL}/internal/restaurants/{restaurant_id}/menu-version",
+                params={"version": version},
+                headers=INTERNAL_HEADERS,
+            )
+    except httpx.HTTPError:
+        pass
+
+def get_item_restaurant_id(db, item_id):
+    item_row = db.execute(
+        "SELECT restaurant_id, deleted_at FROM items WHERE item_id = %s", [item_id]
+    ).one()
+    if not item_row or item_row.deleted_at:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return item_row.restaurant_id
+
 # Initialize S3 client
 s3 = boto3.client("s3")
 BUCKET_NAME = "pantastic-images"
 
+# Deleting an item or restaurant only sets deleted_at and queues the id in
+# purge_queue; the rows (and item images) are removed PURGE_RETENTION_DAYS
+# later by the purge job, a whole day at a time, so deletes do not leave
+# tombstones in the menu and restaurant scans.
+PURGE_RETENTION_DAYS = int(os.getenv("PURGE_RETENTION_DAYS", "7"))
+PURGE_LOOKBACK_DAYS = int(os.getenv("PURGE_LOOKBACK_DAYS", "7"))
+PURGE_INTERVAL_SECONDS = int(os.getenv("PURGE_INTERVAL_SECONDS", "3600"))
+
+def queue_purge(db, kind, record_id, deleted_at):
+    db.execute(
+        "INSERT INTO purge_queue (day, kind, id) VALUES (%s, %s, %s)",
+        (deleted_at.date(), kind, record_id),
+    )
+
+def purge_days(today):
+    # Days old enough to purge; earlier days are looked at again in case a run failed
+    return [today - timedelta(days=PURGE_RETENTION_DAYS + offset) for offset in range(1, PURGE_LOOKBACK_DAYS + 1)]
+
+def purge_item(db, item_id):
+    s3.delete_object(Bucket=BUCKET_NAME, Key=f"menu-items/{item_id}.jpg")
+    db.execute("DELETE FROM items WHERE item_id = %s", [item_id])
+
+def purge_restaurant(db, restaurant_id):
+    db.execute("DELETE FROM restaurants WHERE restaurant_id = %s", [restaurant_id])
+
+PURGES = {"item": purge_item, "restaurant": purge_restaurant}
+
+def purge_deleted(db):
+    purged = 0
+    for day in purge_days(datetime.utcnow().date()):
+        for kind, purge in PURGES.items():
+            rows = db.execute("SELECT id FROM purge_queue WHERE day = %s AND kind = %s", (day, kind)).all()
+            for row in rows:
+                purge(db, row.id)
+            if rows:
+                # One range tombstone for the day instead of one per queued id
+                db.execute("DELETE FROM purge_queue WHERE day = %s AND kind = %s", (day, kind))
+                purged += len(rows)
+    return purged
+
+async def purge_periodically():
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        try:
+            purged = await asyncio.to_thread(purge_deleted, get_db_session())
+            if purged:
+                print(f"Purged {purged} deleted items and restaurants")
+        except Exception as e:
+            print(f"Failed to purge deleted items and restaurants: {str(e)}")
+
+@app.on_event("startup")
+async def start_purger():
+    asyncio.create_task(purge_periodically())
+
 @app.post("/restaurants")
 async def add_restaurant(restaurant: Restaurant, user: User = Depends(verify_admin), db=Depends(get_db_session)):
     restaurant_id = uuid4()
@@ -151,7 +289,7 @@ async def add_restaurant(restaurant: Restaurant, user: User = Depends(verify_adm
 @app.get("/restaurants")
 async def get_restaurants(db=Depends(get_db_session)):
     rows = db.execute("SELECT * FROM restaurants").all()
-    return rows
+    return [row for row in rows if row.deleted_at is None]
 
 @app.put("/restaurants")
 async def update_restaurant(
@@ -177,6 +315,7 @@ async def update_restaurant(
             restaurant_id,
         ),
     )
+    await notify_restaurant_changed(restaurant_id)
     return {"message": "Restaurant updated successfully"}
 
 @app.delete("/restaurants")
@@ -186,7 +325,12 @@ async def delete_restaurant(
     db=Depends(get_db_session),
 ):
     restaurant_id = data.restaurant_id
-    db.execute("DELETE FROM restaurants WHERE restaurant_id = %s", [restaurant_id])
+    deleted_at = datetime.utcnow()
+    db.execute("UPDATE restaurants SET deleted_at = %s WHERE restaurant_id = %s", [deleted_at, restaurant_id])
+    queue_purge(db, "restaurant", restaurant_id, deleted_at)
+    # Couriers are freed right away; this is a single partition tombstone
+    db.execute("DELETE FROM couriers_by_restaurant WHERE restaurant_id = %s", [restaurant_id])
+    await notify_restaurant_changed(restaurant_id)
     return {"message": "Restaurant deleted successfully"}
 
 # Add/remove delivery people
@@ -243,16 +387,50 @@ async def assign_delivery_person(
     restaurant_id = data.restaurant_id
     delivery_person_id = data.delivery_person_id
 
+    # One row per courier keeps restaurant reads small and courier updates constant-cost.
+    # IF NOT EXISTS so re-assigning a courier who is out on a delivery keeps them Busy.
     db.execute(
         """
-        UPDATE restaurants
-        SET delivery_people = delivery_people + {%s: %s}
-        WHERE restaurant_id = %s
+        INSERT INTO couriers_by_restaurant (restaurant_id, delivery_person_id, status, assigned_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s)
+        IF NOT EXISTS
         """,
-        (delivery_person_id, "Assigned", restaurant_id),
+        (restaurant_id, delivery_person_id, "Assigned", datetime.utcnow(), datetime.utcnow()),
     )
+    await notify_restaurant_changed(restaurant_id)
     return {"message": "Delivery person assigned to restaurant successfully"}
 
+@app.post("/assign-worker-to-restaurant")
+async def assign_worker(
+    data: AssignWorkerRequest,
+    user: User = Depends(verify_admin),
+    db=Depends(get_db_session),
+):
+    # Workers only see and update the orders of the restaurant they are assigned to
+    result = db.execute(
+        "UPDATE customers SET worker = 1, restaurant_id = %s WHERE customer_id = %s IF EXISTS",
+        (data.restaurant_id, data.worker_id),
+    )
+    if not result.was_applied:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "Worker assigned to restaurant successfully"}
+
+@app.post("/assign-courier-account")
+async def assign_courier_account(
+    data: AssignCourierAccountRequest,
+    user: User = Depends(verify_admin),
+    db=Depends(get_db_session),
+):
+    # Links a user account to a delivery person, who may then report their own location
+    result = db.execute(
+        "UPDATE customers SET delivery_person_id = %s WHERE customer_id = %s IF EXISTS",
+        (data.delivery_person_id, data.customer_id),
+    )
+    if not result.was_applied:
+        raise HTTPException(status_code=404, detail="User not found")
+    location_reporters.invalidate(data.customer_id)
+    return {"message": "Courier account assigned successfully"}
+
 @app.delete("/unassign-delivery-person-from-restaurant")
 async def unassign_delivery_person(
     data: AssignDeliveryPersonRequest,  # Use a Pydantic model to parse the request body
@@ -263,15 +441,182 @@ async def unassign_delivery_person(
     delivery_person_id = data.delivery_person_id
 
     db.execute(
-        """
-        UPDATE restaurants
-        SET delivery_people = delivery_people - {%s}
-        WHERE restaurant_id = %s
-        """,
-        (delivery_person_id, restaurant_id),
+        "DELETE FROM couriers_by_restaurant WHERE restaurant_id = %s AND delivery_person_id = %s",
+        (restaurant_id, delivery_person_id),
     )
+    await notify_restaurant_changed(restaurant_id)
     return {"message": "Delivery person unassigned from restaurant successfully"}
 
+# Live courier positions. Reports are kept in memory (latest position per courier)
+# and flushed to the hour-bucketed courier_locations table in the background.
+LOCATION_FLUSH_SECONDS = float(os.getenv("LOCATION_FLUSH_SECONDS", "2"))
+LOCATION_TTL_SECONDS = int(os.getenv("LOCATION_TTL_SECONDS", str(7 * 24 * 3600)))
+LOCATION_FLUSH_CONCURRENCY = 64
+location_store = LocationStore()
+insert_location_statement = None
+
+# Positions drive dispatch, so a report is only accepted from the courier
+# themselves (an account linked with /assign-courier-account), a worker for the
+# couriers of their restaurant, or an admin. Cached since couriers report every
+# few seconds.
+LOCATION_REPORTER_CACHE_SECONDS = int(os.getenv("LOCATION_REPORTER_CACHE_SECONDS", "60"))
+ANY_COURIER = "any"
+location_reporters = TTLCache(ttl=LOCATION_REPORTER_CACHE_SECONDS, max_size=100000)
+
+def reportable_couriers(db, user_id: UUID):
+    # ANY_COURIER or the set of delivery_person_ids user_id may report for
+    allowed = location_reporters.get(user_id)
+    if allowed is None:
+        row = db.execute(
+            "SELECT admin, worker, restaurant_id, delivery_person_id FROM customers WHERE customer_id = %s",
+            [user_id],
+        ).one()
+        if row and row.admin == 1:
+            allowed = ANY_COURIER
+        else:
+            allowed = set()
+            if row and row.delivery_person_id:
+                allowed.add(row.delivery_person_id)
+            if row and row.worker == 1 and row.restaurant_id:
+                couriers = db.execute(
+                    "SELECT delivery_person_id FROM couriers_by_restaurant WHERE restaurant_id = %s",
+                    [row.restaurant_id],
+                )
+                allowed.update(courier.delivery_person_id for courier in couriers)
+            allowed = frozenset(allowed)
+        location_reporters.set(user_id, allowed)
+    return allowed
+
+def flush_locations(db):
+    global insert_location_statement
+    partitions = location_store.drain()
+    if not partitions:
+        return
+    if insert_location_statement is None:
+        insert_location_statement = db.prepare(
+            """
+            INSERT INTO courier_locations (delivery_person_id, bucket, recorded_at, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?)
+            USING TTL ?
+            """
+        )
+    # One unlogged batch per courier-hour partition, so each batch is a single write
+    batches = []
+    for (courier_id, bucket), positions in partitions.items():
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+        for position in positions:
+            batch.add(insert_location_statement, (
+                courier_id, bucket, position.recorded_at, position.latitude, position.longitude, LOCATION_TTL_SECONDS,
+            ))
+        batches.append((batch, None))
+    results = execute_concurrent(db, batches, concurrency=LOCATION_FLUSH_CONCURRENCY, raise_on_first_error=False)
+    failed = sum(1 for success, _ in results if not success)
+    if failed:
+        print(f"Failed to write {failed} of {len(batches)} courier location batches")
+    push_courier_positions({courier_id for courier_id, _ in partitions})
+
+def push_courier_positions(courier_ids):
+    # The order service keeps a spatial index of couriers for dispatch
+    positions = []
+    for courier_id in courier_ids:
+        position = location_store.latest(courier_id)
+        if position:
+            positions.append({
+                "delivery_person_id": str(courier_id),
+                "latitude": position.latitude,
+                "longitude": position.longitude,
+            })
+    try:
+        httpx.post(
+            f"{ORDER_SERVICE_URL}/internal/couriers/positions", json=positions, headers=INTERNAL_HEADERS, timeout=2
+        )
+    except httpx.HTTPError:
+        pass
+
+async def flush_locations_periodically():
+    while True:
+        await asyncio.sleep(LOCATION_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_locations, get_db_session())
+        except Exception as e:
+            print(f"Failed to flush courier locations: {str(e)}")
+
+@app.on_event("startup")
+async def start_location_flusher():
+    asyncio.create_task(flush_locations_periodically())
+
+@app.on_event("shutdown")
+async def stop_location_flusher():
+    await asyncio.to_thread(flush_locations, get_db_session())
+
+@app.post("/delivery-people/locations")
+async def report_delivery_people_locations(
+    data: CourierLocationsRequest,
+    user: str = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    allowed = reportable_couriers(db, UUID(user))
+    if allowed != ANY_COURIER:
+        for location in data.locations:
+            if location.delivery_person_id not in allowed:
+                raise HTTPException(
+                    status_code=403,
+                    detail=f"Not authorized to report the location of {location.delivery_person_id}",
+                )
+
+    now = datetime.utcnow()
+    accepted = 0
+    for location in data.locations:
+        recorded_at = location.recorded_at or now
+        if recorded_at.tzinfo is not None:
+            recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+        # Clock skew on phones must not push a position into the future
+        recorded_at = min(recorded_at, now)
+        if location_store.record(location.delivery_person_id, location.latitude, location.longitude, recorded_at):
+            accepted += 1
+    return {"message": "Locations received", "accepted": accepted, "outdated": len(data.locations) - accepted}
+
+@app.get("/delivery-people/{delivery_person_id}/location")
+async def get_delivery_person_location(
+    delivery_person_id: UUID,
+    user: str = Depends(get_current_user),
+    db=Depends(get_db_session),
+):
+    position = location_store.latest(delivery_person_id)
+    if position is None:
+        # Not reported to this process yet (e.g. after a restart); check the last two hours
+        bucket = hour_bucket(datetime.utcnow())
+        for hour in (bucket, bucket - timedelta(hours=1)):
+            position = db.execute(
+                """
+                SELECT latitude, longitude, recorded_at FROM courier_locations
+                WHERE delivery_person_id = %s AND bucket = %s LIMIT 1
+                """,
+                (delivery_person_id, hour),
+            ).one()
+            if position:
+                break
+    if not position:
+        raise HTTPException(status_code=404, detail="No recent location for this delivery person")
+    return {
+        "delivery_person_id": str(delivery_person_id),
+        "latitude": position.latitude,
+        "longitude": position.longitude,
+        "recorded_at": position.recorded_at,
+    }
+
+@app.get("/{restaurant_id}/delivery-people")
+async def get_restaurant_delivery_people(
+    restaurant_id: UUID,
+    user: User = Depends(verify_admin),
+    db=Depends(get_db_session),
+):
+    rows = db.execute(
+        "SELECT delivery_person_id, status, assigned_at, updated_at FROM couriers_by_restaurant WHERE restaurant_id = %s",
+        [restaurant_id],
+    ).all()
+    return rows
+
 @app.post("/items")
 async def add_items(
     data: str = Form(...),  # Accept `data` as a string from the form
@@ -318,6 +663,7 @@ async def add_items(
                 f"https://{BUCKET_NAME}.s3.amazonaws.com/menu-items/{item_id}.jpg",
             ),
         )
+    await bump_menu_version(db, restaurant_id)
     return {"message": "Items added successfully"}
 
 @app.get("/{restaurant_id}/items")
@@ -325,10 +671,17 @@ async def get_items(
     restaurant_id: UUID,  # This will be parsed from the URL path
     db=Depends(get_db_session),
 ):
-    rows = db.execute(
-        "SELECT * FROM items WHERE restaurant_id = %s ALLOW FILTERING", [restaurant_id]
-    ).all()
-    return rows
+    payload = menu_cache.get(restaurant_id)
+    if payload is None:
+        # Read the version first so a concurrent edit makes this load stale, not wrong
+        version = get_menu_version(db, restaurant_id)
+        rows = db.execute(
+            "SELECT * FROM items WHERE restaurant_id = %s ALLOW FILTERING", [restaurant_id]
+        ).all()
+        rows = [row for row in rows if row.deleted_at is None]
+        payload = json.dumps(jsonable_encoder(rows)).encode()
+        menu_cache.set(restaurant_id, version, payload)
+    return Response(content=payload, media_type="application/json")
 
 @app.put("/items")
 async def update_item(
@@ -366,9 +719,11 @@ async def update_item(
     if not updates:
         raise HTTPException(status_code=400, detail="No fields to update")
 
+    restaurant_id = get_item_restaurant_id(db, item_id)
     params.append(item_id)
     query = f"UPDATE items SET {', '.join(updates)} WHERE item_id = %s"
     db.execute(query, params)
+    await bump_menu_version(db, restaurant_id)
     return {"message": "Item updated successfully"}
 
 @app.delete("/items")
@@ -378,11 +733,13 @@ async def delete_item(
     db=Depends(get_db_session),
 ):
     item_id = data.item_id
+    restaurant_id = get_item_restaurant_id(db, item_id)
 
-    # Delete image from S3
-    s3.delete_object(Bucket=BUCKET_NAME, Key=f"menu-items/{item_id}.jpg")
-
-    db.execute("DELETE FROM items WHERE item_id = %s", [item_id])
+    # The row and its image are removed later by purge_deleted
+    deleted_at = datetime.utcnow()
+    db.execute("UPDATE items SET deleted_at = %s WHERE item_id = %s", [deleted_at, item_id])
+    queue_purge(db, "item", item_id, deleted_at)
+    await bump_menu_version(db, restaurant_id)
     return {"message": "Item deleted successfully"}
 
 
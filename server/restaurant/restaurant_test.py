@@ -0,0 +1,94 @@
+import unittest
+from collections import namedtuple
+from datetime import datetime
+from unittest.mock import Mock, patch
+from uuid import uuid4
+
+from fastapi import HTTPException
+
+import restaurant
+
+UserRow = namedtuple("UserRow", ["admin", "worker", "restaurant_id", "delivery_person_id"])
+CourierRow = namedtuple("CourierRow", ["delivery_person_id"])
+
+
+class FakeBatch:
+    def __init__(self, batch_type=None):
+        self.rows = []
+
+    def add(self, statement, parameters):
+        self.rows.append(parameters)
+
+
+class FlushLocationsTest(unittest.TestCase):
+    def setUp(self):
+        restaurant.location_store = restaurant.LocationStore()
+
+    @patch.object(restaurant, "push_courier_positions")
+    @patch.object(restaurant, "BatchStatement", FakeBatch)
+    def test_one_batch_per_courier_hour(self, push):
+        first, second = uuid4(), uuid4()
+        for courier, minute in ((first, 58), (first, 59), (second, 10)):
+            restaurant.location_store.record(courier, 42.0, 23.0, datetime(2025, 5, 1, 10, minute))
+        restaurant.location_store.record(first, 42.0, 23.0, datetime(2025, 5, 1, 11, 1))
+
+        with patch.object(restaurant, "execute_concurrent", return_value=[]) as execute:
+            restaurant.flush_locations(Mock())
+        batches = [batch for batch, _ in execute.call_args.args[1]]
+        self.assertEqual(sorted(len(batch.rows) for batch in batches), [1, 1, 2])
+        self.assertEqual({row[1] for batch in batches for row in batch.rows},
+                         {datetime(2025, 5, 1, 10), datetime(2025, 5, 1, 11)})
+        push.assert_called_once_with({first, second})
+
+        # Nothing left to write on the next tick
+        with patch.object(restaurant, "execute_concurrent") as execute:
+            restaurant.flush_locations(Mock())
+        execute.assert_not_called()
+
+
+class ReportLocationsTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        restaurant.location_reporters.clear()
+        restaurant.location_store = restaurant.LocationStore()
+        self.user = uuid4()
+        self.courier = uuid4()
+
+    def db_for(self, user_row, couriers=()):
+        db = Mock()
+        db.execute.side_effect = lambda query, params: (
+            Mock(one=Mock(return_value=user_row)) if "FROM customers" in query
+            else [CourierRow(courier) for courier in couriers]
+        )
+        return db
+
+    def report(self, db, courier):
+        data = restaurant.CourierLocationsRequest(
+            locations=[restaurant.CourierLocation(delivery_person_id=courier, latitude=42.0, longitude=23.0)]
+        )
+        return restaurant.report_delivery_people_locations(data, str(self.user), db)
+
+    async def test_courier_reports_only_their_own_location(self):
+        db = self.db_for(UserRow(0, 0, None, self.courier))
+        self.assertEqual((await self.report(db, self.courier))["accepted"], 1)
+        with self.assertRaises(HTTPException) as raised:
+            await self.report(db, uuid4())
+        self.assertEqual(raised.exception.status_code, 403)
+
+    async def test_customer_cannot_report(self):
+        with self.assertRaises(HTTPException):
+            await self.report(self.db_for(UserRow(0, 0, None, None)), self.courier)
+        self.assertIsNone(restaurant.location_store.latest(self.courier))
+
+    async def test_worker_reports_couriers_of_their_restaurant(self):
+        db = self.db_for(UserRow(0, 1, uuid4(), None), couriers=[self.courier])
+        self.assertEqual((await self.report(db, self.courier))["accepted"], 1)
+        with self.assertRaises(HTTPException):
+            await self.report(db, uuid4())
+
+    async def test_admin_reports_any_courier(self):
+        db = self.db_for(UserRow(1, 0, None, None))
+        self.assertEqual((await self.report(db, self.courier))["accepted"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()